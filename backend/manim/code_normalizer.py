@@ -0,0 +1,516 @@
+import io
+import os
+import re
+import ast
+import sys
+import time
+import argparse
+import tempfile
+import textwrap
+import tokenize
+
+# Injected into the scene class when boundary checks are requested
+SAFE_POSITION_METHOD = '''
+def safe_position(self, mobject, zone="MIDDLE", buff=0.5):
+    """Ensure mobject stays within screen boundaries."""
+    # Get frame boundaries (adjust if camera.frame_width was changed)
+    frame_width = getattr(self.camera, "frame_width", 14)
+    frame_height = getattr(self.camera, "frame_height", 8)
+    max_x = frame_width/2 - buff
+    max_y = frame_height/2 - buff
+
+    # Set position based on zone
+    if zone == "TOP":
+        mobject.to_edge(UP, buff=buff)
+        # Limit y position
+        if mobject.get_top()[1] > max_y:
+            mobject.shift(DOWN * (mobject.get_top()[1] - max_y))
+    elif zone == "BOTTOM":
+        mobject.to_edge(DOWN, buff=buff)
+        # Limit y position
+        if mobject.get_bottom()[1] < -max_y:
+            mobject.shift(UP * (-max_y - mobject.get_bottom()[1]))
+    else:  # MIDDLE zone or anything else
+        # Only adjust if outside boundaries
+        if mobject.get_center()[1] > max_y - mobject.height/2:
+            mobject.align_to(UP * (max_y - mobject.height/2), UP)
+        if mobject.get_center()[1] < -max_y + mobject.height/2:
+            mobject.align_to(DOWN * (max_y - mobject.height/2), DOWN)
+
+    # Check width and scale down if needed
+    if mobject.width > frame_width - 2*buff:
+        scale_factor = (frame_width - 2*buff) / mobject.width
+        mobject.scale(scale_factor)
+
+    # Check horizontal boundaries
+    if mobject.get_right()[0] > max_x:
+        mobject.shift(LEFT * (mobject.get_right()[0] - max_x))
+    if mobject.get_left()[0] < -max_x:
+        mobject.shift(RIGHT * (-max_x - mobject.get_left()[0]))
+
+    return mobject
+
+'''
+
+FRAME_SETTINGS = '''# Set frame dimensions for consistent boundaries
+self.camera.frame_width = 14
+self.camera.frame_height = 8
+
+'''
+
+TEXT_CLASSES = ("Text", "MathTex", "Tex")
+
+# Characters that show a line inside a function is code rather than prose
+_CODE_CHARS = "={}[](),.+-*/:'\"\\"
+_HEADER_LINE = re.compile(r'^[A-Z][^={}()\[\]]*$')
+# Left behind by broken regex replacements, e.g. "\1"
+_GROUP_REFERENCE = re.compile(r'\\[0-9]')
+
+
+def _is_scene(node):
+    """True for a class deriving from Scene, ThreeDScene, MovingCameraScene, ..."""
+    for base in node.bases:
+        name = base.id if isinstance(base, ast.Name) else getattr(base, "attr", "")
+        if name.endswith("Scene"):
+            return True
+    return False
+
+
+def _is_number(node):
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        node = node.operand
+    return isinstance(node, ast.Constant) and type(node.value) in (int, float)
+
+
+def _call_name(node):
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return ""
+
+
+class _Edits:
+    """Source edits collected during the traversal and applied in one pass.
+
+    Positions come from the AST, whose column offsets count UTF-8 bytes, so
+    they are converted to string offsets once per line.
+    """
+
+    def __init__(self, code):
+        self.code = code
+        self.lines = code.splitlines(keepends=True)
+        self.line_starts = [0]
+        for line in self.lines:
+            self.line_starts.append(self.line_starts[-1] + len(line))
+        self.edits = []
+
+    def offset(self, lineno, col):
+        if lineno > len(self.lines):
+            return len(self.code)
+        line = self.lines[lineno - 1]
+        return self.line_starts[lineno - 1] + len(line.encode("utf-8")[:col].decode("utf-8", "ignore"))
+
+    def line_start(self, lineno):
+        return self.line_starts[min(lineno, len(self.lines) + 1) - 1]
+
+    def line_end(self, lineno):
+        """Offset just past the newline ending line ``lineno``."""
+        return self.line_starts[min(lineno, len(self.lines))]
+
+    def replace(self, start, end, text):
+        self.edits.append((start, end, len(self.edits), text))
+
+    def insert(self, at, text):
+        self.replace(at, at, text)
+
+    def replace_node(self, node, text):
+        self.replace(self.offset(node.lineno, node.col_offset),
+                     self.offset(node.end_lineno, node.end_col_offset), text)
+
+    def insert_after(self, node, text):
+        self.insert(self.offset(node.end_lineno, node.end_col_offset), text)
+
+    def apply(self):
+        code = self.code
+        # Back to front, so earlier offsets stay valid; an edit overlapping
+        # one already applied is dropped
+        limit = len(code) + 1
+        for start, end, _, text in sorted(self.edits, key=lambda e: (e[0], e[2]), reverse=True):
+            if end > limit or (end == limit and start < end):
+                continue
+            code = code[:start] + text + code[end:]
+            limit = start
+        return code
+
+
+class _Normalizer(ast.NodeVisitor):
+    """One walk over the module that records every fix as a source edit."""
+
+    def __init__(self, edits, scene, rename_to=None, boundary_checks=False):
+        self.edits = edits
+        self.scene = scene
+        self.rename_from = scene.name if scene is not None and rename_to else None
+        self.rename_to = rename_to
+        self.boundary_checks = boundary_checks
+        self.fixes = []
+        self.manim_imports = []
+        self.uses_np = False
+        self.imports_np = False
+        self.text_vars = []
+        self.construct = None
+        self.has_safe_position = False
+        self.calls_safe_position = False
+        self.sets_frame = False
+        self._coord_loop_vars = []
+        self._in_scene = False
+
+    def visit_ImportFrom(self, node):
+        if (node.module or "").split(".")[0] == "manim":
+            self.manim_imports.append(node)
+
+    def visit_Import(self, node):
+        if any(alias.name == "numpy" and alias.asname == "np" for alias in node.names):
+            self.imports_np = True
+
+    def visit_Name(self, node):
+        if node.id == "np":
+            self.uses_np = True
+        elif self.rename_from and node.id == self.rename_from:
+            self.edits.replace_node(node, self.rename_to)
+
+    def visit_ClassDef(self, node):
+        if node is not self.scene:
+            self.generic_visit(node)
+            return
+        if self.rename_from:
+            start = self.edits.offset(node.lineno, node.col_offset)
+            match = re.compile(r'class\s+').match(self.edits.code, start)
+            name_start = match.end() if match else start + len("class ")
+            self.edits.replace(name_start, name_start + len(self.rename_from), self.rename_to)
+            self.fixes.append(f"Renamed class from {self.rename_from} to {self.rename_to}")
+        for item in node.body:
+            if isinstance(item, ast.FunctionDef) and item.name == "construct":
+                self.construct = item
+            elif isinstance(item, ast.FunctionDef) and item.name == "safe_position":
+                self.has_safe_position = True
+        self._in_scene = True
+        self.generic_visit(node)
+        self._in_scene = False
+
+    def visit_Assign(self, node):
+        target = node.targets[0] if len(node.targets) == 1 else None
+        if isinstance(target, ast.Name):
+            value = node.value
+            if target.id.endswith("_coords") and isinstance(value, ast.List):
+                flat = [elt for elt in value.elts if isinstance(elt, ast.Tuple)
+                        and len(elt.elts) == 2 and all(_is_number(e) for e in elt.elts)]
+                for elt in flat:
+                    self.edits.insert_after(elt.elts[1], ", 0")
+                if flat:
+                    self.fixes.append(f"Converted 2D coordinates in {target.id} to 3D")
+            elif isinstance(value, ast.Call) and _call_name(value) in TEXT_CLASSES:
+                if target.id not in self.text_vars:
+                    self.text_vars.append(target.id)
+        elif isinstance(target, ast.Attribute) and target.attr == "frame_width":
+            self.sets_frame = True
+        self.generic_visit(node)
+
+    def visit_For(self, node):
+        over_coords = (isinstance(node.target, ast.Name) and isinstance(node.iter, ast.Name)
+                       and node.iter.id.endswith("_coords"))
+        if over_coords:
+            self._coord_loop_vars.append(node.target.id)
+        self.generic_visit(node)
+        if over_coords:
+            self._coord_loop_vars.pop()
+
+    def visit_Call(self, node):
+        name = _call_name(node)
+        if name == "Dot" and node.args and isinstance(node.args[0], ast.Name) \
+                and node.args[0].id in self._coord_loop_vars:
+            point = node.args[0].id
+            self.edits.replace_node(node.args[0], f"np.array([{point}[0], {point}[1], 0])")
+            self.uses_np = True
+            self.fixes.append(f"Made Dot({point}) use 3D points")
+        elif name == "move_to" and len(node.args) == 1 and isinstance(node.args[0], ast.List) \
+                and len(node.args[0].elts) == 2:
+            self.edits.insert_after(node.args[0].elts[1], ", 0")
+            self.fixes.append(f"Added missing z-coordinate to move_to() on line {node.lineno}")
+        elif name == "safe_position" and self._in_scene:
+            self.calls_safe_position = True
+        self.generic_visit(node)
+
+    def finish(self, tree):
+        """Edits that depend on the whole traversal: imports and injected helpers."""
+        star = any(alias.name == "*" for node in self.manim_imports for alias in node.names)
+        import_end = 0
+        if not self.manim_imports:
+            self.edits.insert(0, "from manim import *\n\n")
+            self.fixes.append("Added 'from manim import *'")
+        else:
+            first = self.manim_imports[0]
+            import_end = self.edits.line_end(first.end_lineno)
+            if not star:
+                self.edits.replace_node(first, "from manim import *")
+                self.fixes.append("Fixed incomplete import statement")
+        if self.uses_np and not self.imports_np:
+            self.edits.insert(import_end, "import numpy as np\n")
+            self.fixes.append("Added numpy import")
+
+        construct = self.construct
+        if not self.boundary_checks or construct is None or construct.body[0].lineno == construct.lineno:
+            return
+        method_indent = " " * construct.col_offset
+        body_indent = " " * construct.body[0].col_offset
+        if not self.has_safe_position:
+            first_line = min([construct.lineno] + [d.lineno for d in construct.decorator_list])
+            self.edits.insert(self.edits.line_start(first_line),
+                              textwrap.indent(SAFE_POSITION_METHOD.lstrip("\n"), method_indent,
+                                              lambda line: line.strip()))
+            self.fixes.append("Added safe_position utility function")
+        if not self.sets_frame:
+            self.edits.insert(self.edits.line_start(construct.body[0].lineno),
+                              textwrap.indent(FRAME_SETTINGS, body_indent, lambda line: line.strip()))
+            self.fixes.append("Set camera frame dimensions")
+        if self.text_vars and not self.calls_safe_position:
+            lines = ["", "# Ensure all text elements stay within screen boundaries"]
+            for var_name in self.text_vars:
+                lower = var_name.lower()
+                zone = "TOP" if "title" in lower else \
+                    "BOTTOM" if any(x in lower for x in ["explain", "description", "summary"]) else "MIDDLE"
+                lines += [f"# Safe position for {var_name}",
+                          f"if '{var_name}' in locals():",
+                          f"    self.safe_position({var_name}, zone=\"{zone}\", buff=0.5)"]
+            for var_name in self.text_vars:
+                lines += ["",
+                          f"# Add background for better visibility for {var_name}",
+                          f"if '{var_name}' in locals() and '{var_name}_bg' not in locals():",
+                          f"    {var_name}_bg = SurroundingRectangle({var_name}, fill_opacity=0.85, "
+                          f"fill_color=BLACK, buff=0.15)",
+                          f"    {var_name}_group = VGroup({var_name}_bg, {var_name})"]
+            last = construct.body[-1]
+            self.edits.insert(self.edits.line_end(last.end_lineno),
+                              "".join((body_indent + line if line else "") + "\n" for line in lines))
+            self.fixes.append(f"Added boundary checks for {len(self.text_vars)} text object(s)")
+
+
+def _comment_prose(code, fixes):
+    """Comment out descriptive text lines the model left in the code."""
+    lines = code.split("\n")
+    in_function_def = False
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.startswith("def "):
+            in_function_def = True
+        looks_like_prose = (in_function_def and not any(char in stripped for char in _CODE_CHARS)) \
+            or _HEADER_LINE.match(stripped)
+        if not looks_like_prose:
+            continue
+        try:
+            compile(stripped, "<string>", "single")
+            continue
+        except SyntaxError:
+            pass
+        lines[i] = line[:len(line) - len(line.lstrip())] + "# " + stripped
+        fixes.append(f"Line {i+1}: Commented text '{stripped}'")
+    return "\n".join(lines)
+
+
+def _token_fixes(code, fixes):
+    """Import and move_to fixes for code that does not parse, from its tokens."""
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            tokens.append(token)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Use the tokens read before the error
+        pass
+    edits = _Edits(code)
+
+    def at(row, col):
+        return edits.line_starts[row - 1] + col
+
+    has_import = False
+    for i, token in enumerate(tokens):
+        if token.type != tokenize.NAME:
+            continue
+        if token.string == "from" and i + 2 < len(tokens) and tokens[i + 1].string == "manim" \
+                and tokens[i + 2].string == "import":
+            has_import = True
+            end = i + 3
+            while end < len(tokens) and tokens[end].type not in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                end += 1
+            if i + 3 < len(tokens) and tokens[i + 3].string != "*":
+                edits.replace(at(*tokens[i + 3].start), at(*tokens[end - 1].end), "*")
+                fixes.append("Fixed incomplete import statement")
+        elif token.string == "move_to" and i + 2 < len(tokens) and tokens[i + 1].string == "(" \
+                and tokens[i + 2].string == "[":
+            depth, commas, last = 0, 0, None
+            for j in range(i + 2, len(tokens)):
+                if tokens[j].type == tokenize.OP and tokens[j].string in "([{":
+                    depth += 1
+                elif tokens[j].type == tokenize.OP and tokens[j].string in ")]}":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif tokens[j].string == "," and depth == 1:
+                    commas += 1
+                if tokens[j].type not in (tokenize.COMMENT, tokenize.NL):
+                    last = tokens[j]
+            else:
+                continue
+            # Two elements: [x, y] or [x, y,] (e.g. with the z-coordinate commented out)
+            if commas == 1 and last.string != ",":
+                edits.insert(at(*last.end), ", 0")
+            elif commas == 2 and last.string == ",":
+                edits.insert(at(*last.end), " 0")
+            else:
+                continue
+            fixes.append(f"Added missing z-coordinate to move_to() on line {token.start[0]}")
+    if not has_import:
+        edits.insert(0, "from manim import *\n\n")
+        fixes.append("Added 'from manim import *'")
+    return edits.apply()
+
+
+def normalize_code(code, class_name=None, boundary_checks=False):
+    """Apply every fix for generated Manim code in one pass over its syntax tree.
+
+    Replaces the chains of regex substitutions the pipelines ran one after the
+    other. The code is parsed once, a single traversal records each fix as an
+    edit of the original source (so comments and formatting survive) and the
+    edits are applied together:
+
+    - ``from manim import *`` is added or completed, ``import numpy as np``
+      added when numpy is used
+    - 2D point tuples in ``*_coords`` lists and 2D ``move_to([x, y])`` calls
+      get a z-coordinate, ``Dot(p)`` over such a list gets a 3D point
+    - the scene class is renamed to ``class_name``
+    - with ``boundary_checks``, the safe_position helper, the camera frame
+      settings and the text safety block are injected unless already present
+
+    Code that does not parse has its descriptive text lines commented out and
+    stray regex group references (``\\1``) removed first; if it still does not
+    parse, the import and move_to fixes are made from its tokens instead.
+
+    Args:
+        code: Generated Manim code
+        class_name: Name the scene class must have (optional)
+        boundary_checks: Also inject the boundary helpers (see above)
+
+    Returns:
+        Tuple (code, report); report is a dict with the "fixes" applied, the
+        critical "issues" left (missing scene class or construct method) and
+        whether the code "parsed"
+    """
+    fixes = []
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        code = _comment_prose(code, fixes)
+        if _GROUP_REFERENCE.search(code):
+            code = _GROUP_REFERENCE.sub("", code)
+            fixes.append("Removed invalid escape sequences")
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            tree = None
+
+    if tree is None:
+        code = _token_fixes(code, fixes)
+        old_class = re.search(r'class\s+(\w+)\s*\(\s*\w*Scene\s*\)', code)
+        if class_name and old_class and old_class.group(1) != class_name \
+                and not re.search(rf'class\s+{class_name}\b', code):
+            code = code[:old_class.start(1)] + class_name + code[old_class.end(1):]
+            fixes.append(f"Renamed class from {old_class.group(1)} to {class_name}")
+        issues = []
+        if not re.search(r'class\s+\w+\s*\(\s*\w*Scene\s*\)', code):
+            issues.append("Missing Scene class definition")
+        if not re.search(r'def\s+construct\s*\(\s*self\s*\)', code):
+            issues.append("Missing construct method")
+        return code, {"fixes": fixes, "issues": issues, "parsed": False}
+
+    scenes = [node for node in tree.body if isinstance(node, ast.ClassDef) and _is_scene(node)]
+    scene = next((node for node in scenes if node.name == class_name), None)
+    rename_to = None
+    if scene is None and scenes:
+        scene = scenes[0]
+        rename_to = class_name
+    normalizer = _Normalizer(_Edits(code), scene, rename_to, boundary_checks)
+    normalizer.visit(tree)
+    normalizer.finish(tree)
+
+    issues = []
+    if scene is None:
+        issues.append("Missing Scene class definition")
+    elif normalizer.construct is None:
+        issues.append("Missing construct method")
+    return normalizer.edits.apply(), {"fixes": fixes + normalizer.fixes, "issues": issues, "parsed": True}
+
+
+def write_code(path, code):
+    """Write a code file atomically, so manim never sees a half-written scene."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(code)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def benchmark(code_dir, repeat=20):
+    """Time normalize_code on every scene file under code_dir.
+
+    Returns:
+        List of dicts with the file, milliseconds per run, fixes and whether
+        the normalized code still parses
+    """
+    results = []
+    for root, dirs, files in os.walk(code_dir):
+        dirs[:] = [d for d in dirs if d not in ("media", "__pycache__")]
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'r') as f:
+                code = f.read()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                fixed, report = normalize_code(code, boundary_checks=True)
+            elapsed = (time.perf_counter() - started) / repeat
+            try:
+                ast.parse(fixed)
+                parses = True
+            except SyntaxError:
+                parses = False
+            results.append({"file": os.path.relpath(path, code_dir), "ms": elapsed * 1000,
+                            "fixes": len(report["fixes"]), "parses": parses})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the code normalizer on stored scenes")
+    parser.add_argument("--code-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            "content", "code_dir"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    results = benchmark(args.code_dir, args.repeat)
+    for result in results:
+        print(f"{result['file']:<45} {result['ms']:8.2f} ms  {result['fixes']:2d} fixes"
+              f"{'' if result['parses'] else '  ❌ does not parse'}")
+    total = sum(result["ms"] for result in results)
+    print(f"✓ {len(results)} files, {total:.1f} ms total, {total / max(len(results), 1):.2f} ms per file")
+    return 0 if all(result["parses"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import ast
+
+
+def _base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return ""
+
+
+def preflight_check(code, class_name=None):
+    """Fast static check that generated code can be handed to manim.
+
+    Parses the code instead of rendering it, so a broken candidate is rejected
+    in milliseconds rather than after a manim run.
+
+    Args:
+        code: Generated Manim code
+        class_name: Scene class the code must define (optional)
+
+    Returns:
+        Tuple (ok, message) where message explains the first problem found
+    """
+    if not code or not code.strip():
+        return False, "Empty code"
+
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return False, f"Syntax error on line {e.lineno}: {e.msg}"
+
+    imports_manim = any(
+        isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] == "manim"
+        for node in tree.body
+    )
+    if not imports_manim:
+        return False, "Missing 'from manim import ...'"
+
+    scenes = [
+        node for node in tree.body
+        if isinstance(node, ast.ClassDef)
+        and any(_base_name(base).endswith("Scene") for base in node.bases)
+    ]
+    if not scenes:
+        return False, "No Scene subclass defined"
+    if class_name and class_name not in [scene.name for scene in scenes]:
+        return False, f"Scene class '{class_name}' not found"
+
+    for scene in scenes:
+        if class_name and scene.name != class_name:
+            continue
+        has_construct = any(
+            isinstance(item, ast.FunctionDef) and item.name == "construct" for item in scene.body
+        )
+        if not has_construct:
+            return False, f"Scene class '{scene.name}' has no construct method"
+
+    return True, "ok"
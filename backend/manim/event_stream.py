@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import time
+import threading
+
+# Streamed partial responses arrive many times a second and are not useful as events
+SKIPPED_EVENTS = ("llm_partial",)
+
+
+class EventStream:
+    """Typed progress events written as JSON lines on a dedicated channel.
+
+    Every line is one event object with its type and a timestamp, e.g.
+    ``{"event": "stage_finished", "time": 1718000000.1, "stage": "render", "seconds": 41.2}``.
+    The pipelines emit ``stage_started``, ``stage_finished``, ``stage_failed``,
+    ``llm_usage``, ``render_progress`` and a final ``result`` event, so a parent
+    process reads a few small lines instead of scanning the human-readable log.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **data):
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **data}, default=str)
+        # Stages and hedged requests emit from several threads; keep lines whole
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def listener(self, payload):
+        """Progress listener forwarding ManimGenerator events to the stream."""
+        if payload["event"] not in SKIPPED_EVENTS:
+            self.emit(**payload)
+
+
+def start_machine_mode(quiet=False):
+    """Reserve stdout for JSON-line events and move the human-readable logs.
+
+    Logs go to stderr, or nowhere when ``quiet`` is set; errors printed to
+    stderr (e.g. tracebacks) still show up.
+
+    Returns:
+        EventStream writing to the original stdout
+    """
+    events = EventStream(sys.stdout)
+    sys.stdout = open(os.devnull, "w") if quiet else sys.stderr
+    return events
@@ -0,0 +1,102 @@
+import re
+
+FEEDBACK_EDIT_PROMPT = """A viewer gave feedback on a Manim animation about "{topic}".
+
+Feedback:
+{feedback}
+
+Animation plan the scene was built from:
+{plan}
+
+Current scene code ({file_name}):
+
+```python
+{code}
+```
+
+Change the scene to address the feedback. Keep everything the feedback does not mention
+exactly as it is, so the unchanged animations can be reused from the render cache, and do
+not rename the scene class.
+
+Answer in two parts:
+1. The changes to the plan, one per line, between <PLAN_CHANGES> and </PLAN_CHANGES>.
+2. One or more edit blocks, each replacing an excerpt copied exactly from the current code:
+
+<<<<<<< SEARCH
+lines from the current code
+=======
+replacement lines
+>>>>>>> REPLACE"""
+
+_EDIT_BLOCK = re.compile(
+    r"<<<<<<< SEARCH\n(.*?)\n?=======\n(.*?)\n?>>>>>>> REPLACE", re.DOTALL
+)
+_PLAN_CHANGES = re.compile(r"<PLAN_CHANGES>(.*?)</PLAN_CHANGES>", re.DOTALL)
+
+# manim's log lines for an animation served from, or added to, the partial movie cache
+_CACHED_ANIMATION = re.compile(r"Animation \d+ ?: Using cached data")
+_RENDERED_ANIMATION = re.compile(r"Animation \d+ ?: Partial movie file written")
+
+
+def build_feedback_prompt(topic, plan, code, feedback, file_name):
+    """Prompt asking for a targeted edit of the stored scene instead of a new plan."""
+    return FEEDBACK_EDIT_PROMPT.format(topic=topic, feedback=feedback.strip(),
+                                       plan=plan.strip() or "(not stored)",
+                                       code=code, file_name=file_name)
+
+
+def parse_plan_changes(response):
+    """The plan changes listed in a feedback edit response, or an empty string."""
+    match = _PLAN_CHANGES.search(response or "")
+    return match.group(1).strip() if match else ""
+
+
+def _find_excerpt(code, excerpt):
+    """Position of ``excerpt`` in ``code``, tolerating trailing whitespace differences."""
+    start = code.find(excerpt)
+    if start != -1:
+        return start, start + len(excerpt)
+    lines = code.split("\n")
+    wanted = [line.rstrip() for line in excerpt.split("\n")]
+    for index in range(len(lines) - len(wanted) + 1):
+        if [line.rstrip() for line in lines[index:index + len(wanted)]] == wanted:
+            start = sum(len(line) + 1 for line in lines[:index])
+            end = start + sum(len(line) + 1 for line in lines[index:index + len(wanted)]) - 1
+            return start, end
+    return -1, -1
+
+
+def apply_edits(code, response):
+    """Apply the edit blocks of a feedback edit response to the code.
+
+    A response without edit blocks but with a ```python block is taken as
+    the complete new file.
+
+    Returns:
+        Tuple (new code, number of edits applied)
+
+    Raises:
+        ValueError: The response holds no edits, or an excerpt is not in the code
+    """
+    blocks = _EDIT_BLOCK.findall(response or "")
+    if not blocks:
+        files = re.findall(r"```(?:python)?\s*\n(.*?)```", response or "", re.DOTALL)
+        if not files:
+            raise ValueError("The response holds no edit blocks")
+        return files[-1].rstrip("\n") + "\n", 1
+    for search, replace in blocks:
+        start, end = _find_excerpt(code, search)
+        if start == -1:
+            first_line = search.strip().split("\n")[0]
+            raise ValueError(f"Edit excerpt not found in the code: {first_line[:80]!r}")
+        code = code[:start] + replace + code[end:]
+    return code, len(blocks)
+
+
+def render_cache_stats(output):
+    """Count animations manim reused from its cache and animations it rendered.
+
+    Returns:
+        Tuple (cached, rendered)
+    """
+    return len(_CACHED_ANIMATION.findall(output)), len(_RENDERED_ANIMATION.findall(output))
@@ -1,12 +1,17 @@
 import os
-import subprocess
 import re
 import shutil
-from setup import ManimGenerator
+from setup import ManimGenerator, AsyncManimGenerator
 from prompts_exercise import process_math_visualization_request
+from render_repair import render_with_repairs, save_render_report
+from manim_process import run_manim, count_animations
+from job_deadline import JobCancelled
+from code_preflight import preflight_check
+from feedback_edit import build_feedback_prompt, apply_edits, parse_plan_changes, render_cache_stats
 
 class VideoGenerator:
-    def __init__(self, api_key):
+    def __init__(self, api_key, use_cache=None, refresh_cache=None, async_llm=False, max_in_flight=4,
+                 stream_code=None, llm_backend=None, code_candidates=None, render_repairs=None):
         # Create directories in the user's home directory
         curr_dir = os.path.dirname(os.path.abspath(__file__))
         self.code_dir = os.path.join(curr_dir, "content", "code_dir")
@@ -16,13 +21,39 @@ class VideoGenerator:
         os.makedirs(self.code_dir, exist_ok=True)
         os.makedirs(self.videos_dir, exist_ok=True)
         
+        # Render failures get this many targeted code repairs (None: MANIM_RENDER_REPAIRS or 2)
+        self.render_repairs = render_repairs
+        self.last_render_report = None
+        
         # Initialize generator with API key
-        self.generator = ManimGenerator(api_key=api_key)
+        if async_llm:
+            self.generator = AsyncManimGenerator(
+                api_key=api_key,
+                max_in_flight=max_in_flight,
+                use_cache=use_cache,
+                refresh_cache=refresh_cache,
+                stream_code=stream_code,
+                backend=llm_backend,
+                code_candidates=code_candidates
+            )
+        else:
+            self.generator = ManimGenerator(
+                api_key=api_key,
+                use_cache=use_cache,
+                refresh_cache=refresh_cache,
+                stream_code=stream_code,
+                backend=llm_backend,
+                code_candidates=code_candidates
+            )
     
     def _get_safe_filename(self, math_topic):
         """Convert math topic to a safe filename"""
         return math_topic.lower().replace(' ', '_').replace('/', '_').replace('\\', '_').replace(':', '_')
         
+    def _send_repair_prompt(self, prompt):
+        """Send one render repair prompt through the shared generator"""
+        return self.generator._send_prompt(prompt, stage="render_repair")
+
     def _extract_class_name(self, code):
         """Extract the class name from the generated code"""
         class_match = re.search(r'class\s+(\w+)\s*\(Scene\)', code)
@@ -30,8 +61,139 @@ class VideoGenerator:
             return class_match.group(1)
         return "MathAnimation"  # Default class name
         
+    def _find_rendered_video(self, stdout, filepath):
+        """Path of the video manim just rendered from filepath, or None"""
+        match = re.search(r"File ready at '(.*?)'", stdout)
+        if match:
+            # Relative paths are relative to the code directory manim ran in
+            return os.path.join(self.code_dir, match.group(1))
+        
+        # Look in the media directory for the most recent mp4 file
+        media_videos_dir = os.path.join(self.code_dir, "media", "videos",
+                                        os.path.basename(filepath).replace('.py', ''), "480p15")
+        if not os.path.exists(media_videos_dir):
+            print(f"Media videos directory not found: {media_videos_dir}")
+            return None
+        mp4_files = [f for f in os.listdir(media_videos_dir) if f.endswith('.mp4')]
+        if not mp4_files:
+            print("No MP4 files found in the media directory.")
+            return None
+        # Sort by creation time, newest first
+        mp4_files.sort(key=lambda x: os.path.getctime(os.path.join(media_videos_dir, x)), reverse=True)
+        return os.path.join(media_videos_dir, mp4_files[0])
+    
+    def _stored_paths(self, math_topic):
+        """Code file and artifacts directory of the topic's last generated animation"""
+        safe_topic = self._get_safe_filename(math_topic)
+        return (os.path.join(self.code_dir, f"generated_{safe_topic}.py"),
+                os.path.join(self.videos_dir, f"{safe_topic}_artifacts"))
+    
+    def has_stored_animation(self, math_topic):
+        """True if the topic was generated before, so feedback can edit it"""
+        filepath, artifacts_dir = self._stored_paths(math_topic)
+        return os.path.exists(filepath) and os.path.isdir(artifacts_dir)
+    
+    def regenerate_with_feedback(self, math_topic, user_feedback):
+        """Apply viewer feedback to the stored animation with one targeted edit
+        
+        The stored plan and code are sent with the feedback in a single prompt
+        asking for edit blocks, not a new plan. The edited file is rendered in
+        place, so manim reuses the cached partial movies of every animation the
+        edit did not change and only renders the changed ones.
+        
+        Args:
+            math_topic: Topic of an animation generated before (see has_stored_animation)
+            user_feedback: Feedback text
+            
+        Returns:
+            Path of the new video, or False if the edit or the render failed
+        """
+        filepath, artifacts_dir = self._stored_paths(math_topic)
+        safe_topic = self._get_safe_filename(math_topic)
+        with open(filepath, 'r') as f:
+            original_code = f.read()
+        plan = ""
+        for name in ("02_animation_design.txt", "03_design_testing.txt"):
+            path = os.path.join(artifacts_dir, name)
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    plan += f.read() + "\n\n"
+        
+        print(f"Editing the stored animation of '{math_topic}' to address the feedback...")
+        response = self.generator._send_prompt(
+            build_feedback_prompt(math_topic, plan, original_code, user_feedback,
+                                  os.path.basename(filepath)),
+            stage="feedback_edit"
+        )
+        if not response:
+            print("❌ Feedback edit request failed")
+            return False
+        try:
+            code, edits = apply_edits(original_code, response)
+        except ValueError as e:
+            print(f"❌ Could not apply the feedback edit: {e}")
+            return False
+        class_name = self._extract_class_name(code)
+        ok, message = preflight_check(code, class_name)
+        if not ok:
+            print(f"❌ Edited code rejected by pre-flight check: {message}")
+            return False
+        print(f"✓ Applied {edits} edit(s)")
+        
+        with open(filepath, 'w') as f:
+            f.write(code)
+        
+        def render():
+            return run_manim(
+                ['manim', '-ql', filepath, class_name],
+                cwd=self.code_dir,
+                animations=count_animations(code),
+                deadline=self.generator.job_deadline
+            )
+        
+        result, self.last_render_report = render_with_repairs(
+            render, filepath, class_name, self._send_repair_prompt, self.render_repairs
+        )
+        save_render_report(self.last_render_report, os.path.join(
+            self.videos_dir, f"{safe_topic}_render_report.json"
+        ))
+        source_path = self._find_rendered_video(result.stdout, filepath) if result.returncode == 0 else None
+        if source_path is None:
+            print(f"❌ Edited animation failed to render: {result.stderr[-1000:]}")
+            # Keep the stored code in line with the stored video
+            with open(filepath, 'w') as f:
+                f.write(original_code)
+            return False
+        cached, rendered = render_cache_stats(result.stdout + result.stderr)
+        print(f"✓ Rendered {rendered} changed animation(s), reused {cached} from the render cache")
+        
+        target_path = os.path.join(self.videos_dir, f"{safe_topic}_animation.mp4")
+        shutil.copy2(source_path, target_path)
+        print(f"Animation saved to {target_path}")
+        self.code_path = filepath
+        self.video_path = target_path
+        
+        with open(filepath, 'r') as f:
+            code = f.read()
+        with open(os.path.join(artifacts_dir, "04_code.py"), 'w') as f:
+            f.write(code)
+        revision = len([name for name in os.listdir(artifacts_dir) if name.startswith("05_feedback")]) + 1
+        with open(os.path.join(artifacts_dir, f"05_feedback_{revision}.txt"), 'w') as f:
+            f.write(f"Feedback:\n{user_feedback.strip()}\n\n"
+                    f"Plan changes:\n{parse_plan_changes(response) or '(none listed)'}\n\n"
+                    f"Edits: {edits}, animations rendered: {rendered}, reused from cache: {cached}\n")
+        print(f"Feedback revision {revision} saved to {artifacts_dir}")
+        return target_path
+    
     def generate_video(self, math_topic, audience_level="high school", user_feedback=None):
-        """Generate a Manim animation video for the given math topic using the complete workflow"""
+        """Generate a Manim animation video for the given math topic using the complete workflow
+        
+        With user_feedback on a topic generated before, the stored animation is
+        edited and re-rendered incrementally instead (see regenerate_with_feedback).
+        """
+        if user_feedback and self.has_stored_animation(math_topic):
+            return self.regenerate_with_feedback(math_topic, user_feedback)
+        
         print(f"Starting complete workflow for topic: {math_topic}")
         
         # Step 1: Analyze the concept
@@ -131,45 +293,37 @@ class VideoGenerator:
             temp_media_dir = os.path.join(self.code_dir, "media")
             os.makedirs(temp_media_dir, exist_ok=True)
             
-            # Change to the code directory to run manim
-            original_dir = os.getcwd()
-            os.chdir(self.code_dir)
+            # Run Manim in the code directory with low quality for speed (-ql);
+            # the render is killed if the job is cancelled or runs out of time
+            def render():
+                # A repair may have rewritten the file since the last attempt
+                with open(filepath, 'r') as f:
+                    animations = count_animations(f.read())
+                return run_manim(
+                    ['manim', '-ql', filepath, class_name],
+                    cwd=self.code_dir,
+                    animations=animations,
+                    deadline=self.generator.job_deadline
+                )
             
-            # Run Manim with low quality for speed (-ql) and preview (-p)
-            result = subprocess.run(
-                ['manim', '-ql', filepath, class_name],
-                capture_output=True, 
-                text=True
+            # Failed renders are patched and rendered again instead of failing the job
+            result, self.last_render_report = render_with_repairs(
+                render, filepath, class_name, self._send_repair_prompt, self.render_repairs
             )
+            save_render_report(self.last_render_report, os.path.join(
+                self.videos_dir, f"{safe_topic}_render_report.json"
+            ))
+            if self.last_render_report["outcome"] == "repaired":
+                with open(filepath, 'r') as f:
+                    code = f.read()
             
             if result.returncode != 0:
                 print(f"Manim error: {result.stderr}")
-                os.chdir(original_dir)
                 return False
                 
-            # Find the generated video file
-            video_pattern = r"File ready at '(.*?)'"
-            match = re.search(video_pattern, result.stdout)
-            
-            if not match:
-                # Look in the media directory for the most recent mp4 file
-                media_videos_dir = os.path.join(temp_media_dir, "videos", os.path.basename(filepath).replace('.py', ''), "480p15")
-                if os.path.exists(media_videos_dir):
-                    mp4_files = [f for f in os.listdir(media_videos_dir) if f.endswith('.mp4')]
-                    if mp4_files:
-                        # Sort by creation time, newest first
-                        mp4_files.sort(key=lambda x: os.path.getctime(os.path.join(media_videos_dir, x)), reverse=True)
-                        source_path = os.path.join(media_videos_dir, mp4_files[0])
-                    else:
-                        print("No MP4 files found in the media directory.")
-                        os.chdir(original_dir)
-                        return False
-                else:
-                    print(f"Media videos directory not found: {media_videos_dir}")
-                    os.chdir(original_dir)
-                    return False
-            else:
-                source_path = match.group(1)
+            source_path = self._find_rendered_video(result.stdout, filepath)
+            if source_path is None:
+                return False
             
             # Copy the video to the videos directory with a descriptive name
             target_filename = f"{safe_topic}_animation.mp4"
@@ -204,14 +358,10 @@ class VideoGenerator:
                 
             print(f"Workflow artifacts saved to {artifacts_dir}")
             
-            # Change back to original directory
-            os.chdir(original_dir)
-            
             return target_path
             
+        except JobCancelled:
+            raise
         except Exception as e:
             print(f"Error running Manim: {e}")
-            # Make sure we return to the original directory
-            if 'original_dir' in locals():
-                os.chdir(original_dir)
             return False
\ No newline at end of file
@@ -1,12 +1,15 @@
 import os
-import subprocess
 import re
 import shutil
-from setup import ManimGenerator
+from setup import ManimGenerator, AsyncManimGenerator
 from prompts_exercise import process_math_visualization_request
+from render_repair import render_with_repairs, save_render_report
+from manim_process import run_manim, count_animations
+from job_deadline import JobCancelled
 
 class VideoGenerator:
-    def __init__(self, api_key):
+    def __init__(self, api_key, use_cache=None, refresh_cache=None, async_llm=False, max_in_flight=4,
+                 stream_code=None, llm_backend=None, code_candidates=None, render_repairs=None):
         # Create directories in the user's home directory
         curr_dir = os.path.dirname(os.path.abspath(__file__))
         self.code_dir = os.path.join(curr_dir, "content", "code_dir")
@@ -16,8 +19,30 @@ class VideoGenerator:
         os.makedirs(self.code_dir, exist_ok=True)
         os.makedirs(self.videos_dir, exist_ok=True)
         
+        # Render failures get this many targeted code repairs (None: MANIM_RENDER_REPAIRS or 2)
+        self.render_repairs = render_repairs
+        self.last_render_report = None
+        
         # Initialize generator with API key
-        self.generator = ManimGenerator(api_key=api_key)
+        if async_llm:
+            self.generator = AsyncManimGenerator(
+                api_key=api_key,
+                max_in_flight=max_in_flight,
+                use_cache=use_cache,
+                refresh_cache=refresh_cache,
+                stream_code=stream_code,
+                backend=llm_backend,
+                code_candidates=code_candidates
+            )
+        else:
+            self.generator = ManimGenerator(
+                api_key=api_key,
+                use_cache=use_cache,
+                refresh_cache=refresh_cache,
+                stream_code=stream_code,
+                backend=llm_backend,
+                code_candidates=code_candidates
+            )
     
     def _get_safe_filename(self, math_topic):
         """Convert math topic to a safe filename"""
@@ -30,10 +55,15 @@ class VideoGenerator:
             return class_match.group(1)
         return "MathAnimation"  # Default class name
 
+    def _send_repair_prompt(self, prompt):
+        """Send one render repair prompt through the shared generator"""
+        return self.generator._send_prompt(prompt, stage="render_repair")
+
     def generate_video_from_code(self, code_path, topic):
         """Generate a video from an existing code file"""
         try:
             # Extract the class name from the code file
+            code_path = os.path.abspath(code_path)
             with open(code_path, 'r') as f:
                 code = f.read()
             class_name = self._extract_class_name(code)
@@ -42,22 +72,35 @@ class VideoGenerator:
             temp_media_dir = os.path.join(self.code_dir, "media")
             os.makedirs(temp_media_dir, exist_ok=True)
             
-            # Change to the code directory to run manim
-            original_dir = os.getcwd()
-            os.chdir(self.code_dir)
-            
             print(f"Running Manim animation...")
             
-            # Run Manim with low quality for speed (-ql)
-            result = subprocess.run(
-                ['manim', '-ql', code_path, class_name],
-                capture_output=True,
-                text=True
+            # Run Manim with low quality for speed (-ql) from the code directory. Passing
+            # cwd instead of changing the process directory lets several renders run at once.
+            def report_progress(percent, animation):
+                self.generator.emit_progress("render_progress", stage="render",
+                                             percent=percent, animation=animation)
+
+            def render():
+                with open(code_path, 'r') as f:
+                    animations = count_animations(f.read())
+                return run_manim(
+                    ['manim', '-ql', code_path, class_name],
+                    cwd=self.code_dir,
+                    animations=animations,
+                    on_progress=report_progress,
+                    deadline=self.generator.job_deadline
+                )
+            
+            # Failed renders are patched and rendered again instead of failing the job
+            result, self.last_render_report = render_with_repairs(
+                render, code_path, class_name, self._send_repair_prompt, self.render_repairs
             )
+            save_render_report(self.last_render_report, os.path.join(
+                self.videos_dir, os.path.basename(code_path).replace('.py', '_render_report.json')
+            ))
             
             if result.returncode != 0:
                 print(f"Manim error: {result.stderr}")
-                os.chdir(original_dir)
                 return False
                 
             # Find the generated video file
@@ -65,7 +108,8 @@ class VideoGenerator:
             match = re.search(video_pattern, result.stdout)
             
             if match:
-                source_path = match.group(1)
+                # Relative paths are relative to the code directory manim ran in
+                source_path = os.path.join(self.code_dir, match.group(1))
             else:
                 # Look in media directory for the most recent mp4
                 media_videos_dir = os.path.join(temp_media_dir, "videos", 
@@ -78,11 +122,9 @@ class VideoGenerator:
                         source_path = os.path.join(media_videos_dir, mp4_files[0])
                     else:
                         print("No MP4 files found")
-                        os.chdir(original_dir)
                         return False
                 else:
                     print(f"Media directory not found: {media_videos_dir}")
-                    os.chdir(original_dir)
                     return False
             
             # Copy to videos directory with a descriptive name
@@ -93,15 +135,12 @@ class VideoGenerator:
             shutil.copy2(source_path, target_path)
             print(f"Animation saved to {target_path}")
             
-            # Change back to original directory
-            os.chdir(original_dir)
-            
             return target_path
             
+        except JobCancelled:
+            raise
         except Exception as e:
             print(f"Error generating video: {e}")
-            if 'original_dir' in locals():
-                os.chdir(original_dir)
             return False
 
     def generate_video(self, math_topic, audience_level="high school", user_feedback=None):
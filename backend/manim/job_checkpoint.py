@@ -0,0 +1,128 @@
+import os
+import re
+import json
+import time
+import uuid
+import tempfile
+
+DEFAULT_JOBS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "content", "jobs"
+)
+
+
+def new_job_id(topic):
+    """Readable, unique job id such as ``eigenvalues-20250301-141503-3fa2``."""
+    slug = re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-")[:40] or "job"
+    return f"{slug}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:4]}"
+
+
+class JobCheckpoint:
+    """Per-job directory holding the output of every finished stage.
+
+    Each stage output is written to ``<jobs_dir>/<job_id>/<stage>.json`` the
+    moment the stage completes, next to a ``job.json`` manifest with the job
+    parameters and the list of completed stages. Resuming a job loads the
+    saved outputs, so only the stages that never finished run again.
+    """
+
+    def __init__(self, job_id, jobs_dir=None):
+        self.job_id = job_id
+        self.jobs_dir = jobs_dir or os.getenv("MANIM_JOBS_DIR") or DEFAULT_JOBS_DIR
+        self.path = os.path.join(self.jobs_dir, job_id)
+        self.manifest_path = os.path.join(self.path, "job.json")
+        self.manifest = self._load_manifest()
+
+    @classmethod
+    def create(cls, params, job_id=None, jobs_dir=None):
+        """Start a new job directory.
+
+        Args:
+            params: Job parameters needed to resume it (topic, macro topic, ...)
+            job_id: Id to use (default: derived from the topic)
+            jobs_dir: Parent directory of all job directories (optional)
+        """
+        checkpoint = cls(job_id or new_job_id(params.get("topic", "")), jobs_dir)
+        checkpoint.manifest = {
+            "job_id": checkpoint.job_id,
+            "params": params,
+            "created_at": time.time(),
+            "stages": {},
+        }
+        checkpoint._save_manifest()
+        return checkpoint
+
+    @classmethod
+    def resume(cls, job_id, jobs_dir=None):
+        """Open an existing job directory.
+
+        Raises:
+            FileNotFoundError: No job with this id was checkpointed
+        """
+        checkpoint = cls(job_id, jobs_dir)
+        if not checkpoint.manifest:
+            raise FileNotFoundError(f"No checkpointed job '{job_id}' in {checkpoint.jobs_dir}")
+        return checkpoint
+
+    @classmethod
+    def open(cls, job_id, params, jobs_dir=None):
+        """Resume the job if it was checkpointed before, otherwise create it."""
+        try:
+            return cls.resume(job_id, jobs_dir)
+        except FileNotFoundError:
+            return cls.create(params, job_id=job_id, jobs_dir=jobs_dir)
+
+    @property
+    def params(self):
+        return self.manifest.get("params", {})
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_json(self, path, data):
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _save_manifest(self):
+        self._write_json(self.manifest_path, self.manifest)
+
+    def _stage_path(self, stage):
+        return os.path.join(self.path, f"{stage}.json")
+
+    def has(self, stage):
+        """Whether the stage finished in this or an earlier run of the job."""
+        return stage in self.manifest.get("stages", {}) and os.path.exists(self._stage_path(stage))
+
+    def save(self, stage, outputs):
+        """Checkpoint the outputs of a finished stage (a JSON-serialisable dict)."""
+        self._write_json(self._stage_path(stage), outputs)
+        self.manifest.setdefault("stages", {})[stage] = time.time()
+        self._save_manifest()
+
+    def load(self, stage):
+        """Return the checkpointed outputs of a stage."""
+        with open(self._stage_path(stage), 'r') as f:
+            return json.load(f)
+
+    def discard(self, stage):
+        """Forget a stage so the next resume runs it again."""
+        if self.manifest.get("stages", {}).pop(stage, None) is not None:
+            self._save_manifest()
+        if os.path.exists(self._stage_path(stage)):
+            os.remove(self._stage_path(stage))
+
+    def completed(self):
+        """Names of the checkpointed stages, in completion order."""
+        stages = self.manifest.get("stages", {})
+        return [stage for stage in sorted(stages, key=stages.get) if self.has(stage)]
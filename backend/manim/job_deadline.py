@@ -0,0 +1,78 @@
+import os
+import time
+import threading
+import concurrent.futures
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it was cancelled or ran out of time."""
+    pass
+
+
+class JobDeadline:
+    """Wall-clock deadline and cancel signal shared by every stage of one job.
+
+    LLM calls cap their timeout at the time left (``limit``), the manim
+    subprocess is killed as soon as ``wait`` returns True, and ``cancel``
+    ends the job from any thread at once.
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.expires_at = time.time() + seconds if seconds else None
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        # Completed on cancel, so code waiting on futures can add it to its wait set
+        self.future = concurrent.futures.Future()
+
+    @classmethod
+    def start(cls, seconds=None):
+        """Deadline of a job starting now (default: MANIM_JOB_TIMEOUT seconds, or none)."""
+        if seconds is None and os.getenv("MANIM_JOB_TIMEOUT"):
+            seconds = float(os.getenv("MANIM_JOB_TIMEOUT"))
+        return cls(seconds)
+
+    def remaining(self):
+        """Seconds left, or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self):
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def cancel(self, reason="Job cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+        self.future.set_result(reason)
+
+    def cancelled(self):
+        """True once the job was cancelled or its deadline passed."""
+        return self._event.is_set() or self.expired()
+
+    def check(self):
+        """Raise JobCancelled if the job has to stop."""
+        if self._event.is_set():
+            raise JobCancelled(self.reason)
+        if self.expired():
+            raise JobCancelled(f"Job exceeded its {self.seconds:.0f}s deadline")
+
+    def limit(self, seconds):
+        """``seconds`` cut down to the time left."""
+        remaining = self.remaining()
+        if remaining is None:
+            return seconds
+        return remaining if seconds is None else min(seconds, remaining)
+
+    def wait(self, timeout):
+        """Sleep up to ``timeout`` seconds, waking early on cancel or expiry.
+
+        Returns:
+            True if the job has to stop
+        """
+        self._event.wait(max(0.0, self.limit(timeout)))
+        return self.cancelled()
@@ -0,0 +1,111 @@
+import os
+import hashlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, jobs are not coalesced
+    fcntl = None
+
+from topic_index import normalize_topic
+
+DEFAULT_LOCK_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "content", "job_locks"
+)
+
+# Seconds between attempts to take a held lock while watching the job's deadline
+LOCK_POLL_SECONDS = 0.5
+
+
+def coalesce_key(topic, macro_topic=None, problem_type=None):
+    """Key under which identical generation requests are coalesced.
+
+    Word order, case, punctuation and plurals do not change the key, so
+    "Eigenvalues" and "eigenvalue" share one job.
+    """
+    return "|".join([
+        " ".join(sorted(normalize_topic(topic))),
+        (macro_topic or "").strip().lower(),
+        (problem_type or "").strip().lower(),
+    ])
+
+
+class SingleFlight:
+    """Cross-process single-flight lock for one generation request.
+
+    The first process to ``acquire`` a key runs the pipeline; any other
+    process asking for the same key blocks until the first one exits (or
+    calls ``release``) and then finds the finished result in the topic index
+    instead of generating the same files again.
+    """
+
+    def __init__(self, key, lock_dir=None):
+        self.key = key
+        self.lock_dir = lock_dir or os.getenv("MANIM_JOB_LOCK_DIR") or DEFAULT_LOCK_DIR
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+        self.path = os.path.join(self.lock_dir, f"{digest}.lock")
+        self.waited = False
+        self._file = None
+
+    def acquire(self, deadline=None):
+        """Take the lock, waiting for a running identical job first.
+
+        Args:
+            deadline: Optional JobDeadline; a job cancelled or out of time while
+                waiting gives up with JobCancelled instead of holding its worker
+
+        Returns:
+            True if another job held the lock and this one waited for it
+        """
+        if fcntl is None:
+            return False
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._file = open(self.path, 'a+')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.waited = True
+            self._file.seek(0)
+            holder = self._file.read().strip() or "another job"
+            print(f"An identical request is already running ({holder}) - waiting for its result")
+            try:
+                self._wait_for_lock(deadline)
+            except BaseException:
+                self._file.close()
+                self._file = None
+                raise
+            print("✓ Identical request finished")
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(f"pid {os.getpid()}: {self.key}")
+        self._file.flush()
+        return self.waited
+
+    def _wait_for_lock(self, deadline):
+        if deadline is None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if deadline.wait(LOCK_POLL_SECONDS):
+                    deadline.check()
+
+    def release(self):
+        """Let waiting identical jobs continue. Also happens when the process exits."""
+        if self._file is None:
+            return
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
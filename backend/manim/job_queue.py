@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import sqlite3
+
+from job_checkpoint import new_job_id
+
+DEFAULT_JOB_DB = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "content", "job_queue.sqlite3"
+)
+
+# A job is active while queued or running, and finished in any other status
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+# Pipeline stages grouped into the phases clients show progress for
+STAGE_PHASES = {
+    "topic_index": "planning",
+    "visualization_focus": "planning",
+    "animation_design": "planning",
+    "code_generation": "codegen",
+    "render": "render",
+    "upload": "upload",
+}
+
+
+class JobQueue:
+    """Persistent generation job queue in a local SQLite database.
+
+    Clients ``submit`` jobs and read their ``status`` and ``events``; workers
+    ``claim`` queued jobs, report ``progress`` and ``finish`` them. Each job
+    keeps an append-only event log, so a client that reconnects asks for the
+    events after the last one it saw. Submitting a job identical to an active
+    one returns the active job instead of queueing a duplicate.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv("MANIM_JOB_DB") or DEFAULT_JOB_DB
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " coalesce_key TEXT,"
+                " params TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " phase TEXT,"
+                " stage TEXT,"
+                " progress REAL NOT NULL DEFAULT 0,"
+                " result TEXT,"
+                " error TEXT,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " job_id TEXT NOT NULL,"
+                " type TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS events_job ON events (job_id, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _add_event(conn, job_id, event_type, data):
+        conn.execute(
+            "INSERT INTO events (job_id, type, data, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, event_type, json.dumps(data, default=str), time.time())
+        )
+
+    def submit(self, params, coalesce_key=None):
+        """Queue a job, or return the active job with the same coalesce key.
+
+        Returns:
+            Tuple (job_id, coalesced)
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if coalesce_key:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE coalesce_key = ? AND status IN (?, ?) "
+                    "AND cancel_requested = 0 ORDER BY created_at LIMIT 1",
+                    (coalesce_key, *ACTIVE_STATUSES)
+                ).fetchone()
+                if row:
+                    conn.execute("COMMIT")
+                    return row["id"], True
+            job_id = new_job_id(params.get("topic", ""))
+            now = time.time()
+            conn.execute(
+                "INSERT INTO jobs (id, coalesce_key, params, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, coalesce_key, json.dumps(params), now, now)
+            )
+            self._add_event(conn, job_id, "queued", {"params": params})
+            conn.execute("COMMIT")
+            return job_id, False
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self):
+        """Move the oldest queued job to running.
+
+        Returns:
+            Tuple (job_id, params), or None when nothing is queued
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, updated_at = ? WHERE id = ?",
+                (now, now, row["id"])
+            )
+            self._add_event(conn, row["id"], "started", {})
+            conn.execute("COMMIT")
+            return row["id"], json.loads(row["params"])
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def progress(self, job_id, event_type, data):
+        """Record a progress event and update the job's phase, stage and progress."""
+        stage = data.get("stage")
+        phase = STAGE_PHASES.get(stage)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if event_type == "render_progress":
+                conn.execute(
+                    "UPDATE jobs SET phase = 'render', stage = 'render', progress = ?, updated_at = ? "
+                    "WHERE id = ?", (data.get("percent", 0) / 100, time.time(), job_id)
+                )
+            elif event_type == "stage_started" and phase:
+                conn.execute(
+                    "UPDATE jobs SET phase = ?, stage = ?, progress = 0, updated_at = ? WHERE id = ?",
+                    (phase, stage, time.time(), job_id)
+                )
+            self._add_event(conn, job_id, event_type, data)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def finish(self, job_id, result):
+        """Store a job's result; a job with a pending cancel request ends as cancelled."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row and row["cancel_requested"] and not result.get("success"):
+                status = "cancelled"
+            else:
+                status = "succeeded" if result.get("success") else "failed"
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, finished_at = ?, "
+                "updated_at = ? WHERE id = ?",
+                (status, 1.0 if status == "succeeded" else 0.0, json.dumps(result, default=str),
+                 result.get("error"), now, now, job_id)
+            )
+            self._add_event(conn, job_id, "finished", {"status": status, "result": result})
+            conn.execute("COMMIT")
+            return status
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def cancel(self, job_id):
+        """Cancel a job: queued jobs end at once, running jobs are asked to stop.
+
+        Returns:
+            The job's status afterwards, or None for an unknown job
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            status = row["status"]
+            now = time.time()
+            if status == "queued":
+                status = "cancelled"
+                conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ?, "
+                    "updated_at = ? WHERE id = ?", (now, now, job_id)
+                )
+                self._add_event(conn, job_id, "finished", {"status": "cancelled", "result": None})
+            elif status == "running":
+                conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ?", (now, job_id)
+                )
+                self._add_event(conn, job_id, "cancel_requested", {})
+            conn.execute("COMMIT")
+            return status
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def cancel_requested(self, job_id):
+        """Whether someone asked to cancel the job."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return bool(row and row["cancel_requested"])
+        finally:
+            conn.close()
+
+    def status(self, job_id):
+        """Return the job as a dict, or None for an unknown job."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        job["finished"] = job["status"] in FINISHED_STATUSES
+        return job
+
+    def counts(self):
+        """Number of jobs in each status."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) AS jobs FROM jobs GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        return {row["status"]: row["jobs"] for row in rows}
+
+    def events(self, job_id, after=0, limit=500):
+        """Events of a job with a sequence number above ``after``, oldest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT seq, type, data, created_at FROM events WHERE job_id = ? AND seq > ? "
+                "ORDER BY seq LIMIT ?", (job_id, after, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [{"seq": row["seq"], "type": row["type"], "data": json.loads(row["data"]),
+                 "created_at": row["created_at"]} for row in rows]
+
+    def requeue_interrupted(self):
+        """Put jobs left running by a stopped service back in the queue.
+
+        Their checkpoints let them continue from the last finished stage.
+
+        Returns:
+            Number of jobs requeued
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, cancel_requested FROM jobs WHERE status = 'running'").fetchall()
+            now = time.time()
+            for row in rows:
+                if row["cancel_requested"]:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? "
+                        "WHERE id = ?", (now, now, row["id"])
+                    )
+                    self._add_event(conn, row["id"], "finished", {"status": "cancelled", "result": None})
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', updated_at = ? WHERE id = ?", (now, row["id"])
+                    )
+                    self._add_event(conn, row["id"], "requeued", {})
+            conn.execute("COMMIT")
+            return sum(1 for row in rows if not row["cancel_requested"])
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+import traceback
+
+
+class BatchCollector:
+    """Gather prompts from many concurrent topic pipelines into message batches.
+
+    Every topic pipeline runs in its own thread and calls ``send_prompt``
+    wherever it would normally call ``_send_prompt``. A call blocks until
+    every thread that can still send a prompt is waiting on a response; the
+    waiting prompts are then submitted as one asynchronous batch, polled until
+    it ends, and each response is handed back to the thread that asked for it.
+
+    A pipeline counts as one requesting thread until it runs its stages
+    concurrently: pass ``track_stage`` as its progress callback and each
+    running stage counts instead (the pipeline thread only waits for them).
+    Batches can therefore mix stages of different topics.
+    """
+
+    def __init__(self, generator, poll_interval=None):
+        self.generator = generator
+        if poll_interval is None:
+            poll_interval = float(os.getenv("MANIM_LLM_BATCH_POLL", "30"))
+        self.poll_interval = poll_interval
+        self.batches_submitted = 0
+
+        self._lock = threading.Lock()
+        self._active = 0
+        # Running stages per pipeline thread (see track_stage)
+        self._stages = {}
+        self._pending = []
+
+    def register(self):
+        """Count one more pipeline that may send prompts."""
+        with self._lock:
+            self._active += 1
+
+    def unregister(self):
+        """Mark a pipeline as finished, flushing prompts the others were waiting on."""
+        with self._lock:
+            self._active -= 1
+            ready = self._take_ready()
+        if ready:
+            self._submit(ready)
+
+    def track_stage(self, event, **data):
+        """Progress callback counting every running stage thread of a pipeline as a requester."""
+        if event == "stage_started":
+            change = 1
+        elif event in ("stage_finished", "stage_failed") and not data.get("restored"):
+            change = -1
+        else:
+            return
+        # StageGraph emits its events from the thread running the pipeline
+        pipeline = threading.get_ident()
+        with self._lock:
+            running = self._stages.get(pipeline, 0) + change
+            if running > 0:
+                self._stages[pipeline] = running
+            else:
+                self._stages.pop(pipeline, None)
+            ready = self._take_ready()
+        if ready:
+            self._submit(ready)
+
+    def _requesters(self):
+        # A pipeline with n running stages is n requesting threads instead of one
+        return self._active + sum(running - 1 for running in self._stages.values())
+
+    def _take_ready(self):
+        # Called with the lock held: flush once no requesting thread can add more prompts
+        if self._pending and len(self._pending) >= self._requesters():
+            ready, self._pending = self._pending, []
+            return ready
+        return None
+
+    def send_prompt(self, prompt, max_tokens=None, system=None, stage=None, use_cache=True,
+                    validate=None):
+        """Queue a prompt for the next batch and block until its response arrives
+
+        Args:
+            prompt: The prompt text (the user message)
+            max_tokens: Maximum tokens for the response, defaults to the stage's route
+            system: Optional static system prompt
+            stage: Pipeline stage name, used for model routing and per-stage metrics
+            use_cache: Whether the response cache may be used for this call
+            validate: Optional check of the response text; a failing reply from a
+                smaller model is requested again from the large model, outside the batch
+
+        Returns:
+            The response text, or None if the request failed
+        """
+        generator = self.generator
+        model, max_tokens = generator.router.route(stage, max_tokens)
+        text = self._batched_text(prompt, max_tokens, system, stage, use_cache, model, validate)
+        if generator._needs_upgrade(model, validate, text):
+            text = generator._send_prompt(prompt, max_tokens=max_tokens, use_cache=use_cache,
+                                          system=system, stage=stage,
+                                          model=generator.router.large_model)
+        return text
+
+    def _batched_text(self, prompt, max_tokens, system, stage, use_cache, model, validate=None):
+        generator = self.generator
+        started = time.time()
+        cache_key, cached = generator._cache_lookup(
+            prompt, max_tokens, use_cache, model=model, **generator._cache_extra(system=system)
+        )
+        if cached is not None:
+            generator._record_call(stage, started, stop_reason="cache_hit", cached=True, model=model)
+            return cached
+
+        item = {
+            "request": generator._build_request(prompt, max_tokens, system, model=model),
+            "stage": stage,
+            "model": model,
+            "max_tokens": max_tokens,
+            "cache_key": cache_key,
+            "validate": validate,
+            "started": started,
+            "done": threading.Event(),
+            "text": None,
+        }
+        with self._lock:
+            self._pending.append(item)
+            ready = self._take_ready()
+        if ready:
+            self._submit(ready)
+        item["done"].wait()
+        return item["text"]
+
+    def _submit(self, items):
+        """Send one batch, wait for it to end and deliver every result"""
+        generator = self.generator
+        client = generator.client
+        by_id = {f"req-{index}": item for index, item in enumerate(items)}
+        stages = sorted({item["stage"] or "unknown" for item in items})
+        error = None
+
+        try:
+            print(f"\nSubmitting batch of {len(items)} prompts ({', '.join(stages)})")
+            batch = client.messages.batches.create(requests=[
+                {"custom_id": custom_id, "params": item["request"]}
+                for custom_id, item in by_id.items()
+            ])
+            self.batches_submitted += 1
+            print(f"Batch {batch.id} submitted - polling every {self.poll_interval:.0f}s")
+
+            while batch.processing_status != "ended":
+                time.sleep(self.poll_interval)
+                batch = client.messages.batches.retrieve(batch.id)
+                counts = batch.request_counts
+                print(f"Batch {batch.id}: {batch.processing_status} "
+                      f"({counts.succeeded} succeeded, {counts.errored} errored, "
+                      f"{counts.processing} processing)")
+
+            for entry in client.messages.batches.results(batch.id):
+                item = by_id.get(entry.custom_id)
+                if item is None:
+                    continue
+                if entry.result.type != "succeeded":
+                    item["error"] = f"batch request {entry.result.type}"
+                    continue
+                message = entry.result.message
+                item["text"] = generator._response_text(message)
+                item["message"] = message
+        except Exception as e:
+            generator._log_error(e)
+            traceback.print_exc()
+            error = str(e)
+        finally:
+            for item in items:
+                self._deliver(item, error)
+
+    def _deliver(self, item, error=None):
+        generator = self.generator
+        message = item.get("message")
+        if message is not None:
+            usage = generator._record_usage(message)
+            stop_reason = getattr(message, "stop_reason", None)
+            generator._record_call(item["stage"], item["started"], usage=usage,
+                                   stop_reason=stop_reason, batch=True, model=item["model"])
+            generator._record_exchange(item["request"], item["text"], usage, stop_reason,
+                                       item["started"], item["stage"])
+            if generator._cacheable(item["model"], item["validate"], item["text"]):
+                generator._cache_store(item["cache_key"], item["text"], item["max_tokens"],
+                                       item["model"])
+        else:
+            item["text"] = None
+            generator._record_call(item["stage"], item["started"],
+                                   error=item.get("error") or error or "no batch result",
+                                   batch=True, model=item["model"])
+        item["done"].set()
+
+    def run_pipelines(self, jobs, run_job):
+        """Run ``run_job(job, send_prompt)`` for every job in its own thread
+
+        Args:
+            jobs: List of job descriptions, e.g. topic dictionaries
+            run_job: Callable running one pipeline with the given prompt function
+
+        Returns:
+            List of run_job results in the order of ``jobs``
+        """
+        results = [None] * len(jobs)
+
+        def worker(index, job):
+            try:
+                results[index] = run_job(job, self.send_prompt)
+            except Exception as e:
+                print(f"❌ Pipeline for job {index + 1} failed: {e}")
+                traceback.print_exc()
+                results[index] = {"success": False, "error": str(e)}
+            finally:
+                self.unregister()
+
+        # Register every pipeline up front so the first prompt waits for the others
+        for _ in jobs:
+            self.register()
+        threads = [
+            threading.Thread(target=worker, args=(index, job), name=f"batch-pipeline-{index + 1}")
+            for index, job in enumerate(jobs)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+# Default location for cached responses, next to the other generated content
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "content", "llm_cache"
+)
+
+
+def env_flag(name, default=False):
+    """Read a boolean switch from the environment (1/true/yes/on)."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class ResponseCache:
+    """Persistent, content-addressed cache for LLM responses.
+
+    Each response is stored as a small JSON file named after the SHA-256 of
+    the request (model, max_tokens and prompt), so re-running a pipeline with
+    identical prompts is served from disk instead of the API. Entries older
+    than ``max_age`` seconds are dropped on read, and the oldest entries are
+    evicted whenever the cache grows past ``max_entries`` or ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=500, max_bytes=200 * 1024 * 1024,
+                 max_age=7 * 24 * 3600):
+        self.cache_dir = cache_dir or os.getenv("MANIM_LLM_CACHE_DIR") or DEFAULT_CACHE_DIR
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, model, max_tokens, prompt, **extra):
+        """Build the content address for a request.
+
+        Args:
+            model: Model name the prompt is sent to
+            max_tokens: Token limit for the response
+            prompt: Full prompt text
+            **extra: Any other request parameters that change the response
+
+        Returns:
+            Hex digest identifying the request
+        """
+        payload = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        }
+        payload.update(extra)
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key, allow_stale=False):
+        """Return the cached response text for ``key``, or None on a miss.
+
+        ``allow_stale`` also returns entries past ``max_age``, for use when the
+        API is unavailable.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        if (self.max_age and not allow_stale
+                and time.time() - entry.get("created_at", 0) > self.max_age):
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        # Touch the file so eviction treats it as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return entry.get("response")
+
+    def set(self, key, response, metadata=None):
+        """Store a response under ``key`` and evict old entries if needed."""
+        if response is None:
+            return
+
+        entry = {
+            "created_at": time.time(),
+            "response": response,
+            "metadata": metadata or {},
+        }
+
+        # Write atomically so concurrent runs never read a half-written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+            self.writes += 1
+        except OSError as e:
+            print(f"⚠️ Could not write LLM cache entry: {e}")
+            self._remove(tmp_path)
+            return
+
+        self.evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones over the limits."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if self.max_age and now - stat.st_mtime > self.max_age:
+                if self._remove(path):
+                    self.evictions += 1
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()  # Oldest first
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = entries.pop(0)
+            if self._remove(path):
+                self.evictions += 1
+            total_bytes -= size
+
+    def clear(self):
+        """Remove every cached entry."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        """Return hit/miss counters for this process."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def summary(self):
+        """One-line human-readable summary of the counters."""
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        return (f"LLM cache: {self.hits} hits, {self.misses} misses "
+                f"({hit_rate:.0f}% hit rate), {self.writes} writes, {self.evictions} evictions")
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import tempfile
+import threading
+
+# USD per million tokens
+MODEL_PRICING = {
+    "claude-3-7-sonnet-20250219": {"input": 3.00, "output": 15.00, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-5-haiku-20241022": {"input": 0.80, "output": 4.00, "cache_write": 1.00, "cache_read": 0.08},
+}
+DEFAULT_PRICING = MODEL_PRICING["claude-3-7-sonnet-20250219"]
+
+# Message batches are billed at half the standard rate
+BATCH_DISCOUNT = 0.5
+
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+
+def estimate_cost(model, usage, batch=False):
+    """Estimate the USD cost of one call from its token usage.
+
+    Args:
+        model: Model name the call was sent to
+        usage: Dictionary with the TOKEN_FIELDS counts
+        batch: Whether the call went through the message batches API
+
+    Returns:
+        Estimated cost in USD
+    """
+    if not usage:
+        return 0.0
+    pricing = MODEL_PRICING.get(model, DEFAULT_PRICING)
+    cost = (usage.get("input_tokens", 0) * pricing["input"]
+            + usage.get("output_tokens", 0) * pricing["output"]
+            + usage.get("cache_creation_input_tokens", 0) * pricing["cache_write"]
+            + usage.get("cache_read_input_tokens", 0) * pricing["cache_read"])
+    if batch:
+        cost *= BATCH_DISCOUNT
+    return cost / 1_000_000
+
+
+class LLMMetrics:
+    """Per-call accounting of LLM usage for one job.
+
+    Every call is recorded with its stage name, token usage, stop_reason, wall
+    time and how many earlier calls the same stage already made (retries), so a
+    run can be broken down by stage once it finishes.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, stage, model, usage=None, stop_reason=None, wall_time=0.0,
+               cached=False, error=None, batch=False):
+        """Record one LLM call and return the stored entry."""
+        stage = stage or "unknown"
+        with self._lock:
+            attempt = sum(1 for call in self.calls if call["stage"] == stage) + 1
+            entry = {
+                "stage": stage,
+                "model": model,
+                "attempt": attempt,
+                "retries": attempt - 1,
+                "cached": cached,
+                "batch": batch,
+                "stop_reason": stop_reason,
+                "wall_time": round(wall_time, 3),
+                "cost_usd": 0.0 if cached else round(estimate_cost(model, usage, batch), 6),
+                "error": error,
+            }
+            for field in TOKEN_FIELDS:
+                entry[field] = (usage or {}).get(field, 0)
+            self.calls.append(entry)
+        return entry
+
+    def _aggregate(self, calls):
+        totals = {
+            "calls": len(calls),
+            "cached_calls": sum(1 for call in calls if call["cached"]),
+            "failed_calls": sum(1 for call in calls if call["error"]),
+            "retries": sum(1 for call in calls if call["retries"] > 0),
+            "wall_time": round(sum(call["wall_time"] for call in calls), 3),
+            "cost_usd": round(sum(call["cost_usd"] for call in calls), 6),
+        }
+        for field in TOKEN_FIELDS:
+            totals[field] = sum(call[field] for call in calls)
+        return totals
+
+    def by_stage(self):
+        """Aggregate calls per stage, in the order stages first ran."""
+        with self._lock:
+            calls = list(self.calls)
+        stages = {}
+        for call in calls:
+            stages.setdefault(call["stage"], []).append(call)
+        return {stage: self._aggregate(stage_calls) for stage, stage_calls in stages.items()}
+
+    def totals(self):
+        """Aggregate every call of the job."""
+        with self._lock:
+            calls = list(self.calls)
+        return self._aggregate(calls)
+
+    def to_dict(self, job=None):
+        with self._lock:
+            calls = list(self.calls)
+        return {
+            "job": job or {},
+            "started_at": self.started_at,
+            "elapsed": round(time.time() - self.started_at, 3),
+            "totals": self.totals(),
+            "stages": self.by_stage(),
+            "calls": calls,
+        }
+
+    def write(self, path, job=None):
+        """Write the metrics as JSON, atomically replacing any previous file."""
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.to_dict(job), f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not write LLM metrics to {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        return path
+
+    @staticmethod
+    def _summary_row(label, data):
+        cache = f"{data['cache_read_input_tokens']}/{data['cache_creation_input_tokens']}"
+        return (f"  {label:<22}{data['calls']:>6}{data['retries']:>8}{data['wall_time']:>10.1f}"
+                f"{data['input_tokens']:>9}{data['output_tokens']:>9}{cache:>14}{data['cost_usd']:>9.4f}")
+
+    def summary(self):
+        """Multi-line table of per-stage latency, tokens and cost."""
+        stages = self.by_stage()
+        if not stages:
+            return "LLM metrics: no calls recorded"
+        lines = [
+            "LLM metrics by stage:",
+            f"  {'stage':<22}{'calls':>6}{'retries':>8}{'time (s)':>10}{'in tok':>9}"
+            f"{'out tok':>9}{'cache r/w':>14}{'cost $':>9}",
+        ]
+        for stage, data in stages.items():
+            lines.append(self._summary_row(stage, data))
+        lines.append(self._summary_row("TOTAL", self.totals()))
+        return "\n".join(lines)
@@ -0,0 +1,249 @@
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+
+# Shared by every worker process on this machine
+DEFAULT_RATE_DB = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "content", "llm_rate_limit.sqlite3"
+)
+
+# Longest a cancellable wait for capacity sleeps before checking its signals again
+CANCEL_POLL_SECONDS = 0.25
+
+
+def estimate_tokens(text):
+    """Rough token estimate for reserving capacity (about 4 characters per token)."""
+    return max(1, len(text or "") // 4)
+
+
+def load_api_keys(primary_key=None):
+    """Collect API keys from ANTHROPIC_API_KEYS (comma separated) plus the primary key.
+
+    Returns:
+        List of distinct keys, primary key first
+    """
+    keys = []
+    if primary_key:
+        keys.append(primary_key)
+    for key in (os.getenv("ANTHROPIC_API_KEYS") or "").split(","):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+class SharedRateLimiter:
+    """Token-bucket limiter for requests and tokens per minute, shared across processes.
+
+    Bucket state lives in a local SQLite database and every update runs inside
+    an IMMEDIATE transaction, so all worker processes spawned for concurrent
+    jobs draw from the same budget. Each configured API key has its own pair of
+    buckets; a call reserves one request and its estimated tokens on whichever
+    key has room, waiting only as long as the refill needs instead of
+    discovering the limit through 429 errors. Once the call finishes the
+    reservation is settled against the real token count.
+    """
+
+    def __init__(self, api_keys, requests_per_minute=50, tokens_per_minute=40000, db_path=None):
+        if not api_keys:
+            raise ValueError("SharedRateLimiter needs at least one API key")
+        self.requests_per_minute = float(requests_per_minute)
+        self.tokens_per_minute = float(tokens_per_minute)
+        self.db_path = db_path or os.getenv("MANIM_LLM_RATE_DB") or DEFAULT_RATE_DB
+
+        # Buckets are keyed by a hash so the keys themselves never touch disk
+        self.key_ids = [hashlib.sha256(key.encode("utf-8")).hexdigest()[:16] for key in api_keys]
+        self.api_keys = dict(zip(self.key_ids, api_keys))
+
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key_id TEXT PRIMARY KEY,"
+                " requests REAL NOT NULL,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _refill(self, row, now):
+        requests, tokens, updated_at = row
+        elapsed = max(0.0, now - updated_at)
+        requests = min(self.requests_per_minute, requests + elapsed * self.requests_per_minute / 60)
+        tokens = min(self.tokens_per_minute, tokens + elapsed * self.tokens_per_minute / 60)
+        return requests, tokens
+
+    def try_acquire(self, estimated_tokens):
+        """Reserve one request and ``estimated_tokens`` on the first key with capacity.
+
+        Returns:
+            Tuple (key_id, 0) on success, or (None, seconds_to_wait) if every key is exhausted
+        """
+        # A single oversized call must still fit into a full bucket eventually
+        estimated_tokens = min(float(estimated_tokens), self.tokens_per_minute)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            best_wait = None
+            for key_id in self.key_ids:
+                row = conn.execute(
+                    "SELECT requests, tokens, updated_at FROM buckets WHERE key_id = ?", (key_id,)
+                ).fetchone()
+                if row is None:
+                    row = (self.requests_per_minute, self.tokens_per_minute, now)
+                requests, tokens = self._refill(row, now)
+
+                if requests >= 1 and tokens >= estimated_tokens:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO buckets (key_id, requests, tokens, updated_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (key_id, requests - 1, tokens - estimated_tokens, now)
+                    )
+                    conn.execute("COMMIT")
+                    return key_id, 0.0
+
+                request_wait = max(0.0, (1 - requests) * 60 / self.requests_per_minute)
+                token_wait = max(0.0, (estimated_tokens - tokens) * 60 / self.tokens_per_minute)
+                wait = max(request_wait, token_wait)
+                best_wait = wait if best_wait is None else min(best_wait, wait)
+            conn.execute("COMMIT")
+            return None, best_wait
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def acquire(self, estimated_tokens, cancel=None, deadline=None):
+        """Block until capacity is reserved and return the key id to use.
+
+        Args:
+            estimated_tokens: Tokens to reserve
+            cancel: Optional threading.Event; once it is set the wait ends with None
+            deadline: Optional JobDeadline; the wait ends with JobCancelled once the job stops
+
+        Returns:
+            Key id, or None if ``cancel`` was set first
+        """
+        while True:
+            if deadline is not None:
+                deadline.check()
+            if cancel is not None and cancel.is_set():
+                return None
+            key_id, wait = self.try_acquire(estimated_tokens)
+            if key_id is not None:
+                return key_id
+            print(f"Rate limit budget exhausted - waiting {wait:.1f}s before sending")
+            self._wait(min(wait, 5.0) + 0.05, cancel, deadline)
+
+    @staticmethod
+    def _wait(seconds, cancel=None, deadline=None):
+        """Sleep up to ``seconds``, waking early once ``cancel`` is set or the job stops."""
+        if cancel is None and deadline is None:
+            time.sleep(seconds)
+            return
+        ends_at = time.time() + seconds
+        while True:
+            remaining = ends_at - time.time()
+            if remaining <= 0 or (cancel is not None and cancel.is_set()):
+                return
+            # Either signal may fire first, so neither is waited on for long
+            step = min(remaining, CANCEL_POLL_SECONDS)
+            if deadline is not None:
+                if deadline.wait(step):
+                    return
+            else:
+                cancel.wait(step)
+
+    async def acquire_async(self, estimated_tokens):
+        """Async counterpart of acquire that never blocks the event loop.
+
+        The SQLite transaction can wait up to the connect timeout for a busy
+        database, so it runs in the loop's default executor.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            attempt = loop.run_in_executor(None, self.try_acquire, estimated_tokens)
+            try:
+                key_id, wait = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                # The transaction still finishes in its thread; hand back what it reserved
+                attempt.add_done_callback(
+                    lambda done: self._release_abandoned(loop, done, estimated_tokens))
+                raise
+            if key_id is not None:
+                return key_id
+            print(f"Rate limit budget exhausted - waiting {wait:.1f}s before sending")
+            await asyncio.sleep(min(wait, 5.0) + 0.05)
+
+    def _release_abandoned(self, loop, done, estimated_tokens):
+        if done.cancelled() or done.exception() is not None:
+            return
+        key_id, _ = done.result()
+        if key_id is not None:
+            loop.run_in_executor(None, self.release, key_id, estimated_tokens)
+
+    def settle(self, key_id, estimated_tokens, actual_tokens):
+        """Refund (or charge) the difference between the reservation and real usage."""
+        if key_id is None or actual_tokens is None:
+            return
+        difference = min(float(estimated_tokens), self.tokens_per_minute) - float(actual_tokens)
+        if difference:
+            self._refund(key_id, 0, difference)
+
+    def release(self, key_id, estimated_tokens):
+        """Give back a whole reservation whose request was never sent."""
+        if key_id is None:
+            return
+        self._refund(key_id, 1, min(float(estimated_tokens), self.tokens_per_minute))
+
+    def _refund(self, key_id, requests_back, tokens_back):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at FROM buckets WHERE key_id = ?", (key_id,)
+            ).fetchone()
+            if row is not None:
+                requests, tokens = self._refill(row, now)
+                requests = min(self.requests_per_minute, requests + requests_back)
+                tokens = min(self.tokens_per_minute, tokens + tokens_back)
+                conn.execute(
+                    "UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE key_id = ?",
+                    (requests, tokens, now, key_id)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @classmethod
+    def from_env(cls, primary_key=None):
+        """Build a limiter from MANIM_LLM_RPM / MANIM_LLM_TPM, or None if neither is set."""
+        rpm = os.getenv("MANIM_LLM_RPM")
+        tpm = os.getenv("MANIM_LLM_TPM")
+        if not rpm and not tpm:
+            return None
+        api_keys = load_api_keys(primary_key)
+        if not api_keys:
+            return None
+        return cls(
+            api_keys,
+            requests_per_minute=float(rpm or 50),
+            tokens_per_minute=float(tpm or 40000)
+        )
@@ -0,0 +1,395 @@
+import os
+import sys
+import json
+import random
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Recorded prompt/response pairs, one JSON file per request
+DEFAULT_RECORDINGS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "content", "llm_recordings"
+)
+DEFAULT_REPLAY_URL = "http://127.0.0.1:8765"
+
+BACKENDS = ("anthropic", "record", "replay")
+
+# Stop reasons the Messages API can return; anything else is ours (e.g. "code_end")
+API_STOP_REASONS = ("end_turn", "max_tokens", "stop_sequence", "tool_use")
+
+
+def backend_from_env():
+    """Return the LLM backend selected by MANIM_LLM_BACKEND (anthropic by default)."""
+    backend = (os.getenv("MANIM_LLM_BACKEND") or "anthropic").strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    return backend
+
+
+def client_options(backend, api_key=None):
+    """Keyword arguments for anthropic.Anthropic / AsyncAnthropic on a given backend.
+
+    The replay backend talks to the local stand-in with the regular SDK, so
+    streaming and non-streaming calls exercise the same client code as live runs.
+    """
+    if backend == "replay":
+        return {
+            "api_key": api_key or "replay",
+            "base_url": os.getenv("MANIM_LLM_REPLAY_URL") or DEFAULT_REPLAY_URL,
+            "max_retries": 0,
+        }
+    return {"api_key": api_key}
+
+
+def request_key(request):
+    """Content address of a Messages API request.
+
+    The ``stream`` flag is left out so a recording serves both streaming and
+    non-streaming replays of the same prompt.
+    """
+    payload = {name: value for name, value in request.items() if name != "stream"}
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class LLMRecorder:
+    """Capture real prompt/response pairs and their timings for later replay."""
+
+    def __init__(self, recordings_dir=None):
+        self.recordings_dir = recordings_dir or os.getenv("MANIM_LLM_RECORDINGS") or DEFAULT_RECORDINGS_DIR
+        self.recorded = 0
+        os.makedirs(self.recordings_dir, exist_ok=True)
+
+    def record(self, request, content_text, usage=None, stop_reason=None, latency=0.0, stage=None):
+        """Store one completed call, replacing any earlier recording of the same request.
+
+        Args:
+            request: Keyword arguments the call was sent with
+            content_text: Response text the pipeline received
+            usage: Token usage dictionary
+            stop_reason: Stop reason reported for the call
+            latency: Wall time of the call in seconds
+            stage: Pipeline stage name, kept for readability
+
+        Returns:
+            Path of the recording, or None if it could not be written
+        """
+        key = request_key(request)
+        entry = {
+            "recorded_at": time.time(),
+            "stage": stage,
+            "latency": round(latency, 3),
+            "request": request,
+            "response": {
+                "text": content_text,
+                "stop_reason": stop_reason,
+                "usage": usage or {},
+            },
+        }
+        path = os.path.join(self.recordings_dir, f"{key}.json")
+        fd, tmp_path = tempfile.mkstemp(dir=self.recordings_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not record LLM response: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        self.recorded += 1
+        return path
+
+
+class ReplayStore:
+    """Read-only view of a recordings directory."""
+
+    def __init__(self, recordings_dir=None):
+        self.recordings_dir = recordings_dir or os.getenv("MANIM_LLM_RECORDINGS") or DEFAULT_RECORDINGS_DIR
+
+    def lookup(self, request):
+        """Return the recording for ``request``, or None if it was never recorded."""
+        path = os.path.join(self.recordings_dir, f"{request_key(request)}.json")
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def count(self):
+        try:
+            return sum(1 for name in os.listdir(self.recordings_dir) if name.endswith(".json"))
+        except OSError:
+            return 0
+
+
+def _api_message(request, entry):
+    """Build a Messages API response body from a recording."""
+    response = entry["response"]
+    usage = {"input_tokens": 0, "output_tokens": 0,
+             "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+    usage.update(response.get("usage") or {})
+    stop_reason = response.get("stop_reason")
+    return {
+        "id": f"msg_replay_{request_key(request)[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": request.get("model"),
+        "content": [{"type": "text", "text": response.get("text") or ""}],
+        "stop_reason": stop_reason if stop_reason in API_STOP_REASONS else "end_turn",
+        "stop_sequence": None,
+        "usage": usage,
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serve recorded responses on POST /v1/messages, streaming or not.
+
+    Message batches are emulated too: a batch is reported as in progress for
+    ``batch_delay`` seconds and then ends with one result per request.
+
+    ``slow_fraction`` of the requests get ``slow_latency`` extra seconds and
+    ``error_rate`` of them fail with an overloaded error, to exercise hedged
+    requests and the circuit breaker.
+    """
+
+    store = None
+    latency_scale = 0.0
+    fixed_latency = 0.0
+    batch_delay = 1.0
+    slow_fraction = 0.0
+    slow_latency = 0.0
+    error_rate = 0.0
+    chunk_size = 64
+    batches = {}
+    batches_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        print(f"[stand-in] {self.address_string()} {format % args}")
+
+    def _send_json(self, status, body):
+        encoded = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _latency(self, entry):
+        latency = self.fixed_latency + self.latency_scale * float(entry.get("latency") or 0)
+        if self.slow_fraction and random.random() < self.slow_fraction:
+            print(f"[stand-in] Injecting {self.slow_latency:.1f}s of extra latency")
+            latency += self.slow_latency
+        return latency
+
+    def _not_found(self, message="Unknown path"):
+        self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": message}})
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/health":
+            self._send_json(200, {"status": "ok", "recordings": self.store.count()})
+        elif "/v1/messages/batches/" in path:
+            batch_id, _, rest = path.split("/v1/messages/batches/", 1)[1].partition("/")
+            with self.batches_lock:
+                batch = self.batches.get(batch_id)
+            if batch is None:
+                self._not_found(f"No batch {batch_id}")
+            elif rest == "results":
+                self._batch_results(batch)
+            else:
+                self._send_json(200, self._batch_body(batch))
+        else:
+            self._not_found()
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error",
+                                                             "message": "Request body is not JSON"}})
+            return None
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/v1/messages/batches"):
+            body = self._read_json()
+            if body is not None:
+                self._create_batch(body)
+            return
+        if not path.endswith("/v1/messages"):
+            self._not_found()
+            return
+
+        request = self._read_json()
+        if request is None:
+            return
+
+        if self.error_rate and random.random() < self.error_rate:
+            print("[stand-in] Injecting an overloaded error")
+            self._send_json(529, {"type": "error", "error": {"type": "overloaded_error",
+                                                             "message": "Overloaded (injected)"}})
+            return
+
+        entry = self.store.lookup(request)
+        if entry is None:
+            print(f"[stand-in] No recording for request {request_key(request)[:12]}")
+            self._not_found(f"No recording for request {request_key(request)}")
+            return
+
+        message = _api_message(request, entry)
+        if request.get("stream"):
+            self._stream(message, self._latency(entry))
+        else:
+            time.sleep(self._latency(entry))
+            self._send_json(200, message)
+
+    def _create_batch(self, body):
+        requests = body.get("requests") or []
+        encoded = json.dumps(requests, sort_keys=True).encode("utf-8")
+        batch = {
+            "id": f"msgbatch_replay_{hashlib.sha256(encoded).hexdigest()[:16]}_{int(time.time() * 1000)}",
+            "requests": requests,
+            "created": time.time(),
+        }
+        with self.batches_lock:
+            self.batches[batch["id"]] = batch
+        print(f"[stand-in] Batch {batch['id']} created with {len(requests)} requests")
+        self._send_json(200, self._batch_body(batch))
+
+    def _batch_body(self, batch):
+        ended = time.time() - batch["created"] >= self.batch_delay
+        total = len(batch["requests"])
+        succeeded = sum(1 for item in batch["requests"]
+                        if self.store.lookup(item.get("params") or {}) is not None) if ended else 0
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created"]))
+        host = self.headers.get("Host") or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else total,
+                "succeeded": succeeded,
+                "errored": total - succeeded if ended else 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": created_at,
+            "expires_at": created_at,
+            "ended_at": created_at if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"http://{host}/v1/messages/batches/{batch['id']}/results" if ended else None,
+        }
+
+    def _batch_results(self, batch):
+        """Send one JSON line per batch request, errored when there is no recording"""
+        lines = []
+        for item in batch["requests"]:
+            params = item.get("params") or {}
+            entry = self.store.lookup(params)
+            if entry is None:
+                result = {"type": "errored", "error": {"type": "error", "error": {
+                    "type": "not_found_error",
+                    "message": f"No recording for request {request_key(params)}"
+                }}}
+            else:
+                result = {"type": "succeeded", "message": _api_message(params, entry)}
+            lines.append(json.dumps({"custom_id": item.get("custom_id"), "result": result}))
+        encoded = ("\n".join(lines) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _event(self, name, data):
+        self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream(self, message, latency):
+        """Replay a message as Messages API server-sent events, spreading the latency over chunks"""
+        text = message["content"][0]["text"]
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        delay = latency / len(chunks)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        try:
+            start = dict(message, content=[], stop_reason=None,
+                         usage=dict(message["usage"], output_tokens=0))
+            self._event("message_start", {"type": "message_start", "message": start})
+            self._event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                "content_block": {"type": "text", "text": ""}})
+            for chunk in chunks:
+                time.sleep(delay)
+                self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                    "delta": {"type": "text_delta", "text": chunk}})
+            self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self._event("message_delta", {"type": "message_delta",
+                                          "delta": {"stop_reason": message["stop_reason"],
+                                                    "stop_sequence": None},
+                                          "usage": {"output_tokens": message["usage"]["output_tokens"]}})
+            self._event("message_stop", {"type": "message_stop"})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early, e.g. once the code block closed
+            pass
+
+
+def serve(recordings_dir=None, host="127.0.0.1", port=8765, latency_scale=0.0, fixed_latency=0.0,
+          batch_delay=1.0, slow_fraction=0.0, slow_latency=0.0, error_rate=0.0):
+    """Run the stand-in server until interrupted."""
+    StandInHandler.store = ReplayStore(recordings_dir)
+    StandInHandler.latency_scale = latency_scale
+    StandInHandler.fixed_latency = fixed_latency
+    StandInHandler.batch_delay = batch_delay
+    StandInHandler.slow_fraction = slow_fraction
+    StandInHandler.slow_latency = slow_latency
+    StandInHandler.error_rate = error_rate
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    print(f"LLM stand-in serving {StandInHandler.store.count()} recordings from "
+          f"{StandInHandler.store.recordings_dir} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded LLM responses as a local Messages API")
+    parser.add_argument("--recordings", type=str, default=None,
+                        help="Directory of recordings (default: content/llm_recordings)")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--latency-scale", type=float, default=0.0,
+                        help="Multiply recorded latencies by this factor (0 replays instantly)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Fixed latency in seconds added to every response")
+    parser.add_argument("--batch-delay", type=float, default=1.0,
+                        help="Seconds a message batch stays in progress before it ends")
+    parser.add_argument("--slow-fraction", type=float, default=0.0,
+                        help="Fraction of responses (0-1) delayed by --slow-latency, for tail latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0,
+                        help="Extra seconds added to the slow responses")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests (0-1) answered with an overloaded error")
+    args = parser.parse_args()
+    serve(args.recordings, args.host, args.port, args.latency_scale, args.latency, args.batch_delay,
+          args.slow_fraction, args.slow_latency, args.error_rate)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent writers may drop each other's samples
+    fcntl = None
+
+DEFAULT_LATENCY_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "content", "llm_latency.json"
+)
+
+# Longest a single call of each stage may take, in seconds, before it is abandoned
+STAGE_BUDGETS = {
+    "topic_extraction": 60,
+    "concept_extraction": 90,
+    "concept_design": 180,
+    "code_generation": 300,
+    "video_ideas": 120,
+    "scene_plan": 180,
+    "scene_evaluation": 90,
+    "layout_evaluation": 300,
+    "key_takeaways": 60,
+    "render_repair": 120,
+    "feedback_edit": 180,
+}
+DEFAULT_BUDGET = 240
+
+# Never hedge sooner than this, however fast a stage usually is
+MIN_HEDGE_DELAY = 2.0
+
+
+def stage_budget(stage):
+    """Latency budget of a stage in seconds, scaled by MANIM_LLM_BUDGET_SCALE."""
+    scale = float(os.getenv("MANIM_LLM_BUDGET_SCALE", "1"))
+    return STAGE_BUDGETS.get(stage, DEFAULT_BUDGET) * scale
+
+
+class LatencyTracker:
+    """Rolling per-stage, per-model latency history kept across runs.
+
+    The last ``window`` successful call durations of each stage/model pair are
+    saved to a small JSON file, so the hedge delay of a new job starts from
+    the latencies earlier jobs saw. Processes sharing the file merge their new
+    samples into what is on disk under a file lock instead of overwriting it.
+    """
+
+    def __init__(self, path=None, window=100, min_samples=10):
+        self.path = path or os.getenv("MANIM_LLM_LATENCY_FILE") or DEFAULT_LATENCY_PATH
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self.samples = self._load()
+        # Samples observed here that are not on disk yet
+        self._unsaved = {}
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _key(stage, model):
+        return f"{stage or 'unknown'}|{model}"
+
+    def observe(self, stage, model, seconds):
+        """Add one successful call duration and save the history."""
+        key = self._key(stage, model)
+        with self._lock:
+            samples = self.samples.setdefault(key, [])
+            samples.append(round(seconds, 3))
+            del samples[:-self.window]
+            self._unsaved.setdefault(key, []).append(round(seconds, 3))
+            try:
+                self._save()
+            except OSError as e:
+                print(f"⚠️ Could not save LLM latency history: {e}")
+
+    def _save(self):
+        """Merge the unsaved samples into the file's current history and write it back."""
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Re-read so samples other processes saved since our last write are kept
+            merged = self._load()
+            for key, new_samples in self._unsaved.items():
+                samples = merged.setdefault(key, [])
+                samples.extend(new_samples)
+                del samples[:-self.window]
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(merged, f)
+            os.replace(tmp_path, self.path)
+        self.samples = merged
+        self._unsaved = {}
+
+    def percentile(self, stage, model, q=0.95):
+        """Latency below which ``q`` of the recorded calls finished, or None without enough history."""
+        with self._lock:
+            samples = sorted(self.samples.get(self._key(stage, model), []))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def hedge_delay(self, stage, model, budget):
+        """Seconds to wait before sending a hedge request, or None to not hedge."""
+        p95 = self.percentile(stage, model)
+        if p95 is None:
+            return None
+        delay = max(p95, MIN_HEDGE_DELAY)
+        return delay if delay < budget else None
+
+
+class CircuitBreaker:
+    """Fail fast while the LLM backend is clearly degraded.
+
+    After ``failure_threshold`` consecutive failed calls the breaker opens and
+    ``allow`` refuses calls for ``reset_timeout`` seconds. It then lets one
+    trial call through (half open); success closes it again, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            failure_threshold=int(os.getenv("MANIM_LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("MANIM_LLM_BREAKER_RESET", "60")),
+        )
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        """Whether a call may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_running:
+                self.trial_running = True
+                print("Circuit breaker half open - sending a trial call")
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("✓ Circuit breaker closed - LLM backend recovered")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self):
+        """End a trial call that neither succeeded nor failed (e.g. its job was cancelled)."""
+        with self._lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    print(f"⚠️ Circuit breaker open after {self.failures} failed calls - "
+                          f"failing fast for {self.reset_timeout:.0f}s")
+                self.opened_at = time.time()
+                self.trial_running = False
+
+    def summary(self):
+        return f"Circuit breaker: {self.state}, {self.rejected} calls failed fast"
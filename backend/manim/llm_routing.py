@@ -0,0 +1,68 @@
+LARGE_MODEL = "claude-3-7-sonnet-20250219"
+SMALL_MODEL = "claude-3-5-haiku-20241022"
+
+# Used when neither the caller nor the route sets a limit
+DEFAULT_MAX_TOKENS = 5000
+
+# Per-stage model and max_tokens defaults. Short extraction and pass/fail
+# stages go to the small model; anything not listed (design, planning, code)
+# stays on the large model with the caller's limit.
+STAGE_ROUTES = {
+    # main_exercise / prompts_exercise
+    "topic_extraction": {"model": SMALL_MODEL, "max_tokens": 1500},
+    "concept_extraction": {"model": SMALL_MODEL, "max_tokens": 2000},
+    # main_test_ic
+    "scene_evaluation": {"model": SMALL_MODEL, "max_tokens": 2000},
+    "key_takeaways": {"model": SMALL_MODEL, "max_tokens": 500},
+    "video_ideas": {"model": LARGE_MODEL, "max_tokens": 2000},
+    "scene_plan": {"model": LARGE_MODEL, "max_tokens": 4000},
+    "code_generation": {"model": LARGE_MODEL, "max_tokens": 5000},
+    "layout_evaluation": {"model": LARGE_MODEL, "max_tokens": 5000},
+    # generate_video_from_code
+    "render_repair": {"model": LARGE_MODEL, "max_tokens": 4000},
+    # generate_video feedback edits
+    "feedback_edit": {"model": LARGE_MODEL, "max_tokens": 5000},
+}
+
+
+class ModelRouter:
+    """Pick the model and max_tokens for each pipeline stage.
+
+    Stages routed to a smaller model can be upgraded to ``large_model`` when
+    their output fails validation (see ManimGenerator._send_prompt).
+    """
+
+    def __init__(self, routes=None, large_model=LARGE_MODEL, enabled=True):
+        self.routes = STAGE_ROUTES if routes is None else routes
+        self.large_model = large_model
+        self.enabled = enabled
+        self.upgrades = 0
+
+    def route(self, stage, max_tokens=None, model=None):
+        """Resolve the model and token limit for one call.
+
+        Args:
+            stage: Pipeline stage name
+            max_tokens: Limit requested by the caller, wins over the route default
+            model: Model requested by the caller, wins over the route
+
+        Returns:
+            Tuple of (model, max_tokens)
+        """
+        route = self.routes.get(stage, {}) if self.enabled else {}
+        model = model or route.get("model") or self.large_model
+        max_tokens = max_tokens or route.get("max_tokens") or DEFAULT_MAX_TOKENS
+        return model, max_tokens
+
+    def can_upgrade(self, model):
+        """Whether a call on ``model`` has a larger model to fall back to."""
+        return model != self.large_model
+
+    def summary(self):
+        """One-line description of the routing and how often it fell back."""
+        if not self.enabled:
+            return f"Model routing: disabled (all stages on {self.large_model})"
+        small_stages = sorted(stage for stage, route in self.routes.items()
+                              if route.get("model", self.large_model) != self.large_model)
+        return (f"Model routing: {', '.join(small_stages) or 'no stages'} on smaller models, "
+                f"{self.upgrades} upgrades to {self.large_model}")
@@ -0,0 +1,46 @@
+class ConversationSession:
+    """Message history for one pipeline stage.
+
+    The first ``send`` carries the full prompt. Later sends - typically short
+    corrective turns such as "resend only the code with the tags" - go out with
+    the earlier exchange as history, so the model keeps its context and the
+    retry prompt stays small instead of repeating the whole template.
+    """
+
+    def __init__(self, generator, stage, system=None, max_tokens=None, stop_at_code_end=False):
+        self.generator = generator
+        self.stage = stage
+        self.system = system
+        self.max_tokens = max_tokens
+        self.stop_at_code_end = stop_at_code_end
+        self.messages = []
+
+    @property
+    def turns(self):
+        """Number of completed user/assistant exchanges."""
+        return len(self.messages) // 2
+
+    def send(self, prompt, max_tokens=None, stop_at_code_end=None):
+        """Send the next user turn and remember the exchange
+
+        Args:
+            prompt: The user message for this turn
+            max_tokens: Override the session's token limit for this turn
+            stop_at_code_end: Override the session's streaming behaviour for this turn
+
+        Returns:
+            The response text, or None if the request failed
+        """
+        response = self.generator._send_prompt(
+            prompt,
+            max_tokens=max_tokens or self.max_tokens,
+            stop_at_code_end=self.stop_at_code_end if stop_at_code_end is None else stop_at_code_end,
+            system=self.system,
+            stage=self.stage,
+            history=self.messages
+        )
+        # Failed turns are left out so the history keeps alternating user/assistant
+        if response:
+            self.messages.append({"role": "user", "content": prompt})
+            self.messages.append({"role": "assistant", "content": response})
+        return response
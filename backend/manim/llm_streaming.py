@@ -0,0 +1,60 @@
+CODE_START_TAG = "<CODE_START>"
+CODE_END_TAGS = ("</CODE_END>", "<CODE_END>")
+PYTHON_FENCE = "```python"
+FENCE = "```"
+
+# Longest marker we search for, used to re-scan across chunk boundaries
+_MAX_MARKER_LEN = max(len(CODE_START_TAG), len(PYTHON_FENCE), *(len(tag) for tag in CODE_END_TAGS))
+
+
+class CodeBlockEndDetector:
+    """Watch a streamed response and report when the first code block closes.
+
+    A block opens at ``<CODE_START>`` or a ```` ```python ```` fence and closes at
+    ``</CODE_END>`` / ``<CODE_END>`` or the matching closing fence. Closing
+    markers that appear before any opening marker (e.g. the model repeating the
+    formatting instructions) are ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.opener = None
+        self._open_end = 0
+        self._scan_from = 0
+
+    def feed(self, delta):
+        """Append a chunk of streamed text.
+
+        Args:
+            delta: Newly received text
+
+        Returns:
+            Index just past the closing marker once the block is complete, else -1
+        """
+        self.text += delta
+        search_from = max(0, self._scan_from - _MAX_MARKER_LEN)
+        self._scan_from = len(self.text)
+
+        if self.opener is None:
+            tag_pos = self.text.find(CODE_START_TAG, search_from)
+            fence_pos = self.text.find(PYTHON_FENCE, search_from)
+            candidates = [(pos, marker) for pos, marker in
+                          ((tag_pos, CODE_START_TAG), (fence_pos, PYTHON_FENCE)) if pos != -1]
+            if not candidates:
+                return -1
+            pos, self.opener = min(candidates)
+            self._open_end = pos + len(self.opener)
+            search_from = self._open_end
+
+        search_from = max(search_from, self._open_end)
+        if self.opener == CODE_START_TAG:
+            ends = [(self.text.find(tag, search_from), tag) for tag in CODE_END_TAGS]
+            ends = [(pos, tag) for pos, tag in ends if pos != -1]
+            if ends:
+                pos, tag = min(ends)
+                return pos + len(tag)
+        else:
+            pos = self.text.find(FENCE, search_from)
+            if pos != -1:
+                return pos + len(FENCE)
+        return -1
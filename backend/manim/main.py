@@ -14,9 +14,14 @@ def main():
     parser.add_argument("--audience", type=str, default="high school", 
                       help="Target audience level (e.g., elementary, middle school, high school, undergraduate)")
     parser.add_argument("--feedback", type=str, default=None, 
-                      help="Path to a text file containing user feedback for improving an existing animation")
+                      help="Path to a text file containing user feedback for improving an existing animation "
+                           "(edits the stored animation and re-renders only the changed parts)")
     parser.add_argument("--server-url", type=str, default="http://localhost:4000", 
                       help="URL of the Node.js server")
+    parser.add_argument("--no-cache", action="store_true",
+                      help="Bypass the on-disk LLM response cache")
+    parser.add_argument("--refresh-cache", action="store_true",
+                      help="Ignore cached LLM responses but store the new ones")
     args = parser.parse_args()
     
     print(f"Server URL: {args.server_url}")
@@ -37,7 +42,11 @@ def main():
         return
     
     # Initialize the video generator
-    video_gen = VideoGenerator(api_key=api_key)
+    video_gen = VideoGenerator(
+        api_key=api_key,
+        use_cache=False if args.no_cache else None,
+        refresh_cache=True if args.refresh_cache else None
+    )
     
     # Process user feedback if provided
     user_feedback = None
@@ -53,6 +62,14 @@ def main():
     result = video_gen.generate_video(args.topic, args.audience, user_feedback)
     success = isinstance(result, str) 
     
+    # Write per-stage LLM metrics next to the artifacts directory
+    metrics_path = os.path.join(video_gen.videos_dir, f"{video_gen._get_safe_filename(args.topic)}_llm_metrics.json")
+    video_gen.generator.write_metrics(metrics_path, job={
+        "topic": args.topic,
+        "audience": args.audience,
+        "pipeline": "main_feedback" if user_feedback else "main"
+    })
+    
     # Save result to MongoDB via the Express server
     try:
         # Read the generated code
@@ -140,6 +157,7 @@ def main():
             print(f"Video saved to: {result}")
     else:
         print(f"\nFailed to complete the process for topic: '{args.topic}'")
+    print(video_gen.generator.cache_summary())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
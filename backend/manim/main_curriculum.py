@@ -0,0 +1,382 @@
+from dotenv import load_dotenv
+import os
+import csv
+import json
+import time
+import hashlib
+import argparse
+import threading
+import traceback
+import concurrent.futures
+from generate_video_exercise import VideoGenerator
+from prompts_exercise import process_math_visualization_request
+from topic_index import TopicIndex
+from job_lock import coalesce_key
+from job_checkpoint import JobCheckpoint
+from job_deadline import JobDeadline, JobCancelled
+from main_exercise import (
+    validate_macro_topic,
+    validate_problem_type,
+    create_safe_filename,
+    infer_prompt_stage,
+    save_to_database,
+    STAGE_VALIDATORS
+)
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
+
+
+def load_curriculum(path):
+    """Read (topic, macro_topic, problem_type) rows from a CSV or JSONL file.
+
+    CSV files need a header row naming the three columns. Invalid rows are
+    skipped with a warning, and rows that only differ in case, word order or
+    plurals are kept once.
+
+    Returns:
+        List of row dicts in file order
+    """
+    with open(path, 'r', newline='') as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            raw_rows = [json.loads(line) for line in f if line.strip() and not line.startswith('#')]
+        else:
+            raw_rows = list(csv.DictReader(f))
+
+    rows = {}
+    for number, raw in enumerate(raw_rows, 1):
+        raw = {key.strip().lower().replace("-", "_"): (value or "").strip()
+               for key, value in raw.items() if key}
+        try:
+            row = {
+                "topic": raw["topic"],
+                "macro_topic": validate_macro_topic(raw["macro_topic"]),
+                "problem_type": validate_problem_type(raw["problem_type"]),
+            }
+        except (KeyError, argparse.ArgumentTypeError) as e:
+            print(f"⚠️ Skipping row {number}: {e}")
+            continue
+        if not row["topic"]:
+            print(f"⚠️ Skipping row {number}: empty topic")
+            continue
+        rows.setdefault(coalesce_key(row["topic"], row["macro_topic"], row["problem_type"]), row)
+    return list(rows.values())
+
+
+def curriculum_job_id(row):
+    """Job id that stays the same across runs, so rerunning a curriculum resumes it."""
+    key = coalesce_key(row["topic"], row["macro_topic"], row["problem_type"])
+    return "curriculum-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def open_job(row):
+    """Resume the row's checkpointed job, or start it."""
+    return JobCheckpoint.open(curriculum_job_id(row), dict(row, pipeline="main_curriculum"))
+
+
+def rendered_video(checkpoint):
+    """Video path of a job that already finished, or None."""
+    if not checkpoint.has("render"):
+        return None
+    video_path = checkpoint.load("render")["video_path"]
+    return video_path if os.path.exists(video_path) else None
+
+
+class CurriculumRunner:
+    """Pipelined worker pool for a whole curriculum.
+
+    LLM stages and renders run in separate pools: while ``render_workers``
+    topics are rendering, up to ``llm_workers`` upcoming topics are already
+    being planned and coded, so neither the API nor the CPU sits idle. Every
+    stage is checkpointed per topic, so an interrupted run picks up where it
+    stopped when it is started again with the same file. All topics share one
+    JobDeadline, so an interrupt stops the LLM calls and kills the renders at once.
+    """
+
+    def __init__(self, video_gen, topic_index, server_url, llm_workers=4, render_workers=1,
+                 no_render=False):
+        self.video_gen = video_gen
+        self.topic_index = topic_index
+        self.server_url = server_url
+        self.llm_workers = llm_workers
+        self.render_workers = render_workers
+        self.no_render = no_render
+        # With no_render a finished topic is a saved script, not a video
+        self.unit = "scripts" if no_render else "videos"
+        self.deadline = JobDeadline()
+        self.outcomes = []
+        self.total = 0
+        self.started = None
+        self._index_lock = threading.Lock()
+
+    def _get_llm_response(self):
+        @retry(stop=stop_after_attempt(5),
+               wait=wait_exponential(multiplier=1, min=4, max=30),
+               retry=retry_if_not_exception_type(JobCancelled))
+        def get_llm_response(prompt):
+            stage = infer_prompt_stage(prompt)
+            return self.video_gen.generator._send_prompt(
+                prompt, stage=stage, validate=STAGE_VALIDATORS.get(stage)
+            )
+        return get_llm_response
+
+    def llm_stage(self, row, checkpoint):
+        """Plan and code one topic (checkpointed stages are restored, not re-run)."""
+        started = time.time()
+        print(f"\n[LLM] '{row['topic']}'")
+        result = process_math_visualization_request(
+            query=row["topic"],
+            macro_topic=row["macro_topic"],
+            problem_type=row["problem_type"],
+            get_llm_response_func=self._get_llm_response(),
+            checkpoint=checkpoint
+        )
+        result["llm_seconds"] = time.time() - started
+        return result
+
+    def render_stage(self, row, checkpoint, visualization_result):
+        """Save, render and store one planned topic.
+
+        Returns:
+            Video path (code path with no_render), or None if rendering failed
+        """
+        topic = row["topic"]
+        safe_filename = create_safe_filename(topic, row["problem_type"])
+        code_path = os.path.join(self.video_gen.code_dir, f"{safe_filename}.py")
+        with open(code_path, 'w') as f:
+            f.write(visualization_result["code"])
+        if self.no_render:
+            return code_path
+
+        print(f"\n[RENDER] '{topic}'")
+        result = self.video_gen.generate_video_from_code(code_path, topic)
+        success = isinstance(result, str)
+        # The render repair loop may have rewritten the code
+        with open(code_path, 'r') as f:
+            code = f.read()
+        animation_design = visualization_result["animation_design"]
+
+        if success:
+            checkpoint.save("render", {"video_path": result})
+            artifacts_dir = os.path.join(self.video_gen.videos_dir, f"{safe_filename}_artifacts")
+            os.makedirs(artifacts_dir, exist_ok=True)
+            with open(os.path.join(artifacts_dir, "animation_design.txt"), 'w') as f:
+                f.write(animation_design)
+            with self._index_lock:
+                self.topic_index.register(topic, code_path, result, artifacts_dir,
+                                          row["macro_topic"], row["problem_type"])
+
+        try:
+            save_to_database(self.server_url, {
+                "topic": topic,
+                "macroTopic": row["macro_topic"],
+                "problemType": row["problem_type"],
+                "code": code,
+                "status": "completed" if success else "failed",
+                "videoPath": result if success else "",
+                "animationDesign": animation_design
+            })
+        except Exception as e:
+            print(f"⚠️ Could not save '{topic}' to the database: {e}")
+        return result if success else None
+
+    def _finish(self, row, output, error=None, **timings):
+        outcome = {"topic": row["topic"], "macro_topic": row["macro_topic"],
+                   "problem_type": row["problem_type"], "output": output, "error": error}
+        outcome.update({key: round(value, 3) for key, value in timings.items()})
+        self.outcomes.append(outcome)
+        done = sum(1 for item in self.outcomes if item["output"])
+        print(f"\n[{len(self.outcomes)}/{self.total}] {'✓' if output else '❌'} '{row['topic']}'"
+              f"{f': {output}' if output else f' - {error}'} ({self.throughput():.1f} {self.unit}/hour, "
+              f"{done} done)")
+
+    def throughput(self):
+        """Topics finished per hour since the run started (videos, or scripts with no_render)."""
+        elapsed = time.time() - self.started if self.started else 0
+        done = sum(1 for item in self.outcomes if item["output"] and not item.get("resumed"))
+        return done * 3600 / elapsed if elapsed > 0 else 0.0
+
+    def run(self, rows):
+        """Run every row through the LLM and render pools.
+
+        Returns:
+            List of outcome dicts, one per row, in completion order
+        """
+        self.total = len(rows)
+        self.started = time.time()
+        llm_pool = concurrent.futures.ThreadPoolExecutor(self.llm_workers, thread_name_prefix="llm")
+        render_pool = concurrent.futures.ThreadPoolExecutor(self.render_workers,
+                                                            thread_name_prefix="render")
+        pending = {}
+        self.video_gen.generator.job_deadline = self.deadline
+        try:
+            for row in rows:
+                checkpoint = open_job(row)
+                video_path = rendered_video(checkpoint)
+                if video_path:
+                    self.outcomes.append({"topic": row["topic"], "macro_topic": row["macro_topic"],
+                                          "problem_type": row["problem_type"],
+                                          "output": video_path, "error": None, "resumed": True})
+                    continue
+                pending[llm_pool.submit(self.llm_stage, row, checkpoint)] = ("llm", row, checkpoint, {})
+            if self.outcomes:
+                print(f"✓ {len(self.outcomes)} topics already finished in an earlier run")
+
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    kind, row, checkpoint, timings = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        traceback.print_exc()
+                        self._finish(row, None, error=str(e))
+                        continue
+                    if kind == "llm":
+                        if not result.get("success"):
+                            self._finish(row, None, error=result.get("error", "Unknown error"),
+                                         llm_seconds=result["llm_seconds"])
+                            continue
+                        # Hand the topic to a render slot; the LLM slot takes the next topic
+                        future = render_pool.submit(self.render_stage, row, checkpoint, result)
+                        pending[future] = ("render", row, checkpoint,
+                                           {"llm_seconds": result["llm_seconds"],
+                                            "queued_at": time.time()})
+                    else:
+                        timings["render_seconds"] = time.time() - timings.pop("queued_at")
+                        self._finish(row, result, error=None if result else "Render failed", **timings)
+        except KeyboardInterrupt:
+            print("\n⚠️ Interrupted - finished stages are checkpointed; "
+                  "run the same command again to resume")
+            # Stops the in-flight LLM calls and kills the manim process groups
+            self.deadline.cancel("Curriculum interrupted")
+            llm_pool.shutdown(wait=False, cancel_futures=True)
+            render_pool.shutdown(wait=False, cancel_futures=True)
+            # The deadline stays set so the abandoned workers see the cancel
+            raise
+        llm_pool.shutdown()
+        render_pool.shutdown()
+        self.video_gen.generator.job_deadline = None
+        return self.outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate visualizations for a whole curriculum, overlapping LLM stages "
+                    "with rendering"
+    )
+    parser.add_argument(
+        "curriculum",
+        type=str,
+        help="CSV (with a topic,macro_topic,problem_type header) or JSONL file of topics"
+    )
+    parser.add_argument(
+        "--llm-workers",
+        type=int,
+        default=4,
+        help="Topics in their LLM stages at the same time"
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Concurrent manim renders (default: half the CPU cores)"
+    )
+    parser.add_argument(
+        "--server-url",
+        type=str,
+        default="http://localhost:4000",
+        help="URL of the Node.js server"
+    )
+    parser.add_argument(
+        "--no-render",
+        action="store_true",
+        help="Only generate and save code, without rendering or saving to the database"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the on-disk LLM response cache"
+    )
+    parser.add_argument(
+        "--llm-backend",
+        choices=["anthropic", "record", "replay"],
+        default=None,
+        help="Call the API, record every exchange for replay, or replay recordings from the "
+             "local stand-in (default: MANIM_LLM_BACKEND or anthropic)"
+    )
+    parser.add_argument(
+        "--render-repairs",
+        type=int,
+        default=None,
+        help="Targeted code repairs to attempt when a render fails "
+             "(default: MANIM_RENDER_REPAIRS or 2)"
+    )
+    args = parser.parse_args()
+
+    rows = load_curriculum(args.curriculum)
+    if not rows:
+        parser.error(f"No valid rows in {args.curriculum}")
+
+    load_dotenv()
+    api_key = os.getenv('ANTHROPIC_API_KEY')
+
+    if args.llm_backend:
+        os.environ["MANIM_LLM_BACKEND"] = args.llm_backend
+
+    # Replays are served by the local stand-in, which needs no key
+    if not api_key and os.getenv("MANIM_LLM_BACKEND") != "replay":
+        print("Error: ANTHROPIC_API_KEY not found in environment variables")
+        print("Please create a .env file with your API key or set it as an environment variable")
+        return
+
+    video_gen = VideoGenerator(
+        api_key=api_key,
+        use_cache=False if args.no_cache else None,
+        llm_backend=args.llm_backend,
+        render_repairs=args.render_repairs
+    )
+    topic_index = TopicIndex(video_gen.code_dir, video_gen.videos_dir)
+    runner = CurriculumRunner(video_gen, topic_index, args.server_url,
+                              llm_workers=args.llm_workers,
+                              render_workers=args.render_workers,
+                              no_render=args.no_render)
+
+    print("\n" + "="*50)
+    print("STARTING CURRICULUM")
+    print("="*50)
+    print(f"Curriculum: {args.curriculum} ({len(rows)} topics)")
+    print(f"LLM workers: {args.llm_workers}, render workers: {args.render_workers}")
+    print("-"*50)
+
+    try:
+        outcomes = runner.run(rows)
+    finally:
+        elapsed = time.time() - runner.started
+        report_path = os.path.join(video_gen.videos_dir, f"curriculum_{int(runner.started)}_report.json")
+        with open(report_path, 'w') as f:
+            json.dump({
+                "curriculum": os.path.abspath(args.curriculum),
+                "topics": len(rows),
+                "elapsed_seconds": round(elapsed, 3),
+                f"{runner.unit}_per_hour": round(runner.throughput(), 2),
+                "outcomes": runner.outcomes
+            }, f, indent=2)
+        video_gen.generator.write_metrics(
+            os.path.join(video_gen.videos_dir, f"curriculum_{int(runner.started)}_llm_metrics.json"),
+            job={"curriculum": args.curriculum, "pipeline": "main_curriculum"}
+        )
+
+    print("\n" + "="*50)
+    print("CURRICULUM COMPLETE")
+    print("="*50)
+    succeeded = sum(1 for outcome in outcomes if outcome["output"])
+    resumed = sum(1 for outcome in outcomes if outcome.get("resumed"))
+    print(f"{succeeded}/{len(rows)} topics succeeded ({resumed} from an earlier run)")
+    print(f"Elapsed: {elapsed / 60:.1f} min, throughput: {runner.throughput():.1f} {runner.unit}/hour")
+    print(f"Report saved to: {report_path}")
+    print(video_gen.generator.cache_summary())
+    print(video_gen.generator.usage_summary())
+    print("="*50 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,23 @@ import json
 import re
 import traceback
 from generate_video_exercise import VideoGenerator
-from prompts_exercise import process_math_visualization_request
+from topic_index import TopicIndex
+from job_lock import SingleFlight, coalesce_key
+from job_checkpoint import JobCheckpoint
+from event_stream import start_machine_mode
+from job_deadline import JobDeadline, JobCancelled
+from response_parser import code_block
+from prompts_exercise import (
+    process_math_visualization_request,
+    TOPIC_EXTRACTION,
+    CONCEPT_EXTRACTION,
+    CONCEPT_DESIGN,
+    CODE_GENERATION,
+    extract_section
+)
 from enum import Enum
 import time
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
 
 class MacroTopic(Enum):
     LINEAR_ALGEBRA = "linear algebra"
@@ -117,11 +130,7 @@ def validate_topic_content(code, topic):
 
 def extract_code_from_response(response):
     """Extract code between CODE_START and CODE_END tags."""
-    pattern = r'<CODE_START>\s*(.*?)\s*</CODE_END>'
-    match = re.search(pattern, response, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return None
+    return code_block(response, closers=("</CODE_END>",))
 
 def generate_code_with_validation(topic, video_gen, max_attempts=3):
     for attempt in range(max_attempts):
@@ -167,29 +176,119 @@ def generate_code_with_validation(topic, video_gen, max_attempts=3):
             
     return None
 
+# Stage names for the per-stage LLM metrics, matched on each template's fixed prefix
+PROMPT_STAGES = [
+    (TOPIC_EXTRACTION, "topic_extraction"),
+    (CONCEPT_EXTRACTION, "concept_extraction"),
+    (CONCEPT_DESIGN, "concept_design"),
+    (CODE_GENERATION, "code_generation"),
+]
+
+# Checks on stages that run on the smaller model; a failing reply is re-sent to the larger one
+STAGE_VALIDATORS = {
+    "topic_extraction": lambda response: extract_section(response, "extracted_topic"),
+    "concept_extraction": lambda response: extract_section(response, "visualization_focus"),
+}
+
+def infer_prompt_stage(prompt):
+    """Name the pipeline stage a prompt belongs to."""
+    for template, stage in PROMPT_STAGES:
+        if prompt.startswith(template.split('{', 1)[0]):
+            return stage
+    # Retry prompts from extract_code_with_retries re-request the code section
+    if "<CODE_START>" in prompt:
+        return "code_generation"
+    return "other"
+
+def save_llm_metrics(video_gen, safe_filename, args):
+    """Write the per-stage LLM metrics for this job next to its artifacts."""
+    metrics_path = os.path.join(video_gen.videos_dir, f"{safe_filename}_llm_metrics.json")
+    video_gen.generator.write_metrics(metrics_path, job={
+        "topic": args.topic,
+        "macro_topic": args.macro_topic,
+        "problem_type": args.problem_type,
+        "pipeline": "main_exercise"
+    })
+
+def save_to_database(server_url, data):
+    """Send a finished visualization to the Node.js server (single attempt)."""
+    print("Sending data to database...")
+    endpoint_url = f"{server_url}/videos/save-from-python"
+    response = requests.post(
+        endpoint_url,
+        json=data,
+        headers={"Content-Type": "application/json"},
+        timeout=30
+    )
+    
+    if response.status_code == 201:
+        print("✓ Successfully saved to database")
+        return True
+    print(f"❌ Failed to save to database (Status: {response.status_code})")
+    return False
+
+def reuse_indexed_topic(video_gen, topic_index, entry, topic, args):
+    """Serve a request from an already generated topic instead of calling the LLM.
+
+    Indexed code without a video is rendered first.
+
+    Returns:
+        Video path, or None if the indexed code could not be rendered
+    """
+    with open(entry['code_path'], 'r') as f:
+        code = f.read()
+    print(f"✓ Reusing code: {entry['code_path']}")
+
+    video_path = entry.get('video_path')
+    if not video_path:
+        print("Indexed code has no video yet - rendering it")
+        result = video_gen.generate_video_from_code(entry['code_path'], topic)
+        if not isinstance(result, str):
+            print("❌ Rendering the indexed code failed")
+            return None
+        video_path = result
+        topic_index.register(entry['topic'], entry['code_path'], video_path, entry.get('artifacts_dir'),
+                             entry.get('macro_topic'), entry.get('problem_type'))
+    print(f"✓ Reusing video: {video_path}")
+
+    # The video exists either way, so a database outage must not fail the job
+    try:
+        save_to_database(args.server_url, {
+            "topic": topic,
+            "macroTopic": args.macro_topic,
+            "problemType": args.problem_type,
+            "code": code,
+            "status": "completed",
+            "videoPath": video_path,
+            "animationDesign": topic_index.read_artifact(entry, "animation_design.txt")
+        })
+    except Exception as e:
+        print(f"⚠️ Could not save '{topic}' to the database: {e}")
+    return video_path
+
 class CodeGenerationError(Exception):
     """Custom exception for code generation failures."""
     pass
 
-def main():
-    # Parse command-line arguments with the new structure
+def build_parser():
+    """Command-line options of one generation job (also used for worker service jobs)."""
     parser = argparse.ArgumentParser(description="Generate Manim animations for math concepts")
     parser.add_argument(
         "--topic", 
         type=str, 
-        required=True, 
-        help="Specific mathematical topic to animate"
+        default=None, 
+        help="Specific mathematical topic to animate (required unless --resume is given)"
     )
     parser.add_argument(
         "--macro-topic", 
         type=validate_macro_topic, 
-        required=True,
+        default=None,
         help="Main topic area (linear algebra, probability, or calculus)"
     )
     parser.add_argument(
         "--problem-type", 
         type=validate_problem_type, 
-        required=True,
+        default=None,
         help="Type of problem (concept or exercise)"
     )
     parser.add_argument(
@@ -198,21 +297,183 @@ def main():
         default="http://localhost:4000",
         help="URL of the Node.js server"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the on-disk LLM response cache"
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Ignore cached LLM responses but store the new ones"
+    )
+    parser.add_argument(
+        "--async-llm",
+        action="store_true",
+        help="Send prompts through the async client with a shared concurrency limit"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=4,
+        help="Maximum concurrent LLM requests when --async-llm is set"
+    )
+    parser.add_argument(
+        "--stream-code",
+        action="store_true",
+        help="Stream code generation responses and stop once the code block is closed"
+    )
+    parser.add_argument(
+        "--llm-backend",
+        choices=["anthropic", "record", "replay"],
+        default=None,
+        help="Call the API, record every exchange for replay, or replay recordings from the "
+             "local stand-in (default: MANIM_LLM_BACKEND or anthropic)"
+    )
+    parser.add_argument(
+        "--code-candidates",
+        type=int,
+        default=None,
+        help="Generate this many code candidates concurrently and keep the first that passes "
+             "validation (default: MANIM_CODE_CANDIDATES or 1)"
+    )
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="Generate new code even when a similar topic has already been rendered"
+    )
+    parser.add_argument(
+        "--similarity-threshold",
+        type=float,
+        default=None,
+        help="Minimum similarity (0-1) for reusing an already rendered topic "
+             "(default: MANIM_TOPIC_MATCH_THRESHOLD or 0.75)"
+    )
+    parser.add_argument(
+        "--render-repairs",
+        type=int,
+        default=None,
+        help="Targeted code repairs to attempt when the render fails "
+             "(default: MANIM_RENDER_REPAIRS or 2)"
+    )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        metavar="JOB",
+        help="Resume a checkpointed job from its first incomplete stage"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds the whole job may take before its LLM calls and render are stopped "
+             "(default: MANIM_JOB_TIMEOUT or no limit)"
+    )
+    parser.add_argument(
+        "--json-events",
+        action="store_true",
+        help="Write progress events as JSON lines to stdout and the log to stderr"
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="With --json-events, drop the human-readable log"
+    )
+    return parser
+
+def apply_resume(args):
+    """Fill in the job parameters of a --resume run from its checkpoint.
+
+    Returns:
+        The resumed JobCheckpoint, or None for a new job
+
+    Raises:
+        FileNotFoundError: The job to resume was never checkpointed
+        ValueError: A new job is missing its topic, macro topic or problem type
+    """
+    if not args.resume:
+        if not (args.topic and args.macro_topic and args.problem_type):
+            raise ValueError("--topic, --macro-topic and --problem-type are required unless --resume is given")
+        return None
+    checkpoint = JobCheckpoint.resume(args.resume)
+    args.topic = checkpoint.params["topic"]
+    args.macro_topic = checkpoint.params["macro_topic"]
+    args.problem_type = checkpoint.params["problem_type"]
+    print(f"Resuming job {checkpoint.job_id} (completed stages: "
+          f"{', '.join(checkpoint.completed()) or 'none'})")
+    return checkpoint
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
     
+    # In machine mode stdout only carries JSON-line events for the parent process
+    events = start_machine_mode(args.quiet) if args.json_events else None
+    
+    try:
+        checkpoint = apply_resume(args)
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        if events:
+            events.emit("result", success=False, video_path=None, error=str(e), job_id=args.resume,
+                        reused=False)
+        return
+    except ValueError as e:
+        parser.error(str(e))
+    
     print(f"Server URL: {args.server_url}")
     
     # Load environment variables from .env file
     load_dotenv()
     api_key = os.getenv('ANTHROPIC_API_KEY')
     
-    if not api_key:
+    if args.llm_backend:
+        os.environ["MANIM_LLM_BACKEND"] = args.llm_backend
+    
+    # Replays are served by the local stand-in, which needs no key
+    if not api_key and os.getenv("MANIM_LLM_BACKEND") != "replay":
         print("Error: ANTHROPIC_API_KEY not found in environment variables")
         print("Please create a .env file with your API key or set it as an environment variable")
+        if events:
+            events.emit("result", success=False, video_path=None, error="ANTHROPIC_API_KEY not found",
+                        job_id=None, reused=False)
         return
     
     # Initialize the video generator
-    video_gen = VideoGenerator(api_key=api_key)
+    video_gen = VideoGenerator(
+        api_key=api_key,
+        use_cache=False if args.no_cache else None,
+        refresh_cache=True if args.refresh_cache else None,
+        async_llm=args.async_llm,
+        max_in_flight=args.max_in_flight,
+        stream_code=True if args.stream_code else None,
+        llm_backend=args.llm_backend,
+        code_candidates=args.code_candidates,
+        render_repairs=args.render_repairs
+    )
+    result = run_job(args, video_gen, checkpoint, progress=events.listener if events else None)
+    if events:
+        events.emit("result", **result)
+
+def run_job(args, video_gen, checkpoint=None, progress=None, deadline=None):
+    """Run one generation job with an already initialized VideoGenerator.
+
+    Args:
+        args: Parsed job options (see build_parser)
+        video_gen: VideoGenerator to use; a resident one can serve many jobs
+        checkpoint: JobCheckpoint of a resumed job (default: start a new job)
+        progress: Optional listener receiving the job's progress events as dicts
+            (stage_started/stage_finished/stage_failed, render_progress, llm_usage)
+        deadline: JobDeadline the job runs under; cancelling it stops LLM calls and
+            kills the render (default: a new one from --timeout)
+
+    Returns:
+        Dictionary with success, video_path, error, job_id and reused
+    """
+    video_gen.generator.reset_job_accounting()
+    if deadline is None:
+        deadline = JobDeadline.start(args.timeout)
 
     print("\n" + "="*50)
     print("STARTING VISUALIZATION PROCESS")
@@ -223,32 +484,91 @@ def main():
     print(f"Using prompts from: {'concept_prompts.py' if args.problem_type == 'concept' else 'exercise_prompts.py'}")
     print("-"*50)
 
+    # Identical concurrent requests run once: later ones wait here, then reuse the result
+    flight = SingleFlight(coalesce_key(args.topic, args.macro_topic, args.problem_type))
+    if progress is not None:
+        video_gen.generator.add_progress_listener(progress)
+    # Every LLM call and the render of this job stop once the deadline is cancelled or passes
+    video_gen.generator.job_deadline = deadline
+    try:
+        # A job cancelled while an identical one runs stops waiting with JobCancelled
+        flight.acquire(deadline)
+        return _generate(args, video_gen, checkpoint, flight, deadline)
+    finally:
+        flight.release()
+        video_gen.generator.job_deadline = None
+        if progress is not None:
+            video_gen.generator.remove_progress_listener(progress)
+
+def _generate(args, video_gen, checkpoint, flight, deadline):
+    """Body of run_job, run while holding the job's single-flight lock."""
+    emit = video_gen.generator.emit_progress
+    topic_index = TopicIndex(video_gen.code_dir, video_gen.videos_dir,
+                             threshold=args.similarity_threshold)
+    if not args.resume and (not args.regenerate or flight.waited):
+        print("\nSTEP 0: CHECKING ALREADY RENDERED TOPICS")
+        print("-"*50)
+        emit("stage_started", stage="topic_index")
+        lookup_started = time.time()
+        entry = topic_index.lookup(args.topic, args.macro_topic, args.problem_type)
+        video_path = None
+        if entry:
+            video_path = reuse_indexed_topic(video_gen, topic_index, entry, args.topic, args)
+        emit("stage_finished", stage="topic_index",
+             seconds=round(time.time() - lookup_started, 3), reused=bool(video_path))
+        if video_path:
+            print("\n" + "="*50)
+            print("PROCESS COMPLETE")
+            print("="*50)
+            print(f"✓ Reused visualization of '{entry['topic']}' for: '{args.topic}'")
+            print(f"✓ Video saved to: {video_path}")
+            print("Run with --regenerate to generate a new visualization")
+            print("="*50 + "\n")
+            return {"success": True, "video_path": video_path, "error": None,
+                    "job_id": None, "reused": True}
+        if entry:
+            print("⚠️ Falling back to generating a new visualization")
+
+    # Create safe filename (names the code file, artifacts and metrics for this job)
+    safe_filename = create_safe_filename(args.topic, args.problem_type)
+
+    # Every stage output is checkpointed, so a failed job can be resumed where it stopped
+    if checkpoint is None:
+        checkpoint = JobCheckpoint.create({
+            "topic": args.topic,
+            "macro_topic": args.macro_topic,
+            "problem_type": args.problem_type,
+        })
+    print(f"Job id: {checkpoint.job_id}")
+
     # Define the LLM response function that will be used by process_math_visualization_request
     @retry(stop=stop_after_attempt(5), 
-           wait=wait_exponential(multiplier=1, min=4, max=30))
+           wait=wait_exponential(multiplier=1, min=4, max=30),
+           retry=retry_if_not_exception_type(JobCancelled))
     def get_llm_response(prompt):
         try:
+            stage = infer_prompt_stage(prompt)
             print("\nSending prompt to AI model...")
-            print("Prompt type:", end=" ")
-            if "TOPIC_EXTRACTION" in prompt:
-                print("ANALYZING QUERY TYPE (Exercise/Concept/Visualization)")
-            elif "CONCEPT_BREAKDOWN" in prompt:
-                print("BREAKING DOWN MATHEMATICAL CONCEPT")
-            elif "DESIGN" in prompt:
-                print("DESIGNING ANIMATION")
-            elif "ANIMATION_TESTING" in prompt:
-                print("TESTING ANIMATION DESIGN")
-            elif "CODE_GENERATION" in prompt:
-                print("GENERATING MANIM CODE")
-            else:
-                print("OTHER")
+            print(f"Prompt type: {stage.upper()}")
             
-            response = video_gen.generator._send_prompt(prompt)
+            # Code prompts ask for <CODE_START> tags, so the stream can stop at the closing tag
+            is_code_prompt = "<CODE_START>" in prompt
+            response = video_gen.generator._send_prompt(
+                prompt,
+                stop_at_code_end=is_code_prompt and video_gen.generator.stream_code,
+                stage=stage,
+                validate=STAGE_VALIDATORS.get(stage)
+            )
             print("Response received!")
             return response
         except Exception as e:
             print(f"Error getting LLM response: {e}")
             raise  # Re-raise the exception to trigger retry
+    
+    def race_code(prompt, accept):
+        """Race several code generation candidates and return the first accepted code"""
+        code, _ = video_gen.generator.race_prompt(prompt, accept, stage="code_generation")
+        return code
 
     print("\nSTEP 1: ANALYZING QUERY")
     print("-"*50)
@@ -256,13 +576,24 @@ def main():
         query=args.topic,
         macro_topic=args.macro_topic,
         problem_type=args.problem_type,
-        get_llm_response_func=get_llm_response
+        get_llm_response_func=get_llm_response,
+        race_code_func=race_code if video_gen.generator.code_candidates > 1 else None,
+        code_session=video_gen.generator.start_session(
+            "code_generation", stop_at_code_end=video_gen.generator.stream_code
+        ),
+        checkpoint=checkpoint,
+        progress=emit,
+        cancelled=deadline.cancelled
     )
 
     if not visualization_result['success']:
         print("\n❌ VISUALIZATION REQUEST FAILED")
         print(f"Error: {visualization_result.get('error', 'Unknown error')}")
-        return
+        print(f"Resume with: --resume {checkpoint.job_id}")
+        save_llm_metrics(video_gen, safe_filename, args)
+        return {"success": False, "video_path": None,
+                "error": visualization_result.get('error', 'Unknown error'),
+                "job_id": checkpoint.job_id, "reused": False}
 
     print("\nSTEP 2: EXTRACTING RESULTS")
     print("-"*50)
@@ -276,12 +607,11 @@ def main():
     print(f"Scene plan length: {len(scene_plan) if scene_plan else 0} characters")
     print(f"Generated code length: {len(code) if code else 0} characters")
 
+    error = None
     if code:
         print("\nSTEP 3: SAVING CODE AND GENERATING VIDEO")
         print("-"*50)
         
-        # Create safe filename
-        safe_filename = create_safe_filename(args.topic, args.problem_type)
         code_filename = f"{safe_filename}.py"
         code_path = os.path.join(video_gen.code_dir, code_filename)
         
@@ -293,10 +623,35 @@ def main():
                 f.write(code)
             print(f"✓ Code saved successfully")
 
+            deadline.check()
+
             print("\nSTEP 4: GENERATING ANIMATION")
             print("-"*50)
-            print("Running Manim to generate video...")
-            result = video_gen.generate_video_from_code(code_path, args.topic)
+            emit("stage_started", stage="render")
+            render_started = time.time()
+            result = None
+            if checkpoint.has("render"):
+                result = checkpoint.load("render")["video_path"]
+                if os.path.exists(result):
+                    print(f"✓ Render restored from checkpoint: {result}")
+                else:
+                    result = None
+            if result is None:
+                print("Running Manim to generate video...")
+                result = video_gen.generate_video_from_code(code_path, args.topic)
+                report = video_gen.last_render_report
+                if report and report["outcome"] == "repaired":
+                    # Save the repaired code, not the code that failed to render
+                    with open(code_path, 'r') as f:
+                        code = f.read()
+                if isinstance(result, str):
+                    checkpoint.save("render", {"video_path": result})
+            if isinstance(result, str):
+                emit("stage_finished", stage="render", seconds=round(time.time() - render_started, 3))
+            else:
+                emit("stage_failed", stage="render", error="Video generation failed")
+            emit("stage_started", stage="upload")
+            upload_started = time.time()
             
             if isinstance(result, str):
                 success = True
@@ -314,6 +669,9 @@ def main():
                     f.write(animation_design)
                 print("✓ Saved animation design")
                 print(f"✓ All artifacts saved to: {artifacts_dir}")
+                
+                topic_index.register(args.topic, code_path, result, artifacts_dir,
+                                     args.macro_topic, args.problem_type)
             else:
                 success = False
                 print("❌ Video generation failed")
@@ -331,20 +689,15 @@ def main():
                 "animationDesign": animation_design
             }
             
-            print("Sending data to database...")
-            endpoint_url = f"{args.server_url}/videos/save-from-python"
-            response = requests.post(
-                endpoint_url,
-                json=data,
-                headers={"Content-Type": "application/json"},
-                timeout=30
-            )
-            
-            if response.status_code == 201:
-                print("✓ Successfully saved to database")
-            else:
-                print(f"❌ Failed to save to database (Status: {response.status_code})")
+            save_to_database(args.server_url, data)
+            emit("stage_finished", stage="upload", seconds=round(time.time() - upload_started, 3))
 
+        except JobCancelled as e:
+            print(f"\n⚠️ {e}")
+            emit("stage_failed", stage="render", error=str(e))
+            success = False
+            result = None
+            error = str(e)
         except Exception as e:
             print(f"\n❌ ERROR: {str(e)}")
             traceback.print_exc()
@@ -359,10 +712,19 @@ def main():
             print(f"✓ Video saved to: {result}")
         else:
             print(f"❌ Failed to create visualization for: '{args.topic}'")
+            print(f"Resume with: --resume {checkpoint.job_id}")
+        print(video_gen.generator.cache_summary())
         print("="*50 + "\n")
     else:
         print("\n❌ CODE GENERATION FAILED")
         print("No code was generated")
+        success, result = False, None
+
+    save_llm_metrics(video_gen, safe_filename, args)
+    if not success and not error:
+        error = "Video generation failed" if code else "No code was generated"
+    return {"success": success, "video_path": result if success else None, "error": error,
+            "job_id": checkpoint.job_id, "reused": False}
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,266 @@
+from dotenv import load_dotenv
+import os
+import time
+import argparse
+import traceback
+from generate_video_exercise import VideoGenerator
+from prompts_exercise import process_math_visualization_request
+from llm_batch import BatchCollector
+from topic_index import TopicIndex
+from job_lock import coalesce_key
+from main_exercise import (
+    validate_macro_topic,
+    validate_problem_type,
+    create_safe_filename,
+    infer_prompt_stage,
+    save_to_database,
+    reuse_indexed_topic,
+    STAGE_VALIDATORS
+)
+
+
+def load_topics(args):
+    """Collect topics from --topic flags and --topics-file, dropping duplicates.
+
+    Topics that only differ in case, word order or plurals count as duplicates.
+    """
+    topics = list(args.topic or [])
+    if args.topics_file:
+        with open(args.topics_file, 'r') as f:
+            topics.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    unique = {}
+    for topic in topics:
+        unique.setdefault(coalesce_key(topic, args.macro_topic, args.problem_type), topic)
+    return list(unique.values())
+
+
+def finish_topic(video_gen, topic_index, topic, visualization_result, args):
+    """Save the generated code, render it and store the result, like main_exercise does."""
+    safe_filename = create_safe_filename(topic, args.problem_type)
+    code = visualization_result['code']
+    animation_design = visualization_result['animation_design']
+
+    code_path = os.path.join(video_gen.code_dir, f"{safe_filename}.py")
+    with open(code_path, 'w') as f:
+        f.write(code)
+    print(f"✓ Code saved to: {code_path}")
+
+    if args.no_render:
+        return code_path
+
+    result = video_gen.generate_video_from_code(code_path, topic)
+    success = isinstance(result, str)
+    if success:
+        artifacts_dir = os.path.join(video_gen.videos_dir, f"{safe_filename}_artifacts")
+        os.makedirs(artifacts_dir, exist_ok=True)
+        with open(os.path.join(artifacts_dir, "animation_design.txt"), 'w') as f:
+            f.write(animation_design)
+        topic_index.register(topic, code_path, result, artifacts_dir, args.macro_topic, args.problem_type)
+        print(f"✓ Video saved to: {result}")
+    else:
+        print(f"❌ Video generation failed for '{topic}'")
+
+    save_to_database(args.server_url, {
+        "topic": topic,
+        "macroTopic": args.macro_topic,
+        "problemType": args.problem_type,
+        "code": code,
+        "status": "completed" if success else "failed",
+        "videoPath": result if success else "",
+        "animationDesign": animation_design
+    })
+    return result if success else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate visualizations for many topics, sending each LLM stage as one message batch"
+    )
+    parser.add_argument(
+        "--topic",
+        action="append",
+        help="Topic to generate (repeat for several topics)"
+    )
+    parser.add_argument(
+        "--topics-file",
+        type=str,
+        default=None,
+        help="File with one topic per line"
+    )
+    parser.add_argument(
+        "--macro-topic",
+        type=validate_macro_topic,
+        required=True,
+        help="Main topic area (linear algebra, probability, or calculus)"
+    )
+    parser.add_argument(
+        "--problem-type",
+        type=validate_problem_type,
+        required=True,
+        help="Type of problem (concept or exercise)"
+    )
+    parser.add_argument(
+        "--server-url",
+        type=str,
+        default="http://localhost:4000",
+        help="URL of the Node.js server"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=None,
+        help="Seconds between batch status checks (default: MANIM_LLM_BATCH_POLL or 30)"
+    )
+    parser.add_argument(
+        "--no-render",
+        action="store_true",
+        help="Only generate and save code, without rendering or saving to the database"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the on-disk LLM response cache"
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Ignore cached LLM responses but store the new ones"
+    )
+    parser.add_argument(
+        "--llm-backend",
+        choices=["anthropic", "record", "replay"],
+        default=None,
+        help="Call the API, record every exchange for replay, or replay recordings from the "
+             "local stand-in (default: MANIM_LLM_BACKEND or anthropic)"
+    )
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="Generate new code even for topics similar to an already rendered one"
+    )
+    parser.add_argument(
+        "--similarity-threshold",
+        type=float,
+        default=None,
+        help="Minimum similarity (0-1) for reusing an already rendered topic "
+             "(default: MANIM_TOPIC_MATCH_THRESHOLD or 0.75)"
+    )
+    args = parser.parse_args()
+
+    topics = load_topics(args)
+    if not topics:
+        parser.error("Give at least one --topic or a --topics-file")
+
+    load_dotenv()
+    api_key = os.getenv('ANTHROPIC_API_KEY')
+
+    if args.llm_backend:
+        os.environ["MANIM_LLM_BACKEND"] = args.llm_backend
+
+    # Replays are served by the local stand-in, which needs no key
+    if not api_key and os.getenv("MANIM_LLM_BACKEND") != "replay":
+        print("Error: ANTHROPIC_API_KEY not found in environment variables")
+        print("Please create a .env file with your API key or set it as an environment variable")
+        return
+
+    video_gen = VideoGenerator(
+        api_key=api_key,
+        use_cache=False if args.no_cache else None,
+        refresh_cache=True if args.refresh_cache else None,
+        llm_backend=args.llm_backend
+    )
+    collector = BatchCollector(video_gen.generator, poll_interval=args.poll_interval)
+
+    print("\n" + "="*50)
+    print("STARTING BATCH VISUALIZATION PROCESS")
+    print("="*50)
+    print(f"Topics: {len(topics)}")
+    print(f"Macro topic: '{args.macro_topic}'")
+    print(f"Problem type: '{args.problem_type}'")
+    print("-"*50)
+
+    def run_topic(topic, send_prompt):
+        def get_llm_response(prompt):
+            stage = infer_prompt_stage(prompt)
+            return send_prompt(prompt, stage=stage, validate=STAGE_VALIDATORS.get(stage))
+
+        return process_math_visualization_request(
+            query=topic,
+            macro_topic=args.macro_topic,
+            problem_type=args.problem_type,
+            get_llm_response_func=get_llm_response,
+            # Its three stages send prompts concurrently; each counts toward the batch
+            progress=collector.track_stage
+        )
+
+    outcomes = []
+    topic_index = TopicIndex(video_gen.code_dir, video_gen.videos_dir,
+                             threshold=args.similarity_threshold)
+    if not args.regenerate:
+        print("\nSTEP 0: CHECKING ALREADY RENDERED TOPICS")
+        print("-"*50)
+        topic_index.refresh()
+        remaining = []
+        for topic in topics:
+            entry, score = topic_index.find(topic, args.macro_topic, args.problem_type)
+            if not entry:
+                remaining.append(topic)
+                continue
+            print(f"\n✓ '{topic}' matches '{entry['topic']}' (similarity {score:.2f})")
+            if args.no_render:
+                output = entry['code_path']
+            else:
+                output = reuse_indexed_topic(video_gen, topic_index, entry, topic, args)
+            if output:
+                outcomes.append((topic, output))
+            else:
+                remaining.append(topic)
+        print(f"\n{len(topics) - len(remaining)} topics reused, {len(remaining)} to generate")
+        topics = remaining
+
+    print("\nSTEP 1: GENERATING CODE FOR ALL TOPICS IN BATCHES")
+    print("-"*50)
+    started = time.time()
+    results = collector.run_pipelines(topics, run_topic)
+    print(f"\n✓ LLM stages finished in {time.time() - started:.1f}s "
+          f"using {collector.batches_submitted} batches")
+
+    # Topics are rendered one at a time here; main_curriculum.py overlaps renders with LLM stages
+    print("\nSTEP 2: SAVING AND RENDERING")
+    print("-"*50)
+    for topic, visualization_result in zip(topics, results):
+        print(f"\nTopic: '{topic}'")
+        if not visualization_result or not visualization_result.get('success'):
+            error = (visualization_result or {}).get('error', 'Unknown error')
+            print(f"❌ Visualization request failed: {error}")
+            outcomes.append((topic, None))
+            continue
+        try:
+            outcomes.append((topic, finish_topic(video_gen, topic_index, topic, visualization_result, args)))
+        except Exception as e:
+            print(f"❌ ERROR: {str(e)}")
+            traceback.print_exc()
+            outcomes.append((topic, None))
+
+    metrics_path = os.path.join(video_gen.videos_dir, f"batch_{int(started)}_llm_metrics.json")
+    video_gen.generator.write_metrics(metrics_path, job={
+        "topics": topics,
+        "macro_topic": args.macro_topic,
+        "problem_type": args.problem_type,
+        "pipeline": "main_exercise_batch",
+        "batches": collector.batches_submitted
+    })
+
+    print("\n" + "="*50)
+    print("BATCH COMPLETE")
+    print("="*50)
+    for topic, output in outcomes:
+        print(f"{'✓' if output else '❌'} {topic}{f': {output}' if output else ''}")
+    print(f"{sum(1 for _, output in outcomes if output)}/{len(outcomes)} topics succeeded")
+    print(video_gen.generator.cache_summary())
+    print(video_gen.generator.usage_summary())
+    print("="*50 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,14 @@ import json
 import re
 import traceback
 from generate_video_exercise import VideoGenerator
+from topic_index import TopicIndex
+from job_lock import SingleFlight, coalesce_key
+from stage_dag import StageGraph, StageError
+from job_checkpoint import JobCheckpoint
+from event_stream import start_machine_mode
+from job_deadline import JobDeadline, JobCancelled
+from code_normalizer import write_code
+from response_parser import parse_response
 from prompts_test_ic_enhanced import (
     VIDEO_IDEA_GENERATOR_SYSTEM_PROMPT, 
     VIDEO_IDEA_GENERATOR_USER_PROMPT,
@@ -25,7 +33,29 @@ from prompts_test_ic_enhanced import (
     KEY_TAKEAWAYS_USER_PROMPT
 )
 import time
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
+
+# Stage names for the per-stage LLM metrics, keyed by the static system prompt
+STAGE_BY_SYSTEM_PROMPT = {
+    VIDEO_IDEA_GENERATOR_SYSTEM_PROMPT: "video_ideas",
+    SCENE_PLANNER_SYSTEM_PROMPT: "scene_plan",
+    SCENE_EVALUATOR_SYSTEM_PROMPT: "scene_evaluation",
+    CODE_GENERATOR_SYSTEM_PROMPT: "code_generation",
+    CODE_LAYOUT_EVALUATOR_SYSTEM_PROMPT: "layout_evaluation",
+    KEY_TAKEAWAYS_SYSTEM_PROMPT: "key_takeaways",
+}
+
+# Checks on stages that run on the smaller model; a failing reply is re-sent to the larger one
+STAGE_VALIDATORS = {
+    "scene_evaluation": lambda response: len(response.split()) >= 20,
+    "key_takeaways": lambda response: len(response.split()) >= 10 and "•" in response,
+}
+
+# Template output for optional stages while the circuit breaker is open
+STAGE_FALLBACKS = {
+    # Skips the revision step, keeping the plan as generated
+    "scene_evaluation": "Scene evaluation unavailable - the scene plan is kept as generated.",
+}
 
 def create_safe_filename(topic, suffix="_ic"):
     """Create a safe filename from the topic with optional suffix.
@@ -47,70 +77,60 @@ def create_safe_filename(topic, suffix="_ic"):
 
 def extract_code_from_response(response):
     """Extract code between python tags."""
-    pattern = r'```python\s*(.*?)\s*```'
-    match = re.search(pattern, response, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return None
+    code = parse_response(response)["fences"].get("python")
+    return code.strip() if code is not None else None
 
-def validate_and_fix_manim_code(code):
-    """Perform basic validation and fixes on Manim code before saving."""
-    if not code:
-        return None
-        
-    # Check for critical errors
-    critical_issues = []
-    
-    # 1. Check for proper import
-    if not re.search(r'from\s+manim\s+import', code):
-        critical_issues.append("Missing manim imports")
-        code = "from manim import *\n\n" + code
-    
-    # 2. Check for class definition
-    if not re.search(r'class\s+\w+\s*\(\s*Scene\s*\)', code):
-        critical_issues.append("Missing Scene class definition")
-    
-    # 3. Check for construct method
-    if not re.search(r'def\s+construct\s*\(\s*self\s*\)', code):
-        critical_issues.append("Missing construct method")
-    
-    if critical_issues:
-        print("⚠️ Issues in generated code (attempting fixes):")
-        for issue in critical_issues:
-            print(f"  - {issue}")
-    
-    # Ensure imports are complete
-    if 'from manim import' in code and 'from manim import *' not in code:
-        code = code.replace('from manim import', 'from manim import *')
-        print("✓ Fixed incomplete import statement")
-    
-    # Apply additional fixes: Comment any plain text lines
-    lines = code.split('\n')
-    fixed_lines = []
-    in_function_def = False
-    
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        
-        # Skip empty lines or already commented lines
-        if not stripped or stripped.startswith('#'):
-            fixed_lines.append(line)
-            continue
-        
-        # Track if we're in a function definition
-        if re.match(r'\s*def\s+', line):
-            in_function_def = True
-        
-        # Check if line looks like a descriptive text without code elements
-        if in_function_def and not any(char in stripped for char in "={}[](),.+-*/:'\"\\"):
-            # Comment it as descriptive text
-            leading_space = len(line) - len(line.lstrip())
-            fixed_lines.append(' ' * leading_space + '# ' + stripped)
-            print(f"⚠️ Line {i+1}: Commented text '{stripped}'")
+# Artifacts a reused topic needs for its database record
+IC_ARTIFACTS = ("scene_plan.txt", "key_takeaways.txt")
+
+def reuse_indexed_topic(video_gen, topic_index, entry, args):
+    """Serve a request from an already generated topic instead of calling the LLM.
+
+    Indexed code without a video is rendered first.
+
+    Returns:
+        Video path, or None if the indexed code could not be rendered
+    """
+    with open(entry['code_path'], 'r') as f:
+        code = f.read()
+    print(f"✓ Reusing code: {entry['code_path']}")
+
+    video_path = entry.get('video_path')
+    if not video_path:
+        print("Indexed code has no video yet - rendering it")
+        result = video_gen.generate_video_from_code(entry['code_path'], args.topic)
+        if not isinstance(result, str):
+            print("❌ Rendering the indexed code failed")
+            return None
+        video_path = result
+        topic_index.register(entry['topic'], entry['code_path'], video_path, entry.get('artifacts_dir'),
+                             problem_type="ic")
+    print(f"✓ Reusing video: {video_path}")
+
+    data = {
+        "topic": args.topic,
+        "code": code,
+        "status": "completed",
+        "videoPath": f"backend/manim/content/videos_dir/{os.path.basename(video_path)}",
+        "scenePlan": topic_index.read_artifact(entry, "scene_plan.txt"),
+        "keyTakeaways": topic_index.read_artifact(entry, "key_takeaways.txt").strip()
+    }
+    print("Sending data to database...")
+    # The video exists either way, so a database outage must not fail the job
+    try:
+        response = requests.post(
+            f"{args.server_url}/videos/save-from-python",
+            json=data,
+            headers={"Content-Type": "application/json"},
+            timeout=30
+        )
+        if response.status_code == 201:
+            print("✓ Successfully saved to database")
         else:
-            fixed_lines.append(line)
-    
-    return '\n'.join(fixed_lines)
+            print(f"❌ Failed to save to database (Status: {response.status_code})")
+    except Exception as e:
+        print(f"⚠️ Could not save '{args.topic}' to the database: {e}")
+    return video_path
 
 def main():
     # Parse command-line arguments
@@ -118,8 +138,8 @@ def main():
     parser.add_argument(
         "--topic", 
         type=str, 
-        required=True, 
-        help="Mathematical topic to animate"
+        default=None, 
+        help="Mathematical topic to animate (required unless --resume is given)"
     )
     parser.add_argument(
         "--server-url", 
@@ -127,7 +147,113 @@ def main():
         default="http://localhost:4000",
         help="URL of the Node.js server"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the on-disk LLM response cache"
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Ignore cached LLM responses but store the new ones"
+    )
+    parser.add_argument(
+        "--async-llm",
+        action="store_true",
+        help="Send prompts through the async client with a shared concurrency limit"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=4,
+        help="Maximum concurrent LLM requests when --async-llm is set"
+    )
+    parser.add_argument(
+        "--stream-code",
+        action="store_true",
+        help="Stream code generation responses and stop once the code block is closed"
+    )
+    parser.add_argument(
+        "--llm-backend",
+        choices=["anthropic", "record", "replay"],
+        default=None,
+        help="Call the API, record every exchange for replay, or replay recordings from the "
+             "local stand-in (default: MANIM_LLM_BACKEND or anthropic)"
+    )
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="Generate a new animation even when a similar topic has already been rendered"
+    )
+    parser.add_argument(
+        "--similarity-threshold",
+        type=float,
+        default=None,
+        help="Minimum similarity (0-1) for reusing an already rendered topic "
+             "(default: MANIM_TOPIC_MATCH_THRESHOLD or 0.75)"
+    )
+    parser.add_argument(
+        "--render-repairs",
+        type=int,
+        default=None,
+        help="Targeted code repairs to attempt when the render fails "
+             "(default: MANIM_RENDER_REPAIRS or 2)"
+    )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        metavar="JOB",
+        help="Resume a checkpointed job from its first incomplete stage"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds the whole job may take before its LLM calls and render are stopped "
+             "(default: MANIM_JOB_TIMEOUT or no limit)"
+    )
+    parser.add_argument(
+        "--json-events",
+        action="store_true",
+        help="Write progress events as JSON lines to stdout and the log to stderr"
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="With --json-events, drop the human-readable log"
+    )
     args = parser.parse_args()
+    if not args.resume and not args.topic:
+        parser.error("--topic is required unless --resume is given")
+    
+    # In machine mode stdout only carries JSON-line events for the parent process
+    events = start_machine_mode(args.quiet) if args.json_events else None
+    result = run_pipeline(args, events)
+    if events:
+        events.emit("result", **result)
+
+def run_pipeline(args, events=None):
+    """Run the pipeline for the parsed options of main().
+
+    Args:
+        args: Parsed command-line options
+        events: Optional EventStream receiving the job's progress events
+
+    Returns:
+        Dictionary with success, video_path, error, job_id and reused
+    """
+    checkpoint = None
+    if args.resume:
+        try:
+            checkpoint = JobCheckpoint.resume(args.resume)
+        except FileNotFoundError as e:
+            print(f"❌ {e}")
+            return {"success": False, "video_path": None, "error": str(e),
+                    "job_id": args.resume, "reused": False}
+        args.topic = checkpoint.params["topic"]
+        print(f"Resuming job {checkpoint.job_id} (completed stages: "
+              f"{', '.join(checkpoint.completed()) or 'none'})")
     
     # Load environment variables from .env file
     load_dotenv()
@@ -137,13 +263,32 @@ def main():
     print(f"Environment variables loaded: {os.environ.get('ANTHROPIC_API_KEY')}")
     print(f"API key loaded: {api_key}")
     
-    if not api_key:
+    if args.llm_backend:
+        os.environ["MANIM_LLM_BACKEND"] = args.llm_backend
+    
+    # Replays are served by the local stand-in, which needs no key
+    if not api_key and os.getenv("MANIM_LLM_BACKEND") != "replay":
         print("Error: ANTHROPIC_API_KEY not found in environment variables")
         print("Please create a .env file with your API key or set it as an environment variable")
-        return
+        return {"success": False, "video_path": None, "error": "ANTHROPIC_API_KEY not found",
+                "job_id": None, "reused": False}
     
     # Initialize the video generator
-    video_gen = VideoGenerator(api_key=api_key)
+    video_gen = VideoGenerator(
+        api_key=api_key,
+        use_cache=False if args.no_cache else None,
+        refresh_cache=True if args.refresh_cache else None,
+        async_llm=args.async_llm,
+        max_in_flight=args.max_in_flight,
+        stream_code=True if args.stream_code else None,
+        llm_backend=args.llm_backend,
+        render_repairs=args.render_repairs
+    )
+    if events:
+        video_gen.generator.add_progress_listener(events.listener)
+    # Every LLM call and the render stop once the job's deadline passes
+    deadline = JobDeadline.start(args.timeout)
+    video_gen.generator.job_deadline = deadline
     
     print("\n" + "="*50)
     print("STARTING VISUALIZATION PROCESS")
@@ -152,29 +297,90 @@ def main():
     print("Using simplified prompts from prompts_test_ic.py")
     print("-"*50)
     
+    # Identical concurrent requests run once: later ones wait here, then reuse the result
+    flight = SingleFlight(coalesce_key(args.topic, problem_type="ic"))
+    try:
+        # A job cancelled while an identical one runs stops waiting with JobCancelled
+        flight.acquire(deadline)
+        return _generate(args, video_gen, checkpoint, flight, deadline)
+    finally:
+        flight.release()
+
+def _generate(args, video_gen, checkpoint, flight, deadline):
+    """Body of run_pipeline, run while holding the topic's SingleFlight lock."""
+    emit = video_gen.generator.emit_progress
+    
+    topic_index = TopicIndex(video_gen.code_dir, video_gen.videos_dir,
+                             threshold=args.similarity_threshold)
+    if not args.resume and (not args.regenerate or flight.waited):
+        print("\nSTEP 0: CHECKING ALREADY RENDERED TOPICS")
+        print("-"*50)
+        emit("stage_started", stage="topic_index")
+        lookup_started = time.time()
+        # Only IC topics have the scene plan and key takeaways a reused job posts
+        entry = topic_index.lookup(args.topic, problem_type="ic", requires=IC_ARTIFACTS)
+        video_path = None
+        if entry:
+            video_path = reuse_indexed_topic(video_gen, topic_index, entry, args)
+        emit("stage_finished", stage="topic_index",
+             seconds=round(time.time() - lookup_started, 3), reused=bool(video_path))
+        if video_path:
+            print("\n" + "="*50)
+            print("PROCESS COMPLETE")
+            print("="*50)
+            print(f"✓ Reused visualization of '{entry['topic']}' for: '{args.topic}'")
+            print(f"✓ Video saved to: {video_path}")
+            print("Run with --regenerate to generate a new visualization")
+            print("="*50 + "\n")
+            return {"success": True, "video_path": video_path, "error": None,
+                    "job_id": None, "reused": True}
+        if entry:
+            print("⚠️ Falling back to generating a new visualization")
+    
+    # Create safe filename with _ic suffix (also names the per-job metrics file)
+    safe_filename = create_safe_filename(args.topic, "_ic")
+    metrics_path = os.path.join(video_gen.videos_dir, f"{safe_filename}_llm_metrics.json")
+    
+    # Every stage output is checkpointed, so a failed job can be resumed where it stopped
+    if checkpoint is None:
+        checkpoint = JobCheckpoint.create({"topic": args.topic, "pipeline": "main_test_ic"})
+    print(f"Job id: {checkpoint.job_id}")
+    
     # Define the LLM response function
     @retry(stop=stop_after_attempt(3), 
-           wait=wait_exponential(multiplier=1, min=2, max=10))
+           wait=wait_exponential(multiplier=1, min=2, max=10),
+           retry=retry_if_not_exception_type(JobCancelled))
     def get_llm_response(system_prompt, user_prompt):
         try:
-            print("\nSending prompt to AI model...")
-            # Combine system and user prompts into a single message
-            combined_prompt = f"{system_prompt}\n\n{user_prompt}"
-            response = video_gen.generator._send_prompt(combined_prompt)
+            stage = STAGE_BY_SYSTEM_PROMPT.get(system_prompt, "other")
+            print(f"\nSending prompt to AI model ({stage})...")
+            # Only the code generator's reply can be cut at the closing ```python fence;
+            # the layout evaluator may return several blocks and uses the last one
+            is_code_prompt = system_prompt == CODE_GENERATOR_SYSTEM_PROMPT
+            # The static system prompt goes in its own cacheable block
+            response = video_gen.generator._send_prompt(
+                user_prompt,
+                system=system_prompt,
+                stop_at_code_end=is_code_prompt and video_gen.generator.stream_code,
+                stage=stage,
+                validate=STAGE_VALIDATORS.get(stage),
+                fallback=STAGE_FALLBACKS.get(stage)
+            )
             print("Response received!")
             return response
         except Exception as e:
             print(f"Error getting LLM response: {e}")
             raise  # Re-raise the exception to trigger retry
     
-    try:
+    # Pipeline stages; each one reads only the values named in the DAG below
+    def video_ideas_stage(topic):
         # Step 1: Generate video ideas
         print("\nSTEP 1: GENERATING VIDEO IDEAS")
         print("-"*50)
         
         video_ideas_response = get_llm_response(
             system_prompt=VIDEO_IDEA_GENERATOR_SYSTEM_PROMPT,
-            user_prompt=VIDEO_IDEA_GENERATOR_USER_PROMPT.format(video_prompt=args.topic)
+            user_prompt=VIDEO_IDEA_GENERATOR_USER_PROMPT.format(video_prompt=topic)
         )
         
         # Parse video ideas - we'll assume the response is the full set of scene descriptions
@@ -185,16 +391,16 @@ def main():
         scenes = [scene for scene in scenes if len(scene) > 20]  # Minimal length check
         
         if not scenes:
-            print("❌ Failed to generate scene ideas")
-            return
+            raise StageError("Failed to generate scene ideas")
         
         print(f"✓ Generated {len(scenes)} scene ideas")
         for i, scene in enumerate(scenes):
             print(f"\nScene {i+1}: {scene[:100]}...")
         
         # We'll just use the first scene for this test
-        selected_scene = scenes[0]
-        
+        return scenes[0]
+    
+    def scene_plan_stage(selected_scene):
         # Step 2: Plan the scene in detail
         print("\nSTEP 2: PLANNING SCENE IN DETAIL")
         print("-"*50)
@@ -206,12 +412,14 @@ def main():
         
         scene_plan = scene_plan_response.strip()
         if not scene_plan:
-            print("❌ Failed to generate scene plan")
-            return
+            raise StageError("Failed to generate scene plan")
         
         print(f"✓ Generated scene plan ({len(scene_plan)} characters)")
         print(f"\nScene plan preview: {scene_plan[:200]}...")
-        
+        return scene_plan
+    
+    def scene_review_stage(selected_scene, draft_scene_plan):
+        scene_plan = draft_scene_plan
         # Step 3: Evaluate the scene plan
         print("\nSTEP 3: EVALUATING SCENE PLAN")
         print("-"*50)
@@ -245,7 +453,9 @@ def main():
             print(f"✓ Generated improved scene plan ({len(scene_plan)} characters)")
         else:
             print("✓ Scene plan meets all criteria")
-        
+        return scene_plan
+    
+    def code_stage(scene_plan):
         # Step 4: Generate Manim code
         print("\nSTEP 4: GENERATING MANIM CODE")
         print("-"*50)
@@ -259,9 +469,8 @@ def main():
         code = extract_code_from_response(code_response)
         
         if not code:
-            print("❌ Failed to extract code from response")
             print("Response preview:", code_response[:200])
-            return
+            raise StageError("Failed to extract code from response")
         
         # First, do basic validation and fixes
         fixed_code = validate_and_fix_manim_code(code)
@@ -276,149 +485,87 @@ def main():
             code = layout_fixed_code
             print("✓ Applied layout optimization")
         
-        # Add boundary enforcement
-        print("\nSTEP 4b: ADDING BOUNDARY CHECKS")
-        print("-"*50)
-        boundary_checked_code = enforce_boundary_checks(code)
-        if boundary_checked_code != code:
-            code = boundary_checked_code
-            print("✓ Added boundary safety checks to ensure text stays within frame")
-            print("   • Added safe_position utility function")
-            print("   • Added background rectangles for text")
-            print("   • Added automatic zone positioning (TOP/MIDDLE/BOTTOM)")
-        
         print(f"✓ Generated Manim code ({len(code)} characters)")
+        return code
+    
+    def key_takeaways_stage(topic):
+        print("\nSTEP 6a: GENERATING KEY TAKEAWAYS")
+        print("-"*50)
+        return generate_key_takeaways(topic, get_llm_response)
+    
+    success, result, error = False, None, None
+    try:
+        # The key takeaways only need the topic, so they are generated while the scene
+        # is planned and coded instead of after the render
+        graph = StageGraph("ic_pipeline", checkpoint=checkpoint, emit=emit,
+                           cancelled=deadline.cancelled)
+        graph.add("video_ideas", video_ideas_stage, inputs=["topic"], outputs=["selected_scene"])
+        graph.add("scene_plan", scene_plan_stage, inputs=["selected_scene"],
+                  outputs=["draft_scene_plan"])
+        graph.add("scene_evaluation", scene_review_stage,
+                  inputs=["selected_scene", "draft_scene_plan"], outputs=["scene_plan"])
+        graph.add("code_generation", code_stage, inputs=["scene_plan"], outputs=["code"])
+        graph.add("key_takeaways", key_takeaways_stage, inputs=["topic"])
+        try:
+            values = graph.run(topic=args.topic)
+        except StageError as e:
+            print(f"Resume with: --resume {checkpoint.job_id}")
+            return {"success": False, "video_path": None, "error": str(e),
+                    "job_id": checkpoint.job_id, "reused": False}
+        scene_plan = values["scene_plan"]
+        code = values["code"]
+        key_takeaways = values["key_takeaways"]
         
         # Create class name for the code
         safe_title = ''.join(c for c in args.topic if c.isalnum() or c.isspace())
         class_name = ''.join(word.capitalize() for word in safe_title.split()) + 'Scene'
         
-        # Make sure the code uses the correct class name
-        if f"class {class_name}" not in code:
-            old_class_match = re.search(r'class\s+(\w+)\s*\(\s*Scene\s*\)', code)
-            if old_class_match:
-                old_class_name = old_class_match.group(1)
-                code = code.replace(f"class {old_class_name}", f"class {class_name}")
-                print(f"✓ Renamed class from {old_class_name} to {class_name}")
+        # Add boundary enforcement, fix coordinate dimensions and make sure the
+        # code uses the correct class name, all in one pass over the code
+        print("\nSTEP 4b: ADDING BOUNDARY CHECKS AND FIXING COORDINATES")
+        print("-"*50)
+        code, fixes = enforce_boundary_checks(code, class_name)
+        for fix in fixes:
+            print(f"✓ {fix}")
+        if not fixes:
+            print("✓ Code needed no further fixes")
         
         # Step 5: Save the code and generate the video
         print("\nSTEP 5: SAVING CODE AND GENERATING VIDEO")
         print("-"*50)
         
-        # Create safe filename with _ic suffix
-        safe_filename = create_safe_filename(args.topic, "_ic")
         code_filename = f"{safe_filename}.py"
         code_path = os.path.join(video_gen.code_dir, code_filename)
         
         # Save the code
         print(f"Creating code file: {code_filename}")
-        os.makedirs(os.path.dirname(code_path), exist_ok=True)
-        with open(code_path, 'w') as f:
-            f.write(code)
+        write_code(code_path, code)
         print(f"✓ Code saved successfully as {code_filename}")
         
-        # After code generation and before running the animation
-        # Add a final code validation step
-        print("\nSTEP 4c: FINAL CODE VALIDATION")
-        print("-"*50)
-        
-        # Basic syntax check - make sure there are no \1, \2, etc.
-        if re.search(r'\\[0-9]', code):
-            print("⚠️ Found invalid escape sequences in the code - fixing...")
-            code = re.sub(r'\\[0-9]', '', code)
-            with open(code_path, 'w') as f:
-                f.write(code)
-            print("✓ Fixed escape sequence issues")
-        
-        # Add after the final code validation step in main_test_ic.py
-        print("\nSTEP 4d: FIXING COORDINATE DIMENSIONS")
-        print("-"*50)
-        
-        # Read the current code
-        with open(code_path, 'r') as f:
-            current_code = f.read()
-        
-        # Fix for 2D coordinates in Dot creation
-        if "_coords" in current_code and "Dot(" in current_code:
-            print("⚠️ Checking for 2D coordinates in Dot objects...")
-            
-            # First approach: Convert 2D coordinate arrays to 3D
-            coord_pattern = r'(\w+_coords\s*=\s*\[(?:\s*\([^)]+\)\s*,?)+\])'
-            for match in re.finditer(coord_pattern, current_code):
-                coords_def = match.group(1)
-                # Check if we have 2D coordinates (no third component)
-                if re.search(r'\(\s*-?\d+\.?\d*\s*,\s*-?\d+\.?\d*\s*\)', coords_def):
-                    print(f"⚠️ Found 2D coordinates in: {coords_def[:50]}...")
-                    # Replace with 3D coordinates by adding ,0 as the z-coordinate
-                    fixed_coords = re.sub(
-                        r'\(\s*(-?\d+\.?\d*)\s*,\s*(-?\d+\.?\d*)\s*\)',
-                        r'(\1, \2, 0)',
-                        coords_def
-                    )
-                    current_code = current_code.replace(coords_def, fixed_coords)
-                    print("✓ Fixed coordinates to 3D format")
-            
-            # Second approach: Modify Dot creation to handle 2D points
-            if re.search(r'Dot\(\s*\w+\s*[,)]', current_code) and "import numpy as np" not in current_code:
-                print("⚠️ Adding numpy import for coordinate handling")
-                current_code = current_code.replace("from manim import *", "from manim import *\nimport numpy as np")
-            
-            dot_pattern = r'(Dot\(\s*)(\w+)(\s*,|\s*\))'
-            for match in re.finditer(dot_pattern, current_code):
-                full_match = match.group(0)
-                prefix = match.group(1)
-                point_var = match.group(2)
-                suffix = match.group(3)
-                
-                # Only apply to point variables that are likely coordinates
-                if point_var.endswith("_coords") or point_var == "point":
-                    continue  # Skip list variables - we handle these in the loop
-                
-                if "_coords" in current_code and f"for {point_var} in" in current_code:
-                    # For loop variable from coords
-                    print(f"⚠️ Fixing Dot creation with loop variable: {point_var}")
-                    replacement = f"{prefix}np.array([{point_var}[0], {point_var}[1], 0]){suffix}"
-                    current_code = current_code.replace(full_match, replacement)
-                    print(f"✓ Fixed Dot creation: {full_match} → {replacement}")
-            
-            # Save the updated code
-            with open(code_path, 'w') as f:
-                f.write(current_code)
-            print("✓ Saved coordinate dimension fixes to file")
-        
-        # Check for commented z-coordinates
-        print("\nChecking for commented z-coordinates...")
-        with open(code_path, 'r') as f:
-            current_code = f.read()
-
-        # Fix commented out z-coordinates in move_to calls
-        if re.search(r'move_to\(\s*\[\s*[^,\]]+,\s*[^,\]]+,?\s*(?:#\s*0)?\s*\]\s*\)', current_code):
-            print("⚠️ Found move_to() calls with missing z-coordinate")
-            fixed_code = re.sub(
-                r'move_to\(\s*\[\s*([^,\]]+),\s*([^,\]]+),?\s*(?:#\s*0)?\s*\]\s*\)',
-                r'move_to([\1, \2, 0])',
-                current_code
-            )
-            
-            # Fix other potential cases
-            fixed_code = re.sub(
-                r'(\w+\.move_to\(\[)([^,\]]+),\s*([^,\]]+)(\s*\]\))',
-                r'\1\2, \3, 0\4',
-                fixed_code
-            )
-            
-            with open(code_path, 'w') as f:
-                f.write(fixed_code)
-            print("✓ Fixed missing z-coordinates")
-        
-        # Generate the video
-        print("\nRunning Manim to generate video...")
-        result = video_gen.generate_video_from_code(code_path, args.topic)
+        # Generate the video, unless an earlier run of this job already rendered it
+        emit("stage_started", stage="render")
+        render_started = time.time()
+        result = None
+        if checkpoint.has("render"):
+            result = checkpoint.load("render")["video_path"]
+            if os.path.exists(result):
+                print(f"✓ Render restored from checkpoint: {result}")
+            else:
+                result = None
+        if result is None:
+            print("\nRunning Manim to generate video...")
+            result = video_gen.generate_video_from_code(code_path, args.topic)
+            report = video_gen.last_render_report
+            if report and report["outcome"] == "repaired":
+                # Save the repaired code, not the code that failed to render
+                with open(code_path, 'r') as f:
+                    code = f.read()
         
         if isinstance(result, str) and os.path.exists(result):
             # If successful, rename the video file to include _ic suffix
             success = True
             print("✓ Video generated successfully!")
+            emit("stage_finished", stage="render", seconds=round(time.time() - render_started, 3))
             
             # Get the directory and base filename
             video_dir = os.path.dirname(result) # backend/backend/manim/content/videos_dir/
@@ -436,8 +583,11 @@ def main():
                     result = new_path  # Update result to the new path
                 except Exception as e:
                     print(f"⚠️ Warning: Could not rename video file: {e}")
+            checkpoint.save("render", {"video_path": result})
             
             # Save artifacts
+            emit("stage_started", stage="upload")
+            upload_started = time.time()
             artifacts_dir = os.path.join(video_gen.videos_dir, f"{safe_filename}_artifacts")
             os.makedirs(artifacts_dir, exist_ok=True)
             
@@ -449,13 +599,7 @@ def main():
                 f.write(scene_plan)
             print("✓ Saved scene plan")
             
-            # Add a new step to generate key takeaways
-            print("\nSTEP 6a: GENERATING KEY TAKEAWAYS")
-            print("-"*50)
-            
-            # Get the key takeaways
-            key_takeaways = generate_key_takeaways(args.topic, get_llm_response)
-            
+            # The key takeaways were generated alongside the scene
             print("✓ Generated key takeaways:")
             print(key_takeaways)
             
@@ -463,6 +607,7 @@ def main():
             with open(os.path.join(artifacts_dir, "key_takeaways.txt"), 'w') as f:
                 f.write(key_takeaways)
             print("✓ Saved key takeaways to file")
+            topic_index.register(args.topic, code_path, result, artifacts_dir, problem_type="ic")
             
             # Save to database
             print("\nSTEP 7: SAVING TO DATABASE")
@@ -501,9 +646,11 @@ def main():
                 print("✓ Successfully saved to database")
             else:
                 print(f"❌ Failed to save to database (Status: {response.status_code})")
+            emit("stage_finished", stage="upload", seconds=round(time.time() - upload_started, 3))
         else:
             success = False
             print("❌ Video generation failed")
+            emit("stage_failed", stage="render", error="Video generation failed")
         
         print("\n" + "="*50)
         print("PROCESS COMPLETE")
@@ -513,11 +660,33 @@ def main():
             print(f"✓ Video saved to: {result}")
         else:
             print(f"❌ Failed to create visualization for: '{args.topic}'")
+            print(f"Resume with: --resume {checkpoint.job_id}")
+        print(video_gen.generator.cache_summary())
+        print(video_gen.generator.usage_summary())
         print("="*50 + "\n")
     
+    except JobCancelled as e:
+        print(f"\n⚠️ {e}")
+        print(f"Resume with: --resume {checkpoint.job_id}")
+        emit("stage_failed", stage="render", error=str(e))
+        success, error = False, str(e)
+    
     except Exception as e:
         print(f"\n❌ ERROR: {str(e)}")
         traceback.print_exc()
+        print(f"Resume with: --resume {checkpoint.job_id}")
+        success, error = False, str(e)
+    
+    finally:
+        # Write per-stage LLM metrics whether or not the job succeeded
+        video_gen.generator.write_metrics(metrics_path, job={
+            "topic": args.topic,
+            "pipeline": "main_test_ic"
+        })
+    
+    return {"success": success, "video_path": result if success else None,
+            "error": None if success else (error or "Video generation failed"),
+            "job_id": checkpoint.job_id, "reused": False}
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
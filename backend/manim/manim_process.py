@@ -0,0 +1,113 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+
+from job_deadline import JobCancelled
+
+# manim draws one progress bar per animation on stderr, e.g.
+# "Animation 3: Create(Circle):  45%|####5     | 27/60 [00:00<00:00, 80.2it/s]"
+_ANIMATION_PROGRESS = re.compile(r"Animation (\d+)\b[^%\r\n]*?(\d{1,3})%")
+_ANIMATION_CALL = re.compile(r"\bself\.(?:play|wait)\(")
+
+
+def count_animations(code):
+    """Estimate how many animations a scene renders from its play/wait calls."""
+    return max(1, len(_ANIMATION_CALL.findall(code)))
+
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _watch(process, deadline, killed):
+    """Kill manim and everything it started (ffmpeg, LaTeX) once the job has to stop."""
+    while process.poll() is None:
+        if deadline.wait(0.5):
+            killed.set()
+            _kill_group(process)
+            return
+
+
+def _read_progress(process, animations, on_progress):
+    """Read manim's stderr until it closes, reporting progress bar updates."""
+    stderr = bytearray()
+    pending = ""
+    reported = -1
+    while True:
+        chunk = process.stderr.read1(4096)
+        if not chunk:
+            break
+        stderr.extend(chunk)
+        if on_progress is None:
+            continue
+        # Progress bars redraw with carriage returns, so split on both line endings
+        pending += chunk.decode("utf-8", errors="replace")
+        *updates, pending = re.split(r"[\r\n]", pending)
+        for update in updates:
+            match = _ANIMATION_PROGRESS.search(update)
+            if not match:
+                continue
+            animation, fraction = int(match.group(1)), int(match.group(2)) / 100
+            # Loops can render more animations than the scene spells out; stay below 100% until done
+            percent = min(99, int(100 * (animation + fraction) / max(animations, animation + 1)))
+            if percent > reported:
+                reported = percent
+                on_progress(percent, animation)
+    return stderr
+
+
+def run_manim(command, cwd, animations=1, on_progress=None, deadline=None):
+    """Run manim, reporting the render percentage while it runs.
+
+    Args:
+        command: manim command line
+        cwd: Directory to run manim in
+        animations: Expected number of animations (see count_animations)
+        on_progress: Callable receiving (percent, animation) each time the
+            overall percentage grows by a whole percent (optional)
+        deadline: Optional JobDeadline; manim's whole process group is killed
+            when the job is cancelled or runs out of time
+
+    Returns:
+        subprocess.CompletedProcess with text stdout and stderr, like subprocess.run
+
+    Raises:
+        JobCancelled: The render was killed because of the deadline
+    """
+    if deadline is not None:
+        deadline.check()
+    # A session of its own lets the whole process tree be killed at once
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               start_new_session=True)
+    killed = threading.Event()
+    if deadline is not None:
+        threading.Thread(target=_watch, args=(process, deadline, killed), daemon=True).start()
+
+    # stdout is drained on its own thread so neither pipe can fill up and block manim
+    stdout = []
+    reader = threading.Thread(target=lambda: stdout.append(process.stdout.read()), daemon=True)
+    reader.start()
+
+    try:
+        stderr = _read_progress(process, animations, on_progress)
+        process.wait()
+    except BaseException:
+        # Ctrl-C no longer reaches manim in its own session
+        _kill_group(process)
+        raise
+    reader.join()
+    if killed.is_set():
+        deadline.check()
+        raise JobCancelled("Render stopped")
+    if on_progress is not None and process.returncode == 0:
+        on_progress(100, None)
+    return subprocess.CompletedProcess(
+        command, process.returncode,
+        stdout=(stdout[0] if stdout else b"").decode("utf-8", errors="replace"),
+        stderr=stderr.decode("utf-8", errors="replace")
+    )
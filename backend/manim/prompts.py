@@ -1,4 +1,5 @@
 import re
+from response_parser import parse_response, code_block
 
 # =============================================================================
 # Core Prompts for Manim Animation Generation
@@ -223,6 +224,14 @@ Present your response in the following format:
 </code_self_evaluation>
 
 IMPORTANT: The code section MUST start with <CODE_START> and end with <CODE_END> exactly as shown - do not use triple backticks or any markdown formatting. This is critical for the automated system to process your response correctly.'''
+
+# Short corrective turn sent in the same conversation when no usable code came back
+CODE_FOLLOW_UP = '''Your previous reply did not contain usable Manim code about {topic}.
+Resend ONLY the complete code for the {safe_class_name} class, wrapped EXACTLY like this, with no other text:
+
+<CODE_START>
+[Your complete Python code for the Manim animation]
+<CODE_END>'''
 # =============================================================================
 # Helper Functions
 # =============================================================================
@@ -242,10 +251,8 @@ def extract_code_only(text, topic=None):
         return None
         
     # Try standard pattern first - this is the primary method that should be used
-    pattern = r'<CODE_START>(.*?)<CODE_END>'
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        code = match.group(1).strip()
+    code = code_block(text, closers=("<CODE_END>",))
+    if code is not None:
         # If topic is provided, validate the code is about the topic
         if topic and not validate_topic_relevance(code, topic):
             print(f"Warning: Extracted code does not appear to be about '{topic}'")
@@ -263,16 +270,13 @@ def extract_code_only(text, topic=None):
     
     # Only use fallback methods when topic validation is not required
     # Look for code blocks in markdown format
-    pattern = r'```python\s*(.*?)\s*```'
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
+    parsed = parse_response(text)
+    if "python" in parsed["fences"]:
+        return parsed["fences"]["python"].strip()
     
     # Try any code block
-    pattern = r'```\s*(.*?)\s*```'
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        code = match.group(1).strip()
+    if parsed["first_fence"] is not None:
+        code = parsed["first_fence"].strip()
         if "import" in code or "class" in code:
             return code
     
@@ -433,10 +437,9 @@ def extract_section(text, section_name):
     if not text or not section_name:
         return None
         
-    pattern = rf'<{section_name}>(.*?)</{section_name}>'
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
+    content = parse_response(text)["sections"].get(section_name)
+    if content is not None:
+        return content.strip()
     return None
 
 def create_topic_safe_classname(topic):
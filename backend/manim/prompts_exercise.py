@@ -2,6 +2,10 @@ import re
 from manim import UP, DOWN, RIGHT, VGroup, SurroundingRectangle, BLACK, WHITE
 from concept_prompts import CONCEPT_EXTRACTION, CONCEPT_DESIGN
 from exercise_prompts import EXERCISE_EXTRACTION, EXERCISE_DESIGN
+from code_preflight import preflight_check
+from code_normalizer import normalize_code
+from response_parser import parse_response, code_block
+from stage_dag import StageGraph, StageError
 # =============================================================================
 # Core Prompts for Manim Animation Generation
 # =============================================================================
@@ -380,24 +384,11 @@ def extract_code_only(text, topic=None, original_query=None):
         print("Error: Empty response received")
         return None
         
-    # Try standard pattern first with explicit </CODE_END> tag
-    pattern = r'<CODE_START>\s*(.*?)\s*</CODE_END>'
-    match = re.search(pattern, text, re.DOTALL)
-    
-    if not match:
-        # Try alternate pattern with </CODE_START> as closing tag (common mistake)
-        pattern = r'<CODE_START>\s*(.*?)\s*</CODE_START>'
-        match = re.search(pattern, text, re.DOTALL)
-        
-    if not match:
-        # Try alternate pattern without any closing tag
-        pattern = r'<CODE_START>\s*(.*?)$'
-        match = re.search(pattern, text, re.DOTALL)
-    
-    if match:
-        # Extract the code - IMPORTANT: make sure closing tags aren't included
-        code = match.group(1).strip()
-        
+    # The explicit </CODE_END> tag first, then </CODE_START> as closing tag
+    # (common mistake), then no closing tag at all
+    code = code_block(text)
+    
+    if code is not None:
         # Remove any stray closing tags that might have been included
         code = re.sub(r'</CODE_START>|</CODE_END>', '', code)
         
@@ -617,6 +608,10 @@ def validate_topic_relevance(code, topic, original_query=None):
     
     return validation_passed
 
+# Markdown left in extracted sections
+_MARKDOWN_SYMBOLS = re.compile(r'[#*`]')
+_BULLET_POINTS = re.compile(r'\n\s*-\s*')
+
 def extract_section(text, section_name):
     """Extract content from a specific XML-like section or markdown headers."""
     if not text or not section_name:
@@ -624,30 +619,18 @@ def extract_section(text, section_name):
         return None
         
     try:
-        # First try exact XML tags
-        pattern = rf'<{section_name}>(.*?)</{section_name}>'
-        match = re.search(pattern, text, re.DOTALL)
+        # First try exact XML tags, then markdown headers (# Header or **Header:**)
+        parsed = parse_response(text)
+        content = parsed["sections"].get(section_name)
+        if content is None:
+            content = parsed["headers"].get(section_name.lower())
         
-        if not match:
-            # Try markdown format with different header styles
-            markdown_patterns = [
-                rf'#\s*{section_name}[:\s]*\n+(.*?)(?=\n#|$)',  # # Header
-                rf'##\s*{section_name}[:\s]*\n+(.*?)(?=\n##|$)',  # ## Header
-                rf'###\s*{section_name}[:\s]*\n+(.*?)(?=\n###|$)',  # ### Header
-                rf'\*\*{section_name}:\*\*\s*(.*?)(?=\n\*\*|\Z)',  # **Header:**
-            ]
-            
-            for pattern in markdown_patterns:
-                match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
-                if match:
-                    break
-        
-        if match:
-            content = match.group(1).strip()
+        if content is not None:
+            content = content.strip()
             if content:
                 # Remove markdown formatting from content
-                content = re.sub(r'[#*`]', '', content)  # Remove markdown symbols
-                content = re.sub(r'\n\s*-\s*', '\n', content)  # Clean bullet points
+                content = _MARKDOWN_SYMBOLS.sub('', content)  # Remove markdown symbols
+                content = _BULLET_POINTS.sub('\n', content)  # Clean bullet points
                 return content
             print(f"❌ Empty content found in section: {section_name}")
         else:
@@ -722,8 +705,14 @@ def validate_manim_syntax(code):
         return False
     return True
 
-def extract_code_with_retries(response, topic, get_llm_response_func, max_retries=3):
-    """Extract code from response with multiple retries and explicit formatting requirements."""
+def extract_code_with_retries(response, topic, get_llm_response_func, max_retries=3, session=None):
+    """Extract code from response with multiple retries and explicit formatting requirements.
+    
+    When ``session`` (the conversation that produced ``response``) is given, the
+    corrections are sent as follow-up turns so the model still sees its own
+    previous reply; otherwise each correction is a standalone prompt.
+    """
+    send = session.send if session else get_llm_response_func
     
     for attempt in range(max_retries):
         print(f"\nAttempt {attempt + 1} of {max_retries} to extract code")
@@ -746,7 +735,7 @@ Previous code length: {len(code)} chars
 <CODE_START>
 [Your updated Manim code here]
 </CODE_END>"""
-                response = get_llm_response_func(enhanced_prompt)
+                response = send(enhanced_prompt)
                 continue
             
             return code
@@ -765,7 +754,7 @@ Please provide ONLY the code section with the EXACT required tags:
 DO NOT use markdown formatting or triple backticks. The tags must be exactly as shown above.
 Previous response length: {len(response)} chars"""
 
-        response = get_llm_response_func(enhanced_prompt)
+        response = send(enhanced_prompt)
     
     print("❌ Failed to extract code after all retry attempts")
     return None
@@ -799,47 +788,93 @@ def validate_code_format(code):
 # Main Processing Functions
 # =============================================================================
 
-def process_math_visualization_request(query, macro_topic, problem_type, get_llm_response_func):
-    """Process a mathematical visualization request based on problem type"""
+def accept_code_candidate(response, topic, class_name=None):
+    """Turn one code generation response into final code, or None if it fails any check.
+    
+    Runs the same extraction and validation as the sequential path, followed by
+    the pre-flight check, so it can judge raced candidates as they arrive.
+    """
+    code = extract_code_only(response, topic)
+    if not code or not validate_manim_syntax(code):
+        return None
+    fixed_code = validate_and_fix_manim_code(code)
+    if fixed_code is None:
+        return None
+    ok, message = preflight_check(fixed_code, class_name)
+    if not ok:
+        print(f"Pre-flight check failed: {message}")
+        return None
+    return fixed_code
+
+def process_math_visualization_request(query, macro_topic, problem_type, get_llm_response_func,
+                                       race_code_func=None, code_session=None, checkpoint=None,
+                                       progress=None, cancelled=None):
+    """Process a mathematical visualization request based on problem type
+    
+    Args:
+        query: Topic or exercise to visualize
+        macro_topic: Main topic area
+        problem_type: "concept" or "exercise"
+        get_llm_response_func: Callable sending one prompt and returning the response
+        race_code_func: Optional callable (prompt, accept) that races several code
+            candidates and returns the first accepted code, or None
+        code_session: Optional conversation session for the code stage, so code
+            retries are sent as short follow-up turns
+        checkpoint: Optional JobCheckpoint; finished stages are saved to it and
+            stages it already holds are not run again
+        progress: Optional callable (event, **data) receiving stage events
+        cancelled: Optional callable returning True once the job should stop
+    """
     print(f"\nProcessing visualization for: {query}")
     
-    try:
-        # Step 1: Get visualization focus
+    # None of the three prompts reads another's output, so they run concurrently
+    def focus_stage(topic):
         extraction_response = get_llm_response_func(
-            CONCEPT_EXTRACTION.format(topic=query)
+            CONCEPT_EXTRACTION.format(topic=topic)
         )
         visualization_focus = extract_section(extraction_response, "visualization_focus")
         if not visualization_focus:
-            return {"success": False, "error": "Failed to get visualization focus"}
-            
-        # Step 2: Get animation design
+            raise StageError("Failed to get visualization focus")
+        return visualization_focus
+    
+    def design_stage(topic):
         design_response = get_llm_response_func(
-            CONCEPT_DESIGN.format(topic=query)
+            CONCEPT_DESIGN.format(topic=topic)
         )
         animation_design = extract_section(design_response, "animation_design")
         if not animation_design:
-            return {"success": False, "error": "Failed to get animation design"}
-            
-        # Step 3: Generate code
-        safe_class_name = f"{query.replace(' ', '')}Scene"
-        code_response = get_llm_response_func(
-            CODE_GENERATION.format(
-                topic=query,
-                safe_class_name=safe_class_name
-            )
+            raise StageError("Failed to get animation design")
+        return animation_design
+    
+    def code_stage(topic):
+        safe_class_name = f"{topic.replace(' ', '')}Scene"
+        code_prompt = CODE_GENERATION.format(
+            topic=topic,
+            safe_class_name=safe_class_name
         )
+        result = {"class_name": safe_class_name, "code": None, "code_error": None}
+        
+        if race_code_func:
+            # Raced candidates are already validated and fixed when accepted
+            code = race_code_func(code_prompt, lambda response: accept_code_candidate(response, topic))
+            if code:
+                result["code"] = code
+                return result
+            print("No code candidate passed - falling back to sequential retries")
+        
+        if code_session:
+            code_response = code_session.send(code_prompt)
+        else:
+            code_response = get_llm_response_func(code_prompt)
         
         # Instead, go directly to extract_code_with_retries which handles the different tag formats
-        code = extract_code_with_retries(code_response, query, get_llm_response_func)
+        code = extract_code_with_retries(code_response, topic, get_llm_response_func,
+                                         session=code_session)
         
         if code is None:
             print("\n❌ CODE GENERATION FAILED")
-            return {
-                "success": False,
-                "error": "Failed to generate valid code",
-                "topic": query,
-                "visualization_focus": visualization_focus
-            }
+            result["code_error"] = "Failed to generate valid code"
+            return result
         
         # Add final validation and fixing
         print("\nPerforming final code validation and fixes...")
@@ -847,33 +882,52 @@ def process_math_visualization_request(query, macro_topic, problem_type, get_llm
         
         if fixed_code is None:
             print("\n❌ FINAL CODE VALIDATION FAILED")
-            return {
-                "success": False,
-                "error": "Code has critical issues that could not be fixed",
-                "topic": query,
-                "visualization_focus": visualization_focus
-            }
+            result["code_error"] = "Code has critical issues that could not be fixed"
+            return result
         
         # Use the fixed code
-        code = fixed_code
-        
-        print("\n✓ Code generation successful!")
-        print(f"Generated code length: {len(code)} characters")
-        
-        return {
-            "success": True,
-            "topic": query,
-            "macro_topic": macro_topic,
-            "problem_type": problem_type,
-            "visualization_focus": visualization_focus,
-            "animation_design": animation_design,
-            "code": code,
-            "class_name": safe_class_name
-        }
-        
+        result["code"] = fixed_code
+        return result
+    
+    graph = StageGraph("visualization", checkpoint=checkpoint, emit=progress, cancelled=cancelled)
+    graph.add("visualization_focus", focus_stage, inputs=["topic"])
+    graph.add("animation_design", design_stage, inputs=["topic"])
+    graph.add("code_generation", code_stage, inputs=["topic"],
+              outputs=["code", "class_name", "code_error"])
+    
+    try:
+        values = graph.run(topic=query)
+    except StageError as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
         print(f"Error: {str(e)}")
         return {"success": False, "error": str(e)}
+    
+    if values["code_error"]:
+        # A resumed job should retry the code instead of restoring the failure
+        if checkpoint is not None:
+            checkpoint.discard("code_generation")
+        return {
+            "success": False,
+            "error": values["code_error"],
+            "topic": query,
+            "visualization_focus": values["visualization_focus"]
+        }
+    
+    code = values["code"]
+    print("\n✓ Code generation successful!")
+    print(f"Generated code length: {len(code)} characters")
+    
+    return {
+        "success": True,
+        "topic": query,
+        "macro_topic": macro_topic,
+        "problem_type": problem_type,
+        "visualization_focus": values["visualization_focus"],
+        "animation_design": values["animation_design"],
+        "code": code,
+        "class_name": values["class_name"]
+    }
 
 # Example of how to use the system (replace with your actual LLM API call)
 def example_usage():
@@ -1021,72 +1075,18 @@ def validate_and_fix_manim_code(code):
     """
     if not code:
         return None
-        
-    # Check for critical errors
-    critical_issues = []
     
-    # 1. Check for proper import
-    if not re.search(r'from\s+manim\s+import\s+\*', code):
-        critical_issues.append("Missing 'from manim import *'")
-        
-    # 2. Check for class definition
-    if not re.search(r'class\s+\w+\s*\(\s*Scene\s*\)', code):
-        critical_issues.append("Missing Scene class definition")
-        
-    # 3. Check for construct method
-    if not re.search(r'def\s+construct\s*\(\s*self\s*\)', code):
-        critical_issues.append("Missing construct method")
+    fixed_code, report = normalize_code(code)
+    for fix in report["fixes"]:
+        print(f"✓ {fix}")
     
-    if critical_issues:
+    if report["issues"]:
         print("❌ Critical issues in generated code:")
-        for issue in critical_issues:
+        for issue in report["issues"]:
             print(f"  - {issue}")
         return None
     
-    # Apply additional fixes
-    
-    # 1. Fix any remaining uncommented descriptive text
-    lines = code.split('\n')
-    fixed_lines = []
-    in_class_def = False
-    in_function_def = False
-    
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        
-        # Skip empty lines
-        if not stripped:
-            fixed_lines.append(line)
-            continue
-            
-        # Track if we're in a class or function definition for proper indentation context
-        if re.match(r'\s*class\s+', line):
-            in_class_def = True
-            in_function_def = False
-        elif re.match(r'\s*def\s+', line):
-            in_function_def = True
-        
-        # If already a comment, keep as is
-        if stripped.startswith('#'):
-            fixed_lines.append(line)
-            continue
-            
-        # Check if this is valid Python
-        try:
-            compile(line, '<string>', 'single')
-            fixed_lines.append(line)  # Valid code, keep as is
-        except SyntaxError:
-            # Check if this is just descriptive text (no code characters)
-            if (in_function_def and not any(char in stripped for char in "={}[](),.+-*/:'\"\\")) or re.match(r'^\s*[A-Z][^={}()\[\]]*$', stripped):
-                # Likely a section header or descriptive text, comment it
-                leading_space = len(line) - len(line.lstrip())
-                fixed_lines.append(' ' * leading_space + '# ' + stripped)
-                print(f"⚠️ Line {i+1}: Commented text '{stripped}'")
-            else:
-                # This is likely code with a syntax error
-                fixed_lines.append(line)
-    
-    return '\n'.join(fixed_lines)
+    return fixed_code
 
 def enforce_topic_in_code(code, topic):
     """Enforce that the code is about the specified topic by adding relevant content.
@@ -1,5 +1,6 @@
 # Add this at the top of the file with other imports
 import re
+from code_normalizer import normalize_code
 
 # 1. Video Orchestrator Prompts
 VIDEO_IDEA_GENERATOR_SYSTEM_PROMPT = """You are an expert designing videos that are created using the python library for Manim.
@@ -257,59 +258,20 @@ def validate_and_fix_manim_code(code):
     """Perform enhanced validation and fixes on Manim code."""
     if not code:
         return None
-        
-    # Check for critical errors
-    critical_issues = []
-    
-    # 1. Check for proper import
-    if not re.search(r'from\s+manim\s+import\s+\*', code):
-        print("⚠️ Fixing missing or incomplete import statement")
-        code = re.sub(r'^from\s+manim\s+import\s*(\w+,?\s*)*$', 'from manim import *', code, flags=re.MULTILINE)
-        if not re.search(r'from\s+manim\s+import', code):
-            code = "from manim import *\n\n" + code
-    
-    # 2. Check for class definition
-    if not re.search(r'class\s+\w+\s*\(\s*Scene\s*\)', code):
-        critical_issues.append("Missing Scene class definition")
     
-    # 3. Check for construct method
-    if not re.search(r'def\s+construct\s*\(\s*self\s*\)', code):
-        critical_issues.append("Missing construct method")
+    fixed_code, report = normalize_code(code)
+    for fix in report["fixes"]:
+        print(f"⚠️ {fix}")
     
-    if len(critical_issues) > 0:
+    if report["issues"]:
         print("❌ Critical issues in generated code:")
-        for issue in critical_issues:
+        for issue in report["issues"]:
             print(f"  - {issue}")
-        if len(critical_issues) > 1:
+        # A missing construct method alone is left for the render repair
+        if "Missing Scene class definition" in report["issues"]:
             return None
     
-    # Fix uncommented descriptive text
-    lines = code.split('\n')
-    fixed_lines = []
-    in_function_def = False
-    
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        
-        # Skip empty lines or already commented lines
-        if not stripped or stripped.startswith('#'):
-            fixed_lines.append(line)
-            continue
-        
-        # Track if we're in a function definition
-        if re.match(r'\s*def\s+', line):
-            in_function_def = True
-        
-        # Check if line looks like a descriptive text without code elements
-        if in_function_def and not any(char in stripped for char in "={}[](),.+-*/:'\"\\"):
-            # Comment it as descriptive text
-            leading_space = len(line) - len(line.lstrip())
-            fixed_lines.append(' ' * leading_space + '# ' + stripped)
-            print(f"⚠️ Line {i+1}: Commented text '{stripped}'")
-        else:
-            fixed_lines.append(line)
-    
-    return '\n'.join(fixed_lines) 
+    return fixed_code
 
 # 4. Code Layout Evaluation Prompts
 CODE_LAYOUT_EVALUATOR_SYSTEM_PROMPT = """You are an expert in reviewing Manim animation code to ensure perfect visual layout.
@@ -385,9 +347,6 @@ def evaluate_and_fix_layout(code, get_llm_response_func=None):
         return code
         
     try:
-        # Combine the prompts
-        layout_evaluation_prompt = CODE_LAYOUT_EVALUATOR_SYSTEM_PROMPT + "\n\n" + CODE_LAYOUT_EVALUATION_USER_PROMPT.format(code=code)
-        
         # Send to LLM for evaluation
         print("Evaluating code layout and spacing...")
         evaluation_response = get_llm_response_func(
@@ -441,159 +400,17 @@ def evaluate_and_fix_layout(code, get_llm_response_func=None):
         print(f"⚠️ Error during layout evaluation: {str(e)}")
         return code 
 
-def enforce_boundary_checks(code):
-    """Add comprehensive boundary checks to ensure all elements stay within screen boundaries."""
-    # 1. First, add the safe_position utility function to the Scene class
-    class_match = re.search(r'class\s+(\w+)\s*\(Scene\):\s*\n', code)
-    if class_match:
-        class_name = class_match.group(1)
-        utility_function = """
-    def safe_position(self, mobject, zone="MIDDLE", buff=0.5):
-        \"\"\"Ensure mobject stays within screen boundaries.\"\"\"
-        # Get frame boundaries (adjust if camera.frame_width was changed)
-        frame_width = getattr(self.camera, "frame_width", 14)
-        frame_height = getattr(self.camera, "frame_height", 8)
-        max_x = frame_width/2 - buff
-        max_y = frame_height/2 - buff
-        
-        # Set position based on zone
-        if zone == "TOP":
-            mobject.to_edge(UP, buff=buff)
-            # Limit y position
-            if mobject.get_top()[1] > max_y:
-                mobject.shift(DOWN * (mobject.get_top()[1] - max_y))
-        elif zone == "BOTTOM":
-            mobject.to_edge(DOWN, buff=buff)
-            # Limit y position
-            if mobject.get_bottom()[1] < -max_y:
-                mobject.shift(UP * (-max_y - mobject.get_bottom()[1]))
-        else:  # MIDDLE zone or anything else
-            # Only adjust if outside boundaries
-            if mobject.get_center()[1] > max_y - mobject.height/2:
-                mobject.align_to(UP * (max_y - mobject.height/2), UP)
-            if mobject.get_center()[1] < -max_y + mobject.height/2:
-                mobject.align_to(DOWN * (max_y - mobject.height/2), DOWN)
-        
-        # Check width and scale down if needed
-        if mobject.width > frame_width - 2*buff:
-            scale_factor = (frame_width - 2*buff) / mobject.width
-            mobject.scale(scale_factor)
-        
-        # Check horizontal boundaries
-        if mobject.get_right()[0] > max_x:
-            mobject.shift(LEFT * (mobject.get_right()[0] - max_x))
-        if mobject.get_left()[0] < -max_x:
-            mobject.shift(RIGHT * (-max_x - mobject.get_left()[0]))
-        
-        return mobject
-"""
-        
-        # Insert after class definition
-        code = re.sub(
-            r'(class\s+\w+\s*\(Scene\):\s*\n)(\s*def\s+construct)',
-            r'\1' + utility_function + r'\2',
-            code
-        )
-    
-    # 2. Add camera frame setting to ensure consistent boundaries
-    construct_match = re.search(r'(\s*def\s+construct\s*\(\s*self\s*\):)', code)
-    if construct_match:
-        frame_settings = """
-        # Set frame dimensions for consistent boundaries
-        self.camera.frame_width = 14
-        self.camera.frame_height = 8
-"""
-        code = code.replace(
-            construct_match.group(0),
-            construct_match.group(0) + frame_settings
-        )
+def enforce_boundary_checks(code, class_name=None):
+    """Add comprehensive boundary checks to ensure all elements stay within screen boundaries.
     
-    # 3. Fix coordinate dimensions for Dot creation
-    # Look for 2D coordinates and convert them to 3D
-    coord_pattern = r'(\w+_coords\s*=\s*\[(?:\s*\([^)]+\)\s*,?)+\])'
-    for match in re.finditer(coord_pattern, code):
-        coords_def = match.group(1)
-        # Check if we have 2D coordinates (no third component)
-        if re.search(r'\(\s*-?\d+\.?\d*\s*,\s*-?\d+\.?\d*\s*\)', coords_def):
-            # Replace with 3D coordinates by adding ,0 as the z-coordinate
-            fixed_coords = re.sub(
-                r'\(\s*(-?\d+\.?\d*)\s*,\s*(-?\d+\.?\d*)\s*\)',
-                r'(\1, \2, 0)',
-                coords_def
-            )
-            code = code.replace(coords_def, fixed_coords)
+    Also applies the coordinate fixes and, with class_name, the class rename
+    (see code_normalizer.normalize_code).
     
-    # 4. Alternative approach: Fix Dot creation instead of coordinates
-    dot_pattern = r'Dot\(\s*([^,)]+)(?:\s*,|\s*\))'
-    for match in re.finditer(dot_pattern, code):
-        point_var = match.group(1).strip()
-        # Only fix if it's using a direct variable (not a complex expression)
-        if re.match(r'^[a-zA-Z_]\w*$', point_var) and "point" not in point_var:
-            # Add np.array with 3rd component if it's a plain variable
-            replacement = f"Dot(np.array([{point_var}[0], {point_var}[1], 0])"
-            code = code.replace(f"Dot({point_var}", replacement)
-    
-    # 5. Add numpy import if needed
-    if "np.array" in code and "import numpy" not in code:
-        code = re.sub(
-            r'from manim import \*',
-            'from manim import *\nimport numpy as np',
-            code
-        )
-    
-    # 6. Add safety checks at the end as before
-    # Find all text objects
-    text_objects = re.findall(r'(\w+)\s*=\s*(Text|MathTex|Tex)\(', code)
-    
-    # Find the last line of the construct method to append our safe positioning code
-    construct_end = code.rfind('def construct')
-    if construct_end != -1:
-        # Find where to insert our safe positioning code
-        # Look for the last self.play or self.wait call
-        last_play = max(code.rfind('self.play('), code.rfind('self.wait('))
-        if last_play != -1:
-            # Find the end of this line
-            line_end = code.find('\n', last_play)
-            if line_end != -1:
-                # Insert our safe positioning code
-                safety_code = "\n        # Ensure all text elements stay within screen boundaries\n"
-                for var_name, obj_type in text_objects:
-                    zone = "TOP" if "title" in var_name.lower() else "BOTTOM" if any(x in var_name.lower() for x in ["explain", "description", "summary"]) else "MIDDLE"
-                    safety_code += f"        # Safe position for {var_name}\n"
-                    safety_code += f"        if '{var_name}' in locals():\n"
-                    safety_code += f"            self.safe_position({var_name}, zone=\"{zone}\", buff=0.5)\n"
-                    
-                # Add background rectangles
-                for var_name, obj_type in text_objects:
-                    safety_code += f"""
-        # Add background for better visibility for {var_name}
-        if '{var_name}' in locals() and '{var_name}_bg' not in locals():
-            {var_name}_bg = SurroundingRectangle({var_name}, fill_opacity=0.85, fill_color=BLACK, buff=0.15)
-            {var_name}_group = VGroup({var_name}_bg, {var_name})
-"""
-                
-                # Insert the safety code
-                code = code[:line_end+1] + safety_code + code[line_end+1:]
-    
-    # 7. Check for problematic regex group references that might cause syntax errors
-    if re.search(r'\\[0-9]', code):
-        code = re.sub(r'\\[0-9]', '', code)
-    
-    # Additional fix for commented out z-coordinates in move_to calls
-    code = re.sub(
-        r'move_to\(\s*\[\s*([^,\]]+),\s*([^,\]]+),?\s*(?:#\s*0)?\s*\]\s*\)',
-        r'move_to([\1, \2, 0])',
-        code
-    )
-    
-    # Fix for missing z-coordinate in any coordinate arrays
-    code = re.sub(
-        r'(\w+\.move_to\(\[)([^,\]]+),\s*([^,\]]+)(\s*\]\))',
-        r'\1\2, \3, 0\4',
-        code
-    )
-    
-    return code 
+    Returns:
+        Tuple (code, fixes applied)
+    """
+    code, report = normalize_code(code, class_name=class_name, boundary_checks=True)
+    return code, report["fixes"]
 
 # Add this new prompt to the file
 
@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import time
+import textwrap
+
+from code_preflight import preflight_check
+from job_deadline import JobCancelled
+
+DEFAULT_REPAIR_ATTEMPTS = 2
+
+# Lines of code shown on each side of the failing line
+CONTEXT_LINES = 6
+
+# Plain Python tracebacks and the rich tracebacks manim prints by default
+_PLAIN_FRAME = re.compile(r'File "([^"]+)", line (\d+)')
+_RICH_FRAME = re.compile(r'([^\s│"]+\.py):(\d+) in ')
+_ERROR_LINE = re.compile(r'^\s*([A-Za-z_][\w.]*(?:Error|Exception|Interrupt)\b.*)$', re.MULTILINE)
+
+REPAIR_PROMPT = """The Manim scene in {file_name} failed to render.
+
+Error:
+{error}
+{rejected}
+The error was raised at line {line}. Lines {start}-{end} of the file (the failing line is marked with >>):
+
+{snippet}
+
+Fix the error. Return ONLY the corrected replacement for lines {start}-{end} in a single
+```python code block, keeping the surrounding indentation. Change as little as possible
+and do not return any other part of the file."""
+
+REPAIR_WHOLE_FILE_PROMPT = """The Manim scene in {file_name} failed to render.
+
+Error:
+{error}
+{rejected}
+The traceback does not point into the scene file, so here is the whole file:
+
+```python
+{code}
+```
+
+Fix the error. Return the complete corrected file in a single ```python code block.
+Change as little as possible."""
+
+
+def parse_render_error(stderr, code_path):
+    """Find the error message and the failing line of the scene file in manim's stderr.
+
+    Returns:
+        Tuple (error, line) where line is None if no frame points into code_path
+    """
+    file_name = os.path.basename(code_path)
+    line = None
+    for pattern in (_PLAIN_FRAME, _RICH_FRAME):
+        frames = [int(number) for path, number in pattern.findall(stderr)
+                  if os.path.basename(path) == file_name]
+        if frames:
+            # The innermost frame inside the scene file is the one to fix
+            line = frames[-1]
+            break
+    errors = _ERROR_LINE.findall(stderr)
+    if errors:
+        error = errors[-1].strip()
+    else:
+        lines = [text.strip(" │╭╮╰╯─") for text in stderr.strip().splitlines()]
+        lines = [text for text in lines if text]
+        error = lines[-1] if lines else "Manim exited with an error"
+    return error[:500], line
+
+
+def _window(code, line):
+    lines = code.split("\n")
+    start = max(1, line - CONTEXT_LINES)
+    end = min(len(lines), line + CONTEXT_LINES)
+    return lines, start, end
+
+
+def build_repair_prompt(code, error, line, file_name, rejected=None):
+    """Prompt asking for a targeted fix of the lines around ``line`` (or the whole file)."""
+    rejected = f"\nA previous fix was rejected before rendering: {rejected}\n" if rejected else ""
+    lines, start, end = _window(code, line) if line else (None, None, None)
+    if not line or line > len(lines):
+        return REPAIR_WHOLE_FILE_PROMPT.format(file_name=file_name, error=error,
+                                               rejected=rejected, code=code)
+    snippet = "\n".join(
+        f"{'>>' if number == line else '  '} {number:4d} | {lines[number - 1]}"
+        for number in range(start, end + 1)
+    )
+    return REPAIR_PROMPT.format(file_name=file_name, error=error, rejected=rejected,
+                                line=line, start=start, end=end, snippet=snippet)
+
+
+def _indent_of(lines):
+    indents = [len(text) - len(text.lstrip()) for text in lines if text.strip()]
+    if not indents:
+        return ""
+    shortest = min(indents)
+    return next(text[:shortest] for text in lines if text.strip() and
+                len(text) - len(text.lstrip()) == shortest)
+
+
+def apply_repair(code, response, line):
+    """Splice the fix from a repair response into the code.
+
+    Returns:
+        The repaired code, or None if the response holds no code block
+    """
+    if not isinstance(response, str):
+        return None
+    blocks = re.findall(r"```(?:python)?\s*\n(.*?)```", response, re.DOTALL)
+    if not blocks:
+        return None
+    replacement = blocks[-1].rstrip("\n")
+    if not line:
+        return replacement + "\n"
+    lines, start, end = _window(code, line)
+    if line > len(lines):
+        return replacement + "\n"
+    # Re-indent to the original block, whatever indentation the model used
+    indent = _indent_of(lines[start - 1:end])
+    replacement = textwrap.indent(textwrap.dedent(replacement), indent)
+    repaired = "\n".join(lines[:start - 1] + replacement.split("\n") + lines[end:])
+    if code.endswith("\n") and not repaired.endswith("\n"):
+        repaired += "\n"
+    return repaired
+
+
+def render_with_repairs(render, code_path, class_name, send_prompt, max_attempts=None):
+    """Render a scene, patching the failing lines and rendering again on errors.
+
+    Each repair asks the model for a replacement of the lines around the
+    failing traceback line only. A fix has to pass the pre-flight check before
+    it is written to code_path and rendered; a rejected fix still counts as an
+    attempt, so the loop is bounded by ``max_attempts``.
+
+    Args:
+        render: Callable running manim on code_path and returning its CompletedProcess
+        code_path: Scene file; repaired code is written back to it
+        class_name: Scene class to render
+        send_prompt: Callable sending one prompt and returning the response text
+        max_attempts: Maximum repairs (default: MANIM_RENDER_REPAIRS or 2)
+
+    Returns:
+        Tuple (result, report): the last CompletedProcess, and a dict with every
+        attempt, its latency and the final outcome
+    """
+    if max_attempts is None:
+        max_attempts = int(os.getenv("MANIM_RENDER_REPAIRS", DEFAULT_REPAIR_ATTEMPTS))
+    started = time.time()
+    report = {"code_path": code_path, "attempts": [], "outcome": None}
+
+    render_started = time.time()
+    result = render()
+    report["first_render_seconds"] = round(time.time() - render_started, 3)
+    error, line = (None, None)
+    if result.returncode != 0:
+        error, line = parse_render_error(result.stderr, code_path)
+    rejected = None
+
+    while error and len(report["attempts"]) < max_attempts:
+        number = len(report["attempts"]) + 1
+        attempt = {"attempt": number, "error": error, "line": line}
+        report["attempts"].append(attempt)
+        print(f"\nRender repair {number}/{max_attempts}: {error}"
+              f"{f' (line {line})' if line else ''}")
+        attempt_started = time.time()
+        with open(code_path, 'r') as f:
+            code = f.read()
+
+        try:
+            response = send_prompt(build_repair_prompt(
+                code, error, line, os.path.basename(code_path), rejected
+            ))
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"❌ Repair request failed: {e}")
+            attempt["outcome"] = "llm_error"
+            attempt["seconds"] = round(time.time() - attempt_started, 3)
+            break
+        if not response:
+            # The generator reports API failures, timeouts and an open breaker as None
+            print("❌ Repair request failed: no response")
+            attempt["outcome"] = "llm_error"
+            attempt["seconds"] = round(time.time() - attempt_started, 3)
+            break
+        attempt["llm_seconds"] = round(time.time() - attempt_started, 3)
+
+        fixed = apply_repair(code, response, line)
+        ok, message = preflight_check(fixed, class_name) if fixed else (False, "No code block in response")
+        if not ok:
+            print(f"⚠️ Repair rejected by pre-flight check: {message}")
+            attempt["outcome"] = "preflight_failed"
+            attempt["preflight"] = message
+            attempt["seconds"] = round(time.time() - attempt_started, 3)
+            rejected = message
+            continue
+        rejected = None
+
+        with open(code_path, 'w') as f:
+            f.write(fixed)
+        render_started = time.time()
+        result = render()
+        attempt["render_seconds"] = round(time.time() - render_started, 3)
+        attempt["seconds"] = round(time.time() - attempt_started, 3)
+        if result.returncode == 0:
+            attempt["outcome"] = "rendered"
+            error = None
+            print(f"✓ Render repaired on attempt {number} ({attempt['seconds']:.1f}s)")
+        else:
+            attempt["outcome"] = "render_failed"
+            error, line = parse_render_error(result.stderr, code_path)
+
+    if result.returncode == 0:
+        report["outcome"] = "repaired" if report["attempts"] else "rendered"
+    else:
+        report["outcome"] = "failed"
+    report["total_seconds"] = round(time.time() - started, 3)
+    return result, report
+
+
+def save_render_report(report, path):
+    """Write a render report next to the job's other outputs."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        print(f"⚠️ Could not save render report: {e}")
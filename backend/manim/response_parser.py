@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import functools
+
+# Tags a <CODE_START> block can be closed with, in the order the extractors prefer them
+CODE_CLOSERS = ("</CODE_END>", "</CODE_START>", "<CODE_END>")
+
+# Everything the parser looks for, in one pattern so a response is scanned once:
+# XML-style tags, code fences, markdown header lines and **Label:** markers
+_TOKENS = re.compile(
+    r"(?P<tag></?(?P<name>[A-Za-z_][\w-]*)>)"
+    r"|(?P<fence>```)(?P<lang>[\w+-]*)"
+    r"|^[ \t]*#{1,6}[ \t]*(?P<header>[^\n]*?)[: \t]*$"
+    r"|\*\*(?P<label>[^*\n]+?):\*\*",
+    re.MULTILINE
+)
+
+
+@functools.lru_cache(maxsize=64)
+def parse_response(text):
+    """Index every section and code block of an LLM response in a single scan.
+
+    The extractors used to run one regex search per lookup (and up to four
+    fallback patterns after it) over the whole response. Here one pass finds
+    everything, so each later lookup is a dict access, and the result is
+    memoized per response text because the pipelines look up several sections
+    of the same response. The returned dict is shared; do not modify it.
+
+    Args:
+        text: Response text
+
+    Returns:
+        Dict with
+            "sections": XML-style ``<name>...</name>`` contents by name
+            "headers": markdown ``# Name`` / ``**Name:**`` contents by lowercased name
+            "code": ``<CODE_START>`` block contents by closing tag (see CODE_CLOSERS),
+                plus "unclosed" for the text up to the end of the response
+            "fences": fenced block contents by language ("" for none)
+            "first_fence": content of the first fenced block, or None
+        Each XML section, header, closing tag and language maps to its first occurrence.
+    """
+    sections, headers, code, fences = {}, {}, {}, {}
+    first_fence = None
+    open_tags = {}
+    code_start = None
+    fence_lang = fence_start = None
+    # A header's content runs up to the next header, a label's up to the next label
+    pending = {"header": None, "label": None}
+
+    for match in _TOKENS.finditer(text):
+        if match.group("fence"):
+            if fence_start is None:
+                fence_lang, fence_start = match.group("lang"), match.end()
+            else:
+                body = text[fence_start:match.start()]
+                fences.setdefault(fence_lang, body)
+                if first_fence is None:
+                    first_fence = body
+                fence_start = None
+            continue
+
+        if match.group("tag"):
+            tag, name = match.group("tag"), match.group("name")
+            if tag[1] != "/":
+                if name not in sections:
+                    open_tags.setdefault(name, match.end())
+                if name == "CODE_START" and code_start is None:
+                    code_start = match.end()
+            elif name in open_tags:
+                sections[name] = text[open_tags.pop(name):match.start()]
+            if code_start is not None and tag in CODE_CLOSERS and tag not in code:
+                if match.start() >= code_start:
+                    code[tag] = text[code_start:match.start()]
+            continue
+
+        # Python comments inside a fence are not headers
+        if fence_start is not None:
+            continue
+        kind = "header" if match.group("header") is not None else "label"
+        if pending[kind] is not None:
+            heading, start = pending[kind]
+            headers.setdefault(heading, text[start:match.start()])
+        pending[kind] = (match.group(kind).strip().lower(), match.end())
+
+    for heading, start in filter(None, pending.values()):
+        headers.setdefault(heading, text[start:])
+    if code_start is not None:
+        code["unclosed"] = text[code_start:]
+    return {"sections": sections, "headers": headers, "code": code,
+            "fences": fences, "first_fence": first_fence}
+
+
+def code_block(text, closers=("</CODE_END>", "</CODE_START>", "unclosed")):
+    """The <CODE_START> block of a response, stripped, or None.
+
+    Args:
+        text: Response text
+        closers: Keys of parse_response()["code"] to try, in order
+    """
+    code = parse_response(text)["code"]
+    for closer in closers:
+        if closer in code:
+            return code[closer].strip()
+    return None
+
+
+def _legacy_lookups(text, names):
+    """The per-lookup regex searches the extractors ran before parse_response."""
+    found = {}
+    for name in names:
+        match = re.search(rf'<{name}>(.*?)</{name}>', text, re.DOTALL)
+        if not match:
+            for pattern in (rf'#\s*{name}[:\s]*\n+(.*?)(?=\n#|$)',
+                            rf'##\s*{name}[:\s]*\n+(.*?)(?=\n##|$)',
+                            rf'###\s*{name}[:\s]*\n+(.*?)(?=\n###|$)',
+                            rf'\*\*{name}:\*\*\s*(.*?)(?=\n\*\*|\Z)'):
+                match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
+                if match:
+                    break
+        found[name] = match.group(1).strip() if match else None
+    match = None
+    for pattern in (r'<CODE_START>\s*(.*?)\s*</CODE_END>',
+                    r'<CODE_START>\s*(.*?)\s*</CODE_START>',
+                    r'<CODE_START>\s*(.*?)$'):
+        match = re.search(pattern, text, re.DOTALL)
+        if match:
+            break
+    found["code"] = match.group(1).strip() if match else None
+    match = re.search(r'```python\s*(.*?)\s*```', text, re.DOTALL)
+    found["python"] = match.group(1).strip() if match else None
+    return found
+
+
+def _parsed_lookups(text, names):
+    parsed = parse_response(text)
+    found = {}
+    for name in names:
+        content = parsed["sections"].get(name)
+        if content is None:
+            content = parsed["headers"].get(name.lower())
+        found[name] = content.strip() if content is not None else None
+    found["code"] = code_block(text)
+    python = parsed["fences"].get("python")
+    found["python"] = python.strip() if python is not None else None
+    return found
+
+
+def load_recorded_responses(*directories):
+    """Response texts of the LLM recordings and cache entries in the directories."""
+    responses = []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name), 'r') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            response = entry.get("response")
+            # Recordings store {"text": ...}, cache entries the text itself
+            if isinstance(response, dict):
+                response = response.get("text")
+            if isinstance(response, str) and response:
+                responses.append(response)
+    return responses
+
+
+def benchmark(responses, names, repeat=50):
+    """Time the old per-lookup regex searches against one parse per response.
+
+    Returns:
+        Dict with the seconds per pass over all responses for "legacy" and
+        "parsed", and the number of lookups whose results differ
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        legacy = [_legacy_lookups(text, names) for text in responses]
+    legacy_time = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        # Measure the scan itself, not the memoized result
+        parse_response.cache_clear()
+        parsed = [_parsed_lookups(text, names) for text in responses]
+    parsed_time = (time.perf_counter() - started) / repeat
+
+    differences = sum(1 for old, new in zip(legacy, parsed) for key in old if old[key] != new[key])
+    return {"legacy": legacy_time, "parsed": parsed_time, "differences": differences}
+
+
+def main():
+    content_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content")
+    parser = argparse.ArgumentParser(description="Benchmark response parsing on recorded LLM responses")
+    parser.add_argument("--dirs", nargs="+", default=[os.path.join(content_dir, "llm_recordings"),
+                                                      os.path.join(content_dir, "llm_cache")])
+    parser.add_argument("--sections", nargs="+",
+                        default=["concept_analysis", "visualization_approach", "key_visual_elements",
+                                 "animation_design", "self_evaluation", "code_self_evaluation",
+                                 "visualization_focus", "extracted_topic"])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    responses = load_recorded_responses(*args.dirs)
+    if not responses:
+        print("❌ No recorded responses found (record some with --llm-backend record)")
+        return 1
+    result = benchmark(responses, args.sections, args.repeat)
+    size = sum(len(text) for text in responses)
+    print(f"{len(responses)} responses, {size / 1024:.0f} KB, "
+          f"{len(args.sections) + 2} lookups per response")
+    print(f"  regex per lookup: {result['legacy'] * 1000:8.2f} ms")
+    print(f"  single scan:      {result['parsed'] * 1000:8.2f} ms")
+    print(f"✓ {result['legacy'] / max(result['parsed'], 1e-9):.1f}x faster")
+    if result["differences"]:
+        print(f"⚠️ {result['differences']} lookups differ from the regex results")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,607 @@
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
 import anthropic
+from llm_cache import ResponseCache, env_flag
+from llm_metrics import LLMMetrics
+from llm_rate_limit import SharedRateLimiter, estimate_tokens
+from llm_replay import LLMRecorder, backend_from_env, client_options
+from llm_streaming import CodeBlockEndDetector
+from llm_session import ConversationSession
+from llm_routing import ModelRouter
+from llm_resilience import LatencyTracker, CircuitBreaker, stage_budget
+from job_deadline import JobCancelled
+from code_preflight import preflight_check
 from prompts import (CONCEPT_BREAKDOWN, ANIMATION_TESTING, DESIGN, 
-                   CODE_GENERATION, 
+                   CODE_GENERATION, CODE_FOLLOW_UP,
                    extract_code_only, extract_section)
 
 class ManimGenerator:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, use_cache=None, refresh_cache=None, cache_dir=None,
+                 stream_code=None, backend=None, code_candidates=None, routing=None, hedging=None):
         print(f"Debug: Initializing ManimGenerator with API key length: {len(api_key) if api_key else 0}")
         print(f"Debug: API key starts with: {api_key[:12] if api_key else 'None'}")
-        self.client = anthropic.Anthropic(api_key=api_key)
+        
+        # "anthropic" calls the API, "record" also saves every exchange for replay and
+        # "replay" sends requests to the local stand-in started with llm_replay.py
+        self.backend = backend or backend_from_env()
+        self.client = anthropic.Anthropic(**client_options(self.backend, api_key))
+        self.recorder = LLMRecorder() if self.backend == "record" else None
         self.model = "claude-3-7-sonnet-20250219"
-        print(f"Initialized ManimGenerator with model: {self.model}")
+        print(f"Initialized ManimGenerator with model: {self.model} (backend: {self.backend})")
+        
+        # Light stages can run on a smaller model; self.model stays the default and upgrade target
+        if routing is None:
+            routing = env_flag("MANIM_LLM_ROUTING", default=True)
+        self.router = ModelRouter(large_model=self.model, enabled=routing)
+        
+        # Response cache switches can come from the caller or the environment
+        if use_cache is None:
+            use_cache = env_flag("MANIM_LLM_CACHE", default=True)
+        if refresh_cache is None:
+            refresh_cache = env_flag("MANIM_LLM_CACHE_REFRESH", default=False)
+        if self.recorder:
+            # Cache hits never reach the API, so recording always fetches fresh responses
+            refresh_cache = True
+        self.cache = ResponseCache(cache_dir=cache_dir) if use_cache else None
+        self.refresh_cache = refresh_cache
+        print(f"LLM response cache: {'enabled' if self.cache else 'disabled'}"
+              f"{' (refreshing entries)' if self.cache and refresh_cache else ''}")
+        
+        # Stream code generation calls and stop as soon as the code block closes
+        if stream_code is None:
+            stream_code = env_flag("MANIM_LLM_STREAM_CODE", default=False)
+        self.stream_code = stream_code
+        self.progress_listeners = []
+        
+        # JobDeadline of the job being served: calls stop once it is cancelled or expires
+        self.job_deadline = None
+        
+        # Number of code generation candidates raced against each other (1 = sequential)
+        if code_candidates is None:
+            code_candidates = int(os.getenv("MANIM_CODE_CANDIDATES", "1"))
+        self.code_candidates = max(1, int(code_candidates))
+        
+        # Token usage of the most recent call and per-stage accounting for the job
+        self.last_usage = None
+        self.metrics = LLMMetrics()
+        
+        # Per-stage latency budgets, hedge requests past the historical p95 and a
+        # circuit breaker that falls back to cached or template output
+        if hedging is None:
+            hedging = env_flag("MANIM_LLM_HEDGE", default=True)
+        self.hedging = hedging
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker.from_env()
+        
+        # Optional request/token budget shared with every other job on this machine,
+        # with one client per pooled API key
+        self.rate_limiter = SharedRateLimiter.from_env(api_key)
+        self.key_clients = {}
+        if self.rate_limiter:
+            for key_id, key in self.rate_limiter.api_keys.items():
+                self.key_clients[key_id] = anthropic.Anthropic(**client_options(self.backend, key))
+            print(f"Shared rate limiter: {self.rate_limiter.requests_per_minute:.0f} requests/min, "
+                  f"{self.rate_limiter.tokens_per_minute:.0f} tokens/min across "
+                  f"{len(self.key_clients)} API key(s)")
+    
+    def add_progress_listener(self, listener):
+        """Register a callable that receives progress events as dicts"""
+        self.progress_listeners.append(listener)
+
+    def remove_progress_listener(self, listener):
+        """Unregister a listener added with add_progress_listener"""
+        if listener in self.progress_listeners:
+            self.progress_listeners.remove(listener)
+
+    def emit_progress(self, event, **data):
+        """Send a progress event to every listener, ignoring listener errors"""
+        payload = {"event": event, **data}
+        for listener in list(self.progress_listeners):
+            try:
+                listener(payload)
+            except Exception as e:
+                print(f"⚠️ Progress listener failed: {e}")
+    
+    def _build_request(self, prompt, max_tokens, system=None, temperature=None, history=None,
+                       model=None):
+        """Build messages.create arguments, sending the system prompt as a cacheable block
+        
+        Args:
+            prompt: The user message
+            max_tokens: Maximum tokens for the response
+            system: Optional static system prompt
+            temperature: Optional sampling temperature
+            history: Earlier user/assistant messages of the same conversation
+            model: Model to send to, defaults to self.model
+            
+        Returns:
+            Dictionary of request keyword arguments
+        """
+        request = {
+            "model": model or self.model,
+            "max_tokens": max_tokens,
+            "messages": list(history or []) + [{
+                "role": "user",
+                "content": prompt
+            }]
+        }
+        if system:
+            # Marking the static prefix lets the provider reuse it across calls
+            request["system"] = [{
+                "type": "text",
+                "text": system,
+                "cache_control": {"type": "ephemeral"}
+            }]
+        if temperature is not None:
+            request["temperature"] = temperature
+        return request
+    
+    def _record_usage(self, message):
+        """Print and return token usage, including prompt cache reads and writes"""
+        usage = getattr(message, "usage", None) if message is not None else None
+        if usage is None:
+            self.last_usage = None
+            return None
+        
+        recorded = {
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        }
+        self.last_usage = recorded
+        
+        print(f"Token usage: input={recorded['input_tokens']}, output={recorded['output_tokens']}, "
+              f"cache_read={recorded['cache_read_input_tokens']}, "
+              f"cache_write={recorded['cache_creation_input_tokens']}")
+        return recorded
+    
+    def _record_call(self, stage, started, usage=None, stop_reason=None, cached=False, error=None,
+                     batch=False, model=None):
+        """Add one call to the job metrics and notify progress listeners"""
+        entry = self.metrics.record(
+            stage=stage,
+            model=model or self.model,
+            usage=usage,
+            stop_reason=stop_reason,
+            wall_time=time.time() - started,
+            cached=cached,
+            error=error,
+            batch=batch
+        )
+        print(f"[{entry['stage']}] {entry['wall_time']:.1f}s, attempt {entry['attempt']}, "
+              f"stop_reason={entry['stop_reason']}{' (cached)' if cached else ''}"
+              f"{' (batch)' if batch else ''}")
+        self.emit_progress("llm_usage", **entry)
+        return entry
+    
+    def usage_summary(self):
+        """Return a one-line summary of token usage across all calls"""
+        totals = self.metrics.totals()
+        return (f"LLM usage: {totals['calls']} calls, {totals['input_tokens']} input tokens, "
+                f"{totals['output_tokens']} output tokens, "
+                f"{totals['cache_read_input_tokens']} cache reads, "
+                f"{totals['cache_creation_input_tokens']} cache writes, "
+                f"~${totals['cost_usd']:.4f}")
+    
+    def resilience_summary(self):
+        """Return a one-line summary of hedged requests and the circuit breaker"""
+        return (f"LLM hedging: {self.hedges} hedge requests, {self.hedge_wins} answered first; "
+                f"{self.breaker.summary()}")
+    
+    def write_metrics(self, path, job=None):
+        """Write per-stage LLM metrics for this job to a JSON file and print the summary"""
+        print(self.metrics.summary())
+        print(self.router.summary())
+        print(self.resilience_summary())
+        written = self.metrics.write(path, job)
+        if written:
+            print(f"LLM metrics saved to: {written}")
+        return written
+    
+    def _job_budget(self, stage):
+        """The stage's latency budget, cut down to what is left of the job deadline"""
+        budget = stage_budget(stage)
+        if self.job_deadline is not None:
+            self.job_deadline.check()
+            budget = self.job_deadline.limit(budget)
+        return budget
+    
+    def reset_job_accounting(self):
+        """Start the per-job metrics afresh, for a generator that serves several jobs"""
+        self.metrics = LLMMetrics()
+        self.last_usage = None
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.router.upgrades = 0
+    
+    def _reservation_size(self, prompt, max_tokens, system=None):
+        """Tokens to reserve before a call: estimated input plus the full output budget"""
+        return estimate_tokens(prompt) + estimate_tokens(system) + max_tokens
+    
+    @staticmethod
+    def _tokens_used(usage):
+        """Tokens a finished call counts against the per-minute budget"""
+        if not usage:
+            return 0
+        return (usage["input_tokens"] + usage["output_tokens"]
+                + usage["cache_creation_input_tokens"])
+    
+    def _reserve_capacity(self, prompt, max_tokens, system=None, cancel=None):
+        """Wait for shared rate-limit capacity and pick the client to send with
+        
+        The wait ends early once ``cancel`` is set (the key id is then None) or
+        the job is cancelled (JobCancelled).
+        
+        Returns:
+            Tuple of (key id or None, reserved tokens, client)
+        """
+        if not self.rate_limiter:
+            return None, 0, self.client
+        reserved = self._reservation_size(prompt, max_tokens, system)
+        key_id = self.rate_limiter.acquire(reserved, cancel=cancel, deadline=self.job_deadline)
+        if key_id is None:
+            return None, 0, None
+        return key_id, reserved, self.key_clients[key_id]
+    
+    def _release_capacity(self, key_id, reserved):
+        """Give back a reservation whose request was never sent"""
+        if self.rate_limiter and key_id:
+            self.rate_limiter.release(key_id, reserved)
+    
+    def _settle_capacity(self, key_id, reserved, usage=None):
+        """Give back the part of a reservation the call did not use"""
+        if self.rate_limiter and key_id:
+            self.rate_limiter.settle(key_id, reserved, self._tokens_used(usage))
+    
+    def _record_exchange(self, request, content_text, usage, stop_reason, started, stage):
+        """Save a completed call for offline replay when recording"""
+        if self.recorder and content_text is not None:
+            self.recorder.record(request, content_text, usage=usage, stop_reason=stop_reason,
+                                 latency=time.time() - started, stage=stage)
+    
+    def cache_summary(self):
+        """Return a one-line summary of response cache usage"""
+        if not self.cache:
+            return "LLM cache: disabled"
+        return self.cache.summary()
+    
+    @staticmethod
+    def _cache_extra(stop_at_code_end=False, system=None, temperature=None, history=None):
+        """Request options besides the prompt that change the response, for the cache key"""
+        cache_extra = {"stop_at_code_end": True} if stop_at_code_end else {}
+        if system:
+            cache_extra["system"] = system
+        if temperature is not None:
+            cache_extra["temperature"] = temperature
+        if history:
+            cache_extra["history"] = history
+        return cache_extra
+    
+    @staticmethod
+    def _with_history(prompt, history=None):
+        """Full conversation text, used to size rate-limit reservations"""
+        if not history:
+            return prompt
+        return "".join(message["content"] for message in history) + prompt
+    
+    def _cache_lookup(self, prompt, max_tokens, use_cache=True, model=None, **extra):
+        """Return (cache_key, cached_response) for a prompt; both may be None"""
+        if not (self.cache and use_cache):
+            return None, None
+        cache_key = self.cache.make_key(model or self.model, max_tokens, prompt, **extra)
+        if self.refresh_cache:
+            return cache_key, None
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            print(f"Cache hit for prompt ({len(prompt)} chars) - skipping API call")
+        return cache_key, cached
     
-    def _send_prompt(self, prompt, max_tokens=5000):
-        """Helper method to send a prompt to the API and get the text response"""
-        print(f"Sending prompt to API with max_tokens={max_tokens}")
+    def _cache_store(self, cache_key, content_text, max_tokens, model=None):
+        """Save a successful response under its cache key"""
+        if cache_key and content_text:
+            self.cache.set(cache_key, content_text, {"model": model or self.model, "max_tokens": max_tokens})
+    
+    @staticmethod
+    def _response_text(message):
+        """Concatenate the text blocks of an API message"""
+        content_text = ""
+        for content_block in message.content:
+            if content_block.type == "text":
+                content_text += content_block.text
+        return content_text
+    
+    @staticmethod
+    def _log_response(content_text):
+        """Print response previews and the code tag diagnostics"""
+        print(f"Received response of length: {len(content_text)}")
+        print(f"Response first 100 chars: {content_text[:100]}...")
+        print(f"Response last 100 chars: {content_text[-100:]}...")
+        
+        # Check for <CODE_START> and <CODE_END> tags
+        if "<CODE_START>" in content_text and "<CODE_END>" in content_text:
+            print("SUCCESS: Found <CODE_START> and <CODE_END> tags in response")
+        else:
+            print("WARNING: <CODE_START> or <CODE_END> tags not found in response")
+            # Print snippets around potential code areas
+            if "```python" in content_text:
+                print("Found '```python' in response - checking context:")
+                index = content_text.find("```python")
+                context_start = max(0, index - 50)
+                context_end = min(len(content_text), index + 50)
+                print(f"Context around ```python: {content_text[context_start:context_end]}")
+            
+            if "```" in content_text:
+                print(f"Found {content_text.count('```')} occurrences of ``` in response")
+    
+    @staticmethod
+    def _log_error(e):
+        print(f"Error sending prompt: {str(e)}")
+        print(f"Error type: {type(e)}")
+        print(f"Error details: {e.__dict__ if hasattr(e, '__dict__') else 'No details available'}")
+    
+    def _stream_until_code_end(self, request, client=None, cancel=None, timeout=None):
+        """Stream a request, stopping once the first code block is closed
+        
+        Args:
+            request: Keyword arguments for messages.stream
+            client: Client to send with, defaults to self.client
+            cancel: Optional threading.Event that abandons the stream when set
+            timeout: Optional request timeout in seconds
+            
+        Returns:
+            Tuple of (response text truncated right after the closing code marker,
+            message snapshot carrying usage or None, stop reason)
+        """
+        detector = CodeBlockEndDetector()
+        end = -1
+        cancelled = False
+        options = {"timeout": timeout} if timeout else {}
+        with (client or self.client).messages.stream(**request, **options) as stream:
+            for delta in stream.text_stream:
+                end = detector.feed(delta)
+                self.emit_progress("llm_partial", text=detector.text, chars=len(detector.text))
+                if end != -1:
+                    # Leaving the context manager closes the connection and stops generation
+                    break
+                if cancel is not None and cancel.is_set():
+                    cancelled = True
+                    break
+                if self.job_deadline is not None and self.job_deadline.cancelled():
+                    cancelled = True
+                    break
+            if end != -1 or cancelled:
+                message = getattr(stream, "current_message_snapshot", None)
+            else:
+                message = stream.get_final_message()
+        if cancelled:
+            return detector.text, message, "cancelled"
+        if end != -1:
+            print(f"Closing code tag seen after {end} chars - stopped streaming early")
+            return detector.text[:end], message, "code_end"
+        return detector.text, message, getattr(message, "stop_reason", None)
+    
+    def _cacheable(self, model, validate, response):
+        """False for a smaller model's reply that fails validation, so later runs never replay it"""
+        if not validate or not self.router.can_upgrade(model):
+            return True
+        try:
+            return bool(response) and bool(validate(response))
+        except Exception:
+            return False
+    
+    def _needs_upgrade(self, model, validate, response):
+        """True when a reply from a smaller model fails the caller's validation"""
+        if not validate or not self.router.can_upgrade(model):
+            return False
+        try:
+            valid = bool(response) and bool(validate(response))
+        except Exception as e:
+            print(f"⚠️ Validation of {model} output failed: {e}")
+            valid = False
+        if valid:
+            return False
+        self.router.upgrades += 1
+        print(f"⚠️ Output from {model} failed validation - retrying with {self.router.large_model}")
+        return True
+    
+    def _send_prompt(self, prompt, max_tokens=None, use_cache=True, stop_at_code_end=False,
+                     system=None, stage=None, temperature=None, cancel=None, history=None,
+                     model=None, validate=None, fallback=None):
+        """Helper method to send a prompt to the API and get the text response
+        
+        Args:
+            prompt: The prompt text (the user message)
+            max_tokens: Maximum tokens for the response, defaults to the stage's route
+            use_cache: Whether the response cache may be used for this call
+            stop_at_code_end: Stream the response and stop once the code block closes
+            system: Optional static system prompt, sent as a cacheable system block
+            stage: Pipeline stage name, used for model routing and per-stage metrics
+            temperature: Optional sampling temperature
+            cancel: Optional threading.Event; a streamed call stops when it is set
+            history: Earlier messages of the conversation (see start_session)
+            model: Model to use instead of the stage's route
+            validate: Optional check of the response text; a failing reply from a
+                smaller model is requested again from the large model
+            fallback: Template text, or a callable taking the prompt, returned when the
+                circuit breaker is open and no cached response exists
+            
+        Returns:
+            The response text, or None if the request failed or was cancelled
+        """
+        model, max_tokens = self.router.route(stage, max_tokens, model)
+        response = self._call_model(prompt, max_tokens, use_cache, stop_at_code_end, system, stage,
+                                    temperature, cancel, history, model, fallback, validate)
+        if self._needs_upgrade(model, validate, response):
+            response = self._call_model(prompt, max_tokens, use_cache, stop_at_code_end, system, stage,
+                                        temperature, cancel, history, self.router.large_model, fallback)
+        return response
+    
+    def _degraded_response(self, prompt, max_tokens, model, cache_extra, fallback, stage, started):
+        """Output used while the circuit breaker is open: any cached response, else the template"""
+        text = None
+        if self.cache:
+            cache_key = self.cache.make_key(model, max_tokens, prompt, **cache_extra)
+            text = self.cache.get(cache_key, allow_stale=True)
+        source = "cached"
+        if text is None and fallback is not None:
+            text = fallback(prompt) if callable(fallback) else fallback
+            source = "template"
+        if text is None:
+            print(f"❌ Circuit breaker open - no cached or template output for {stage or 'this call'}")
+            self._record_call(stage, started, error="circuit open", model=model)
+            return None
+        print(f"⚠️ Circuit breaker open - using {source} output for {stage or 'this call'}")
+        self._record_call(stage, started, stop_reason="circuit_open", cached=True, model=model)
+        return text
+    
+    def _attempt(self, request, stage, model, prompt, history, max_tokens, system,
+                 stop_at_code_end, cancel, timeout, abandoned=None):
+        """One API call with rate limiting, metrics and latency tracking
+        
+        An attempt cancelled after it was sent is recorded once, with the
+        reason ``_hedged`` left in ``abandoned`` (if any) as its error.
+        
+        Returns:
+            Tuple of (response text, usage, stop reason)
+        """
+        started = time.time()
+        key_id, reserved, sent = None, 0, False
+        try:
+            key_id, reserved, client = self._reserve_capacity(
+                self._with_history(prompt, history), max_tokens, system, cancel)
+            # A job cancelled or a hedge decided while waiting for capacity sends nothing
+            if self.job_deadline is not None:
+                self.job_deadline.check()
+            if cancel is not None and cancel.is_set():
+                self._release_capacity(key_id, reserved)
+                return "", None, "cancelled"
+            sent = True
+            if stop_at_code_end:
+                content_text, message, stop_reason = self._stream_until_code_end(
+                    request, client, cancel, timeout)
+            else:
+                message = client.messages.create(**request, timeout=timeout)
+                # Get the text content from the response
+                content_text = self._response_text(message)
+                stop_reason = getattr(message, "stop_reason", None)
+        except Exception as e:
+            if sent:
+                self._settle_capacity(key_id, reserved)
+            else:
+                self._release_capacity(key_id, reserved)
+            self._record_call(stage, started, error=str(e), model=model)
+            raise
+        
+        usage = self._record_usage(message)
+        self._settle_capacity(key_id, reserved, usage)
+        error = None
+        if cancel is not None and cancel.is_set():
+            # A hedge that lost the race, or a call past its budget, still used tokens
+            stop_reason = "cancelled"
+            error = (abandoned or {}).get("reason")
+        else:
+            self.latency.observe(stage, model, time.time() - started)
+        self._record_call(stage, started, usage=usage, stop_reason=stop_reason, error=error,
+                          model=model)
+        return content_text, usage, stop_reason
+    
+    @staticmethod
+    def _budget_exceeded(stage, budget, abandoned):
+        """TimeoutError for a call past its budget, noting the reason for the abandoned attempts"""
+        reason = f"{stage or 'LLM'} call exceeded its {budget:.1f}s latency budget"
+        if abandoned is not None:
+            abandoned["reason"] = reason
+        return TimeoutError(reason)
+    
+    def _hedged(self, attempt, stage, budget, hedge_after, abandoned=None):
+        """Run ``attempt(cancel)`` within the stage budget, hedging once after ``hedge_after`` seconds
+        
+        When the budget runs out the reason is stored in ``abandoned`` for the
+        attempts to record, so the timeout is counted once.
+        
+        Returns:
+            The first successful attempt result
+        """
+        cancels = []
+        futures = {}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        
+        def launch():
+            cancels.append(threading.Event())
+            futures[executor.submit(attempt, cancels[-1])] = len(cancels) - 1
+        
+        deadline = time.time() + budget
+        # A cancelled job completes this future, which ends the wait below at once
+        job_cancel = {self.job_deadline.future} if self.job_deadline is not None else set()
+        error = None
+        try:
+            launch()
+            pending = set(futures)
+            while pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if self.job_deadline is not None:
+                        self.job_deadline.check()
+                    raise self._budget_exceeded(stage, budget, abandoned)
+                wait_for = remaining
+                if hedge_after and len(cancels) == 1:
+                    wait_for = min(remaining, max(0.0, hedge_after - (budget - remaining)))
+                done, pending = concurrent.futures.wait(
+                    pending | job_cancel, timeout=wait_for, return_when=concurrent.futures.FIRST_COMPLETED)
+                pending -= job_cancel
+                if done & job_cancel:
+                    self.job_deadline.check()
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if futures[future] > 0:
+                        self.hedge_wins += 1
+                        print("✓ Hedge request answered first")
+                    return result
+                if not done and hedge_after and len(cancels) == 1:
+                    self.hedges += 1
+                    print(f"⚠️ {stage or 'LLM'} call still running after {hedge_after:.1f}s "
+                          f"(historical p95) - sending a hedge request")
+                    launch()
+                    pending = {future for future in futures if not future.done()}
+            raise error or self._budget_exceeded(stage, budget, abandoned)
+        finally:
+            # Losers still waiting for rate-limit capacity send nothing and streams stop at
+            # their next chunk; a plain call already sent finishes in the background
+            for cancel in cancels:
+                cancel.set()
+            executor.shutdown(wait=False)
+    
+    def _call_model(self, prompt, max_tokens, use_cache, stop_at_code_end, system, stage,
+                    temperature, cancel, history, model, fallback=None, validate=None):
+        """Send one request to ``model`` (see _send_prompt for the arguments)"""
+        started = time.time()
+        cache_extra = self._cache_extra(stop_at_code_end, system, temperature, history)
+        cache_key, cached = self._cache_lookup(prompt, max_tokens, use_cache, model=model, **cache_extra)
+        if cached is not None:
+            self._record_call(stage, started, stop_reason="cache_hit", cached=True, model=model)
+            return cached
+        
+        # Before allow(), so a cancelled job never takes the half-open trial
+        budget = self._job_budget(stage)
+        if not self.breaker.allow():
+            return self._degraded_response(prompt, max_tokens, model, cache_extra, fallback,
+                                           stage, started)
+        
+        if history:
+            print(f"Continuing conversation with {len(history)} earlier messages")
+        print(f"Sending prompt to {model} with max_tokens={max_tokens}")
+        if system:
+            print(f"System prompt: {len(system)} chars (cacheable)")
         print(f"Prompt first 100 chars: {prompt[:300]}...")
         print(f"Prompt last 100 chars: {prompt[-300:]}...")
         
@@ -23,47 +611,127 @@ class ManimGenerator:
             print(f"Debug: API key length: {len(self.client.api_key) if self.client and hasattr(self.client, 'api_key') else 'N/A'}")
             print(f"Debug: API key starts with: {self.client.api_key[:12] if self.client and hasattr(self.client, 'api_key') else 'N/A'}")
             
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=max_tokens,
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
-            )
+            request = self._build_request(prompt, max_tokens, system, temperature, history, model)
             
-            # Get the text content from the response
-            content_text = ""
-            for content_block in message.content:
-                if content_block.type == "text":
-                    content_text += content_block.text
+            abandoned = {}
             
-            print(f"Received response of length: {len(content_text)}")
-            print(f"Response first 100 chars: {content_text[:100]}...")
-            print(f"Response last 100 chars: {content_text[-100:]}...")
+            def attempt(attempt_cancel):
+                return self._attempt(request, stage, model, prompt, history, max_tokens, system,
+                                     stop_at_code_end, attempt_cancel, budget, abandoned)
             
-            # Check for <CODE_START> and <CODE_END> tags
-            if "<CODE_START>" in content_text and "<CODE_END>" in content_text:
-                print("SUCCESS: Found <CODE_START> and <CODE_END> tags in response")
+            if cancel is not None:
+                # Raced candidates are redundant already, so they are not hedged
+                content_text, usage, stop_reason = attempt(cancel)
             else:
-                print("WARNING: <CODE_START> or <CODE_END> tags not found in response")
-                # Print snippets around potential code areas
-                if "```python" in content_text:
-                    print("Found '```python' in response - checking context:")
-                    index = content_text.find("```python")
-                    context_start = max(0, index - 50)
-                    context_end = min(len(content_text), index + 50)
-                    print(f"Context around ```python: {content_text[context_start:context_end]}")
-                
-                if "```" in content_text:
-                    print(f"Found {content_text.count('```')} occurrences of ``` in response")
+                # Only a stream stops when its hedge loses; a plain call would be paid twice
+                hedge_after = None
+                if self.hedging and stop_at_code_end:
+                    hedge_after = self.latency.hedge_delay(stage, model, budget)
+                content_text, usage, stop_reason = self._hedged(attempt, stage, budget, hedge_after,
+                                                                abandoned)
+            self.breaker.record_success()
+            
+            if stop_reason == "cancelled":
+                print(f"Call abandoned after {len(content_text)} chars")
+                return None
+            self._record_exchange(request, content_text, usage, stop_reason, started, stage)
+            self._log_response(content_text)
+            if self._cacheable(model, validate, content_text):
+                self._cache_store(cache_key, content_text, max_tokens, model)
             
             return content_text
+        except JobCancelled:
+            # Stopping a job says nothing about the health of the API, but a
+            # half-open trial it was running has to be handed back
+            self.breaker.release_trial()
+            raise
         except Exception as e:
-            print(f"Error sending prompt: {str(e)}")
-            print(f"Error type: {type(e)}")
-            print(f"Error details: {e.__dict__ if hasattr(e, '__dict__') else 'No details available'}")
+            self._log_error(e)
+            self.breaker.record_failure()
+            return None
+    
+    def start_session(self, stage, system=None, max_tokens=None, stop_at_code_end=False):
+        """Start a conversation whose retries are sent as short follow-up turns"""
+        return ConversationSession(self, stage, system=system, max_tokens=max_tokens,
+                                   stop_at_code_end=stop_at_code_end)
+    
+    @staticmethod
+    def _candidate_temperatures(candidates):
+        """Spread candidate sampling temperatures evenly between 0.2 and 1.0"""
+        if candidates <= 1:
+            return [None]
+        return [round(0.2 + 0.8 * i / (candidates - 1), 2) for i in range(candidates)]
+    
+    @staticmethod
+    def _judge_candidate(response, accept, temperature):
+        """Run a candidate response through ``accept``, treating errors as a rejection"""
+        if response is None:
             return None
+        try:
+            result = accept(response)
+        except Exception as e:
+            print(f"⚠️ Candidate check failed: {e}")
+            result = None
+        if result is None:
+            print(f"❌ Candidate (temperature={temperature}) rejected")
+        else:
+            print(f"✓ Candidate (temperature={temperature}) accepted")
+        return result
+    
+    def race_prompt(self, prompt, accept, candidates=None, max_tokens=None, system=None, stage=None):
+        """Send a prompt as several concurrent candidates and keep the first one accepted
+        
+        Each candidate uses a different temperature and is streamed until its code
+        block closes. Responses are checked with ``accept`` as they arrive; the first
+        accepted one wins and the remaining streams are abandoned.
+        
+        Args:
+            prompt: The prompt text (the user message)
+            accept: Callable taking a response and returning a result, or None to reject it
+            candidates: Number of candidates, defaults to self.code_candidates
+            max_tokens: Maximum tokens for each response
+            system: Optional static system prompt
+            stage: Pipeline stage name used for the per-stage metrics
+            
+        Returns:
+            Tuple of (accepted result, winning response), or (None, None) if none passed
+        """
+        temperatures = self._candidate_temperatures(candidates or self.code_candidates)
+        print(f"Racing {len(temperatures)} candidates (temperatures: {temperatures})")
+        cancel = threading.Event()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(temperatures), thread_name_prefix="llm-candidate"
+        )
+        futures = {
+            executor.submit(self._send_prompt, prompt, max_tokens=max_tokens, stop_at_code_end=True,
+                            system=system, stage=stage, temperature=temperature,
+                            cancel=cancel): temperature
+            for temperature in temperatures
+        }
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                response = future.result()
+                result = self._judge_candidate(response, accept, futures[future])
+                if result is not None:
+                    return result, response
+        finally:
+            cancel.set()
+            executor.shutdown(wait=False)
+        print("❌ No candidate passed validation")
+        return None, None
+    
+    def _accept_code(self, topic, class_name=None):
+        """Build a race_prompt check that extracts code and runs the pre-flight check"""
+        def accept(response):
+            code = extract_code_only(response, topic)
+            if not code:
+                return None
+            ok, message = preflight_check(code, class_name)
+            if not ok:
+                print(f"Pre-flight check failed: {message}")
+                return None
+            return code
+        return accept
     
     def analyze_concept(self, math_topic, audience_level="high school"):
         """Break down a mathematical concept for visualization"""
@@ -72,7 +740,7 @@ class ManimGenerator:
             topic=math_topic,
             audience_level=audience_level
         )
-        response = self._send_prompt(formatted_prompt, max_tokens=3500)
+        response = self._send_prompt(formatted_prompt, max_tokens=3500, stage="concept_analysis")
         
         # Extract the key sections from the response
         concept_analysis = extract_section(response, "concept_analysis")
@@ -103,7 +771,7 @@ class ManimGenerator:
             formatted_prompt += f"\n\n<concept_analysis>\n{concept_analysis}\n</concept_analysis>"
             print("Included concept_analysis in design prompt")
         
-        response = self._send_prompt(formatted_prompt, max_tokens=3500)
+        response = self._send_prompt(formatted_prompt, max_tokens=3500, stage="design")
         
         # Extract the animation design section
         animation_design = extract_section(response, "animation_design")
@@ -126,7 +794,7 @@ class ManimGenerator:
             animation_design=animation_design
         )
         
-        response = self._send_prompt(formatted_prompt, max_tokens=3000)
+        response = self._send_prompt(formatted_prompt, max_tokens=3000, stage="design_testing")
         
         # Extract the key sections
         novice_viewer = extract_section(response, "novice_viewer")
@@ -166,39 +834,57 @@ class ManimGenerator:
         # Add debug info directly to prompt
         formatted_prompt += "\n\nIMPORTANT DEBUG NOTE: The system REQUIRES you to include EXACT <CODE_START> and <CODE_END> tags around your code. DO NOT use markdown triple backticks or any variations. The format must be exactly as shown in the example with unmodified tags."
         
+        if self.code_candidates > 1:
+            clean_code, response = self.race_prompt(
+                formatted_prompt, self._accept_code(topic), max_tokens=5000, stage="code_generation"
+            )
+            if clean_code:
+                return {
+                    "code": clean_code,
+                    "self_evaluation": extract_section(response, "code_self_evaluation"),
+                    "full_response": response
+                }
+            print("No code candidate passed - falling back to a single request with retries")
+        
         print("Sending code generation prompt with debug note added")
-        response = self._send_prompt(formatted_prompt, max_tokens=5000)
-        
-        # Debug the raw response
-        print("\nDEBUG: Checking raw response for code tags:")
-        if "<CODE_START>" in response:
-            start_idx = response.find("<CODE_START>")
-            print(f"Found <CODE_START> tag at position {start_idx}")
-            print(f"Content around start tag: {response[max(0, start_idx-20):start_idx+20]}")
+        session = self.start_session("code_generation", max_tokens=5000, stop_at_code_end=self.stream_code)
+        response = session.send(formatted_prompt)
+        
+        if response is None:
+            # Handled by the retry below, which resends the full prompt
+            print("ERROR: Code generation request failed")
+            clean_code, self_evaluation = None, None
         else:
-            print("ERROR: <CODE_START> tag not found in response")
+            # Debug the raw response
+            print("\nDEBUG: Checking raw response for code tags:")
+            if "<CODE_START>" in response:
+                start_idx = response.find("<CODE_START>")
+                print(f"Found <CODE_START> tag at position {start_idx}")
+                print(f"Content around start tag: {response[max(0, start_idx-20):start_idx+20]}")
+            else:
+                print("ERROR: <CODE_START> tag not found in response")
             
-        if "<CODE_END>" in response:
-            end_idx = response.find("<CODE_END>")
-            print(f"Found <CODE_END> tag at position {end_idx}")
-            print(f"Content around end tag: {response[max(0, end_idx-20):end_idx+20]}")
-        else:
-            print("ERROR: <CODE_END> tag not found in response")
+            if "<CODE_END>" in response:
+                end_idx = response.find("<CODE_END>")
+                print(f"Found <CODE_END> tag at position {end_idx}")
+                print(f"Content around end tag: {response[max(0, end_idx-20):end_idx+20]}")
+            else:
+                print("ERROR: <CODE_END> tag not found in response")
         
-        # Check for code blocks in markdown format
-        if "```python" in response:
-            py_start = response.find("```python")
-            py_end = response.find("```", py_start + 10)
-            print(f"Found markdown python block: positions {py_start} to {py_end}")
-            print(f"First 100 chars of markdown block: {response[py_start+10:py_start+110]}...")
+            # Check for code blocks in markdown format
+            if "```python" in response:
+                py_start = response.find("```python")
+                py_end = response.find("```", py_start + 10)
+                print(f"Found markdown python block: positions {py_start} to {py_end}")
+                print(f"First 100 chars of markdown block: {response[py_start+10:py_start+110]}...")
         
-        # Extract only the code portion, with topic validation
-        print("Attempting to extract code with topic validation")
-        clean_code = extract_code_only(response, topic)
-        print(f"Extracted code length: {len(clean_code) if clean_code else 0} chars")
+            # Extract only the code portion, with topic validation
+            print("Attempting to extract code with topic validation")
+            clean_code = extract_code_only(response, topic)
+            print(f"Extracted code length: {len(clean_code) if clean_code else 0} chars")
         
-        self_evaluation = extract_section(response, "code_self_evaluation")
-        print(f"Extracted self_evaluation: {len(self_evaluation) if self_evaluation else 0} chars")
+            self_evaluation = extract_section(response, "code_self_evaluation")
+            print(f"Extracted self_evaluation: {len(self_evaluation) if self_evaluation else 0} chars")
         
         # Handle case where code extraction or topic validation failed
         if not clean_code:
@@ -206,22 +892,35 @@ class ManimGenerator:
             print("The generated code may not be relevant to the requested topic.")
             print("Attempting to prompt Claude again with stronger topic emphasis...")
             
-            # Try again with even stronger topic emphasis
-            retry_prompt = CODE_GENERATION.format(
-                topic=topic,
-                design_scene=design,
-                safe_class_name=safe_class_name,
-                TOPIC=topic,
-                SAFE_CLASS_NAME=safe_class_name
-            )
-            retry_prompt += f"\n\nCRITICAL: You MUST create a MANIM animation about {topic}. " \
-                        f"The class name should include '{topic.replace(' ', '')}' and " \
-                        f"the code must explicitly be about {topic} in its comments and visuals."
-            
-            retry_prompt += "\n\nABSOLUTELY CRITICAL: You MUST wrap your code in <CODE_START> and <CODE_END> tags EXACTLY as shown below. DO NOT use markdown formatting, DO NOT use triple backticks, ONLY use these exact tags:\n\n<CODE_START>\n# Your code here\n<CODE_END>"
+            if session.turns:
+                # The design is already in the conversation, so a short correction is enough
+                retry_prompt = CODE_FOLLOW_UP.format(topic=topic, safe_class_name=safe_class_name)
+                print("Sending short follow-up asking for the tagged code only")
+            else:
+                # The first request failed outright - try again with even stronger topic emphasis
+                retry_prompt = CODE_GENERATION.format(
+                    topic=topic,
+                    design_scene=design,
+                    safe_class_name=safe_class_name,
+                    TOPIC=topic,
+                    SAFE_CLASS_NAME=safe_class_name
+                )
+                retry_prompt += f"\n\nCRITICAL: You MUST create a MANIM animation about {topic}. " \
+                            f"The class name should include '{topic.replace(' ', '')}' and " \
+                            f"the code must explicitly be about {topic} in its comments and visuals."
+                
+                retry_prompt += "\n\nABSOLUTELY CRITICAL: You MUST wrap your code in <CODE_START> and <CODE_END> tags EXACTLY as shown below. DO NOT use markdown formatting, DO NOT use triple backticks, ONLY use these exact tags:\n\n<CODE_START>\n# Your code here\n<CODE_END>"
+                print("Sending retry prompt with CRITICAL tag instructions")
             
-            print("Sending retry prompt with CRITICAL tag instructions")
-            retry_response = self._send_prompt(retry_prompt, max_tokens=5000)
+            retry_response = session.send(retry_prompt)
+            if retry_response is None:
+                print("ERROR: Code generation retry request failed")
+                return {
+                    "code": None,
+                    "self_evaluation": None,
+                    "full_response": response,
+                    "error": f"Code generation request failed for '{topic}'"
+                }
             
             print("\nDEBUG: Checking retry response for code tags:")
             if "<CODE_START>" in retry_response:
@@ -310,4 +1009,313 @@ class ManimGenerator:
             "code_generation": code_results,
             "final_code": final_code,
             "summary": summary
-        }
\ No newline at end of file
+        }
+
+
+class AsyncManimGenerator(ManimGenerator):
+    """ManimGenerator variant that sends prompts through AsyncAnthropic.
+
+    All requests run on one background event loop and share a semaphore that
+    caps how many calls are in flight at once. ``send_prompt`` can be awaited
+    from any event loop, and ``_send_prompt`` keeps the blocking signature so
+    the existing get_llm_response callbacks work unchanged - calls made from
+    several threads or tasks then proceed concurrently up to the limit.
+    """
+    
+    def __init__(self, api_key=None, max_in_flight=4, **kwargs):
+        super().__init__(api_key=api_key, **kwargs)
+        self.async_client = anthropic.AsyncAnthropic(**client_options(self.backend, api_key))
+        self.async_key_clients = {
+            key_id: anthropic.AsyncAnthropic(**client_options(self.backend, key))
+            for key_id, key in (self.rate_limiter.api_keys.items() if self.rate_limiter else ())
+        }
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._in_flight = 0
+        self._loop = None
+        self._loop_thread = None
+        self._semaphore = None
+        self._loop_lock = threading.Lock()
+        # (job deadline, asyncio future completed when it is cancelled)
+        self._job_cancel_waiter = None
+        print(f"Async LLM client enabled with max {self.max_in_flight} requests in flight")
+    
+    def _ensure_loop(self):
+        """Start the background event loop that owns the client and limiter"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="llm-event-loop",
+                    daemon=True
+                )
+                self._loop_thread.start()
+                self._semaphore = asyncio.run_coroutine_threadsafe(
+                    self._create_semaphore(), self._loop
+                ).result()
+        return self._loop
+    
+    async def _create_semaphore(self):
+        return asyncio.Semaphore(self.max_in_flight)
+    
+    async def _stream_until_code_end_async(self, request, client=None):
+        """Async counterpart of _stream_until_code_end"""
+        detector = CodeBlockEndDetector()
+        end = -1
+        async with (client or self.async_client).messages.stream(**request) as stream:
+            async for delta in stream.text_stream:
+                end = detector.feed(delta)
+                self.emit_progress("llm_partial", text=detector.text, chars=len(detector.text))
+                if end != -1:
+                    break
+            if end != -1:
+                message = getattr(stream, "current_message_snapshot", None)
+            else:
+                message = await stream.get_final_message()
+        if end != -1:
+            print(f"Closing code tag seen after {end} chars - stopped streaming early")
+            return detector.text[:end], message, "code_end"
+        return detector.text, message, getattr(message, "stop_reason", None)
+    
+    async def _request(self, prompt, max_tokens=None, use_cache=True, stop_at_code_end=False,
+                       system=None, stage=None, temperature=None, history=None,
+                       model=None, validate=None, fallback=None):
+        """Coroutine that runs on the background loop, routed like ManimGenerator._send_prompt"""
+        model, max_tokens = self.router.route(stage, max_tokens, model)
+        response = await self._request_model(prompt, max_tokens, use_cache, stop_at_code_end,
+                                             system, stage, temperature, history, model, fallback,
+                                             validate)
+        if self._needs_upgrade(model, validate, response):
+            response = await self._request_model(prompt, max_tokens, use_cache, stop_at_code_end,
+                                                 system, stage, temperature, history,
+                                                 self.router.large_model, fallback)
+        return response
+    
+    async def _request_model(self, prompt, max_tokens, use_cache, stop_at_code_end, system, stage,
+                             temperature, history, model, fallback=None, validate=None):
+        """Send one async request to ``model`` within the stage budget, hedged past the p95"""
+        started = time.time()
+        cache_extra = self._cache_extra(stop_at_code_end, system, temperature, history)
+        cache_key, cached = self._cache_lookup(prompt, max_tokens, use_cache, model=model, **cache_extra)
+        if cached is not None:
+            self._record_call(stage, started, stop_reason="cache_hit", cached=True, model=model)
+            return cached
+        
+        # Before allow(), so a cancelled job never takes the half-open trial
+        budget = self._job_budget(stage)
+        if not self.breaker.allow():
+            return self._degraded_response(prompt, max_tokens, model, cache_extra, fallback,
+                                           stage, started)
+        
+        request = self._build_request(prompt, max_tokens, system, temperature, history, model)
+        hedge_after = self.latency.hedge_delay(stage, model, budget) if self.hedging else None
+        
+        abandoned = {}
+        
+        def attempt():
+            return self._attempt_async(request, stage, model, prompt, history, max_tokens, system,
+                                       stop_at_code_end, abandoned)
+        
+        try:
+            content_text, usage, stop_reason = await self._hedged_async(attempt, stage, budget,
+                                                                        hedge_after, abandoned)
+        except (JobCancelled, asyncio.CancelledError):
+            self.breaker.release_trial()
+            raise
+        except Exception as e:
+            self._log_error(e)
+            self.breaker.record_failure()
+            return None
+        
+        self.breaker.record_success()
+        self._record_exchange(request, content_text, usage, stop_reason, started, stage)
+        self._log_response(content_text)
+        if self._cacheable(model, validate, content_text):
+            self._cache_store(cache_key, content_text, max_tokens, model)
+        return content_text
+    
+    async def _attempt_async(self, request, stage, model, prompt, history, max_tokens, system,
+                             stop_at_code_end, abandoned=None):
+        """One async API call with rate limiting, metrics and latency tracking
+        
+        Returns:
+            Tuple of (response text, usage, stop reason)
+        """
+        started = time.time()
+        async with self._semaphore:
+            key_id, reserved, client = None, 0, self.async_client
+            if self.rate_limiter:
+                reserved = self._reservation_size(self._with_history(prompt, history), max_tokens, system)
+                key_id = await self.rate_limiter.acquire_async(reserved)
+                client = self.async_key_clients[key_id]
+            
+            self._in_flight += 1
+            print(f"Sending async prompt to {model} ({len(prompt)} chars, max_tokens={max_tokens}, "
+                  f"{self._in_flight}/{self.max_in_flight} in flight)")
+            try:
+                if stop_at_code_end:
+                    content_text, message, stop_reason = await self._stream_until_code_end_async(
+                        request, client)
+                else:
+                    message = await client.messages.create(**request)
+                    content_text = self._response_text(message)
+                    stop_reason = getattr(message, "stop_reason", None)
+            except asyncio.CancelledError:
+                # Cancelling the task closes the HTTP stream, so generation stops too
+                self._settle_capacity(key_id, reserved)
+                self._record_call(stage, started, stop_reason="cancelled",
+                                  error=(abandoned or {}).get("reason"), model=model)
+                raise
+            except Exception as e:
+                self._settle_capacity(key_id, reserved)
+                self._record_call(stage, started, error=str(e), model=model)
+                raise
+            finally:
+                self._in_flight -= 1
+        
+        usage = self._record_usage(message)
+        self._settle_capacity(key_id, reserved, usage)
+        self.latency.observe(stage, model, time.time() - started)
+        self._record_call(stage, started, usage=usage, stop_reason=stop_reason, model=model)
+        return content_text, usage, stop_reason
+    
+    def _job_cancel_future(self):
+        """Asyncio future on the loop completed once the current job is cancelled, or None"""
+        job_deadline = self.job_deadline
+        if job_deadline is None:
+            return None
+        if self._job_cancel_waiter is None or self._job_cancel_waiter[0] is not job_deadline:
+            # One wrapper per job; never cancelled, as that would cancel the deadline's future
+            self._job_cancel_waiter = (job_deadline, asyncio.wrap_future(job_deadline.future))
+        return self._job_cancel_waiter[1]
+    
+    async def _hedged_async(self, attempt, stage, budget, hedge_after, abandoned=None):
+        """Async version of ManimGenerator._hedged; the losing request is cancelled
+        
+        A cancelled job ends the wait at once: the running requests are
+        cancelled, which closes their HTTP streams, and JobCancelled is raised.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        job_cancel = self._job_cancel_future()
+        job_cancel = {job_cancel} if job_cancel is not None else set()
+        tasks = [asyncio.ensure_future(attempt())]
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    if self.job_deadline is not None:
+                        self.job_deadline.check()
+                    raise self._budget_exceeded(stage, budget, abandoned)
+                hedge_now = hedge_after and len(tasks) == 1
+                wait_for = remaining
+                if hedge_now:
+                    wait_for = min(remaining, max(0.0, hedge_after - (budget - remaining)))
+                done, pending = await asyncio.wait(pending | job_cancel, timeout=wait_for,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                pending -= job_cancel
+                if done & job_cancel:
+                    self.job_deadline.check()
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is not tasks[0]:
+                        self.hedge_wins += 1
+                        print("✓ Hedge request answered first")
+                    return task.result()
+                if not done and hedge_now:
+                    self.hedges += 1
+                    print(f"⚠️ {stage or 'LLM'} call still running after {hedge_after:.1f}s "
+                          f"(historical p95) - sending a hedge request")
+                    tasks.append(asyncio.ensure_future(attempt()))
+                    pending.add(tasks[-1])
+            raise error or self._budget_exceeded(stage, budget, abandoned)
+        finally:
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+    
+    async def _race(self, prompt, accept, temperatures, max_tokens, system, stage):
+        """Coroutine behind race_prompt: first accepted candidate wins, the rest are cancelled"""
+        tasks = {
+            asyncio.ensure_future(self._request(prompt, max_tokens=max_tokens, stop_at_code_end=True,
+                                                system=system, stage=stage,
+                                                temperature=temperature)): temperature
+            for temperature in temperatures
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = self._judge_candidate(task.result(), accept, tasks[task])
+                    if result is not None:
+                        return result, task.result()
+            return None, None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    def race_prompt(self, prompt, accept, candidates=None, max_tokens=None, system=None, stage=None):
+        """Async-client version of ManimGenerator.race_prompt with real cancellation"""
+        temperatures = self._candidate_temperatures(candidates or self.code_candidates)
+        print(f"Racing {len(temperatures)} candidates (temperatures: {temperatures})")
+        loop = self._ensure_loop()
+        result, response = asyncio.run_coroutine_threadsafe(
+            self._race(prompt, accept, temperatures, max_tokens, system, stage), loop
+        ).result()
+        if result is None:
+            print("❌ No candidate passed validation")
+        return result, response
+    
+    async def send_prompt(self, prompt, max_tokens=None, use_cache=True, stop_at_code_end=False,
+                          system=None, stage=None, temperature=None, history=None, model=None,
+                          validate=None, fallback=None):
+        """Await a prompt from any event loop, respecting the shared limiter"""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._request(prompt, max_tokens=max_tokens, use_cache=use_cache,
+                          stop_at_code_end=stop_at_code_end, system=system, stage=stage,
+                          temperature=temperature, history=history, model=model,
+                          validate=validate, fallback=fallback),
+            loop
+        )
+        return await asyncio.wrap_future(future)
+    
+    async def gather_prompts(self, prompts, max_tokens=None, stage=None):
+        """Send independent prompts concurrently and return responses in order"""
+        return await asyncio.gather(*(
+            self.send_prompt(prompt, max_tokens=max_tokens, stage=stage) for prompt in prompts
+        ))
+    
+    def _send_prompt(self, prompt, max_tokens=None, use_cache=True, stop_at_code_end=False,
+                     system=None, stage=None, temperature=None, history=None, model=None,
+                     validate=None, fallback=None):
+        """Blocking bridge so existing callbacks can use the async client"""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._request(prompt, max_tokens=max_tokens, use_cache=use_cache,
+                          stop_at_code_end=stop_at_code_end, system=system, stage=stage,
+                          temperature=temperature, history=history, model=model,
+                          validate=validate, fallback=fallback),
+            loop
+        )
+        return future.result()
+    
+    def close(self):
+        """Stop the background event loop"""
+        with self._loop_lock:
+            if self._loop is not None:
+                for client in [self.async_client, *self.async_key_clients.values()]:
+                    asyncio.run_coroutine_threadsafe(client.close(), self._loop).result()
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop_thread.join(timeout=5)
+                self._loop = None
+                self._loop_thread = None
@@ -0,0 +1,167 @@
+import time
+import concurrent.futures
+
+
+class StageError(Exception):
+    """Raised by a stage to stop the pipeline with a readable error message."""
+    pass
+
+
+class StageGraph:
+    """A generation pipeline declared as a DAG of stages.
+
+    Each stage names the values it reads (``inputs``) and the values it
+    produces (``outputs``). ``run`` starts every stage whose inputs are
+    available in its own thread, so stages without a data dependency on each
+    other - e.g. the concept, design and code prompts - overlap, and the
+    pipeline takes as long as its critical path rather than the sum of all
+    stages.
+
+    A stage function is called with its inputs as keyword arguments and
+    returns its single output, or a dict when it declares several outputs.
+
+    With a ``checkpoint`` (a job_checkpoint.JobCheckpoint) every finished
+    stage's outputs are saved immediately, and stages already checkpointed by
+    an earlier run of the job are loaded instead of run again.
+
+    ``emit`` is called as ``emit(event, stage=..., ...)`` with the
+    ``stage_started``, ``stage_finished`` and ``stage_failed`` events, and
+    ``cancelled`` is polled between stages: once it returns True no further
+    stage starts and ``run`` raises StageError.
+    """
+
+    def __init__(self, name="pipeline", max_workers=None, checkpoint=None, emit=None, cancelled=None):
+        self.name = name
+        self.max_workers = max_workers
+        self.checkpoint = checkpoint
+        self.emit = emit
+        self.cancelled = cancelled
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name, func, inputs=(), outputs=None):
+        """Declare a stage.
+
+        Args:
+            name: Stage name, used in logs and timings
+            func: Callable taking the inputs as keyword arguments
+            inputs: Names of the values the stage reads
+            outputs: Names of the values it produces (default: the stage name)
+        """
+        outputs = tuple(outputs or (name,))
+        for stage in self.stages.values():
+            clash = set(stage["outputs"]) & set(outputs)
+            if clash:
+                raise ValueError(f"Stage '{name}' redeclares outputs {sorted(clash)} of '{stage['name']}'")
+        self.stages[name] = {"name": name, "func": func, "inputs": tuple(inputs), "outputs": outputs}
+        return self
+
+    def _check(self, available):
+        produced = set(available)
+        for stage in self.stages.values():
+            produced.update(stage["outputs"])
+        for stage in self.stages.values():
+            missing = set(stage["inputs"]) - produced
+            if missing:
+                raise ValueError(f"Stage '{stage['name']}' needs {sorted(missing)}, which nothing produces")
+
+    def _run_stage(self, stage, inputs):
+        started = time.time()
+        try:
+            result = stage["func"](**inputs)
+        finally:
+            self.timings[stage["name"]] = (started, time.time())
+        if len(stage["outputs"]) == 1:
+            return {stage["outputs"][0]: result}
+        missing = [key for key in stage["outputs"] if key not in (result or {})]
+        if missing:
+            raise StageError(f"Stage '{stage['name']}' did not produce {missing}")
+        return {key: result[key] for key in stage["outputs"]}
+
+    def run(self, **initial):
+        """Run every stage as soon as its inputs are ready.
+
+        Args:
+            **initial: Values available before any stage runs (e.g. the topic)
+
+        Returns:
+            Dictionary with the initial values and every stage output
+
+        Raises:
+            StageError: The first stage failure, once the stages already
+                running have finished. Stages depending on it never start.
+        """
+        self._check(initial)
+        values = dict(initial)
+        waiting = dict(self.stages)
+        if self.checkpoint is not None:
+            for name in list(waiting):
+                if self.checkpoint.has(name):
+                    values.update(self.checkpoint.load(name))
+                    del waiting[name]
+                    print(f"✓ Stage '{name}' restored from checkpoint")
+                    self._emit("stage_finished", stage=name, seconds=0.0, restored=True)
+        running = {}
+        error = None
+        started = time.time()
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers or max(1, len(self.stages)),
+            thread_name_prefix=f"{self.name}-stage"
+        )
+        try:
+            while waiting or running:
+                if error is None and waiting and self.cancelled is not None and self.cancelled():
+                    error = StageError("Job cancelled")
+                    print(f"⚠️ {self.name} cancelled before stages {sorted(waiting)}")
+                if error is None:
+                    ready = [stage for stage in waiting.values()
+                             if all(key in values for key in stage["inputs"])]
+                    for stage in ready:
+                        del waiting[stage["name"]]
+                        inputs = {key: values[key] for key in stage["inputs"]}
+                        self._emit("stage_started", stage=stage["name"])
+                        running[executor.submit(self._run_stage, stage, inputs)] = stage["name"]
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e if isinstance(e, StageError) else StageError(f"{name}: {e}")
+                            print(f"❌ Stage '{name}' failed: {e}")
+                        self._emit("stage_failed", stage=name, error=str(e))
+                        continue
+                    values.update(outputs)
+                    start, end = self.timings[name]
+                    self._emit("stage_finished", stage=name, seconds=round(end - start, 3))
+                    if self.checkpoint is not None:
+                        try:
+                            self.checkpoint.save(name, outputs)
+                        except (OSError, TypeError) as e:
+                            print(f"⚠️ Could not checkpoint stage '{name}': {e}")
+        finally:
+            executor.shutdown(wait=True)
+
+        self._print_timings(time.time() - started)
+        if error is not None:
+            raise error
+        if waiting:
+            raise StageError(f"Stages {sorted(waiting)} never became ready")
+        return values
+
+    def _emit(self, event, **data):
+        if self.emit is not None:
+            self.emit(event, **data)
+
+    def _print_timings(self, wall_time):
+        if not self.timings:
+            return
+        origin = min(start for start, _ in self.timings.values())
+        total = sum(end - start for start, end in self.timings.values())
+        print(f"\n{self.name} stages ({wall_time:.1f}s wall time, {total:.1f}s if run in sequence):")
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            print(f"  {name:<22} {start - origin:6.1f}s -> {end - origin:6.1f}s")
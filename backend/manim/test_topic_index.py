@@ -0,0 +1,82 @@
+import os
+
+from topic_index import TopicIndex
+
+
+def make_index(tmp_path):
+    code_dir = tmp_path / "code_dir"
+    videos_dir = tmp_path / "videos_dir"
+    code_dir.mkdir()
+    videos_dir.mkdir()
+    return TopicIndex(str(code_dir), str(videos_dir), index_path=str(tmp_path / "index.json"))
+
+
+def add_topic(index, topic, problem_type=None, artifacts=()):
+    """Register a topic with an empty code file and the named artifact files."""
+    code_path = os.path.join(index.code_dir, f"{topic.replace(' ', '_')}.py")
+    open(code_path, 'w').close()
+    artifacts_dir = os.path.join(index.videos_dir, f"{topic.replace(' ', '_')}_artifacts")
+    os.makedirs(artifacts_dir, exist_ok=True)
+    for name in artifacts:
+        with open(os.path.join(artifacts_dir, name), 'w') as f:
+            f.write("content")
+    index.register(topic, code_path, artifacts_dir=artifacts_dir, problem_type=problem_type)
+
+
+def matched_topic(index, topic, **kwargs):
+    entry, _ = index.find(topic, **kwargs)
+    return entry["topic"] if entry else None
+
+
+def test_near_duplicate_topics_match(tmp_path):
+    index = make_index(tmp_path)
+    add_topic(index, "eigenvalues")
+    add_topic(index, "eigenvalue and eigenvectors")
+    assert matched_topic(index, "eigen values") == "eigenvalues"
+    assert matched_topic(index, "Eigenvalues and eigenvectors") == "eigenvalue and eigenvectors"
+    assert matched_topic(index, "eigenvectors and eigenvalues") == "eigenvalue and eigenvectors"
+
+
+def test_broader_topic_serves_narrower_request(tmp_path):
+    index = make_index(tmp_path)
+    add_topic(index, "Eigenvalues and eigenvectors")
+    assert matched_topic(index, "eigen values") == "Eigenvalues and eigenvectors"
+
+
+def test_narrower_topic_does_not_serve_broader_request(tmp_path):
+    index = make_index(tmp_path)
+    add_topic(index, "eigenvalues")
+    assert matched_topic(index, "Eigenvalues and eigenvectors") is None
+    assert matched_topic(index, "eigendecomposition") is None
+
+
+def test_exercises_with_different_numbers_do_not_match(tmp_path):
+    index = make_index(tmp_path)
+    add_topic(index, "Find the projection of vector (1,2) onto (3,4)")
+    add_topic(index, "determinant of [[1,2],[3,4]]")
+    add_topic(index, "derivative of x^2")
+    assert matched_topic(index, "Find the projection of vector (1,2) onto (3,5)") is None
+    assert matched_topic(index, "determinant of [[2,2],[3,4]]") is None
+    assert matched_topic(index, "derivative of x^3") is None
+    assert matched_topic(index, "Derivative of x^2") == "derivative of x^2"
+
+
+def test_required_artifacts_and_problem_type_filter(tmp_path):
+    index = make_index(tmp_path)
+    add_topic(index, "dot product", problem_type="concept", artifacts=["animation_design.txt"])
+    assert matched_topic(index, "dot product", problem_type="ic") is None
+    assert matched_topic(index, "dot product",
+                         requires=("scene_plan.txt", "key_takeaways.txt")) is None
+    add_topic(index, "dot products", problem_type="ic",
+              artifacts=["scene_plan.txt", "key_takeaways.txt"])
+    assert matched_topic(index, "dot product", problem_type="ic",
+                         requires=("scene_plan.txt", "key_takeaways.txt")) == "dot products"
+
+
+def test_concurrent_indexes_keep_each_others_entries(tmp_path):
+    first = make_index(tmp_path)
+    second = TopicIndex(first.code_dir, first.videos_dir, index_path=first.index_path)
+    add_topic(first, "dot product")
+    add_topic(second, "cross product")
+    reloaded = TopicIndex(first.code_dir, first.videos_dir, index_path=first.index_path)
+    assert sorted(entry["topic"] for entry in reloaded.entries) == ["cross product", "dot product"]
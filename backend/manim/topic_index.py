@@ -0,0 +1,288 @@
+import os
+import re
+import json
+import time
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent jobs may drop each other's entries
+    fcntl = None
+
+CONTENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content")
+DEFAULT_INDEX_PATH = os.path.join(CONTENT_DIR, "topic_index.json")
+# Tuned on the request examples: "eigen values" reaches exactly 0.75 against
+# "Eigenvalues and eigenvectors", a broader topic than the request
+DEFAULT_THRESHOLD = 0.75
+
+# Words that do not change which animation a request needs
+STOPWORDS = {
+    "a", "an", "and", "the", "of", "to", "in", "on", "for", "with", "by", "its", "their",
+    "what", "is", "are", "how", "why", "explain", "explaining", "show", "visualize",
+    "visualization", "introduction", "intro", "basics", "understanding", "ic", "generated",
+}
+
+# Words that end in "s" in their base form
+_KEEP_S = {"basis", "analysis", "axis", "calculus", "series", "radius", "gauss", "bayes",
+           "mathematics", "physics", "statistics", "locus", "modulus", "hypothesis"}
+
+# Numbers, single-letter variables and operators: an exercise is only the same
+# exercise if all of them match ("x^2" and "x^3" are different problems)
+_SYMBOLS = re.compile(r"\d+(?:\.\d+)?|(?<![a-z0-9])[b-hj-z](?![a-z])|[+*/^=<>!|]"
+                      r"|(?<![a-z])-|-(?![a-z])")
+
+
+def lemmatize(word):
+    """Reduce a lowercase word to a rough singular base form (no dictionary needed)."""
+    if word in _KEEP_S or len(word) <= 3:
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize_topic(topic):
+    """Return the lemmas of the meaningful words in a topic, in their original order."""
+    words = re.findall(r"[a-z0-9]+", topic.lower().replace("_", " "))
+    return list(dict.fromkeys(lemmatize(word) for word in words if word not in STOPWORDS))
+
+
+def topic_symbols(topic):
+    """Numbers, variables and operators of a topic, in order (e.g. ['x', '^', '2'])."""
+    return _SYMBOLS.findall(topic.lower().replace("_", " "))
+
+
+def _join_compounds(tokens, vocabulary):
+    # "eigen value" -> "eigenvalue" when the other topic spells it as one word
+    joined, i = [], 0
+    while i < len(tokens):
+        if i + 1 < len(tokens) and tokens[i] + tokens[i + 1] in vocabulary:
+            joined.append(tokens[i] + tokens[i + 1])
+            i += 2
+        else:
+            joined.append(tokens[i])
+            i += 1
+    return set(joined)
+
+
+def similarity(tokens, symbols, entry):
+    """Score a request against an index entry.
+
+    Topics whose numbers, variables or operators differ score 0. Otherwise the
+    score averages the word-set overlap (Jaccard) with the share of the
+    request's words the entry covers, so reordered words match fully and a
+    broader indexed topic can serve a narrower request, but not the other way
+    round. Words split differently ("eigen values", "eigenvalues") are joined
+    before comparing.
+
+    Args:
+        tokens: normalize_topic() of the request
+        symbols: topic_symbols() of the request
+        entry: Index entry
+
+    Returns:
+        Similarity between 0 and 1
+    """
+    if symbols != topic_symbols(entry["topic"]):
+        return 0.0
+    other_tokens = entry.get("tokens", [])
+    words = _join_compounds(tokens, set(other_tokens))
+    other_words = _join_compounds(other_tokens, words)
+    if not words or not other_words:
+        return 0.0
+    shared = len(words & other_words)
+    return (shared / len(words | other_words) + shared / len(words)) / 2
+
+
+class TopicIndex:
+    """Local index of topics that already have generated code and videos.
+
+    Entries come from two places: pipelines ``register`` every topic they
+    render, and ``refresh`` picks up code files in ``code_dir`` that no
+    pipeline registered (their topic is read from the file name). Each entry
+    keeps its normalized tokens, so ``find`` is a local comparison with no
+    network calls. Every change re-reads the index under a file lock before
+    writing it, so concurrent jobs do not drop each other's entries.
+    """
+
+    def __init__(self, code_dir, videos_dir, index_path=None, threshold=None):
+        self.code_dir = code_dir
+        self.videos_dir = videos_dir
+        self.index_path = index_path or os.getenv("MANIM_TOPIC_INDEX") or DEFAULT_INDEX_PATH
+        if threshold is None:
+            threshold = float(os.getenv("MANIM_TOPIC_MATCH_THRESHOLD", DEFAULT_THRESHOLD))
+        self.threshold = threshold
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f).get("entries", [])
+        except (OSError, ValueError):
+            return []
+        # Entries saved by an older normalization are compared with the current one
+        for entry in entries:
+            entry["tokens"] = normalize_topic(entry["topic"])
+            entry.pop("signature", None)
+        return entries
+
+    @contextlib.contextmanager
+    def _update(self):
+        """Reload the entries under the index lock, then save them after the block."""
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with open(self.index_path + ".lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.entries = self._load()
+            yield
+            self.save()
+
+    def save(self):
+        """Write the index atomically."""
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"entries": self.entries}, f, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _make_entry(self, topic, code_path, video_path=None, artifacts_dir=None,
+                    macro_topic=None, problem_type=None, source="pipeline"):
+        tokens = normalize_topic(topic)
+        return {
+            "topic": topic,
+            "tokens": tokens,
+            "code_path": os.path.abspath(code_path),
+            "video_path": os.path.abspath(video_path) if video_path else None,
+            "artifacts_dir": os.path.abspath(artifacts_dir) if artifacts_dir else None,
+            "macro_topic": macro_topic,
+            "problem_type": problem_type,
+            "source": source,
+            "created_at": time.time(),
+        }
+
+    def register(self, topic, code_path, video_path=None, artifacts_dir=None,
+                 macro_topic=None, problem_type=None):
+        """Add or replace the entry for a rendered topic and save the index.
+
+        Args:
+            topic: Topic as requested by the user
+            code_path: Generated code file
+            video_path: Rendered video, if rendering succeeded
+            artifacts_dir: Directory with the design, scene plan or key takeaways
+            macro_topic: Macro topic of the request (optional)
+            problem_type: Problem type of the request (optional)
+        """
+        code_path = os.path.abspath(code_path)
+        with self._update():
+            self.entries = [entry for entry in self.entries if entry["code_path"] != code_path]
+            self.entries.append(self._make_entry(topic, code_path, video_path, artifacts_dir,
+                                                 macro_topic, problem_type))
+
+    def _video_for(self, stem):
+        # main_test_ic renders <topic>_ic.py to <topic>_animation_ic.mp4
+        base = stem[:-3] if stem.endswith("_ic") else stem
+        candidates = [f"{base}_animation_ic.mp4", f"{stem}_animation.mp4", f"{base}_animation.mp4"]
+        for name in candidates:
+            path = os.path.join(self.videos_dir, name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def refresh(self):
+        """Sync the index with code_dir: drop missing files, add unregistered ones.
+
+        Returns:
+            Number of entries added
+        """
+        added = 0
+        with self._update():
+            self.entries = [entry for entry in self.entries if os.path.exists(entry["code_path"])]
+            known = {entry["code_path"] for entry in self.entries}
+            if os.path.isdir(self.code_dir):
+                for name in sorted(os.listdir(self.code_dir)):
+                    path = os.path.abspath(os.path.join(self.code_dir, name))
+                    if not name.endswith(".py") or path in known:
+                        continue
+                    stem = name[:-3]
+                    artifacts_dir = os.path.join(self.videos_dir, f"{stem}_artifacts")
+                    topic = re.sub(r"(^generated_|_ic$)", "", stem).replace("_", " ")
+                    # main_test_ic names its files <topic>_ic.py; other pipelines' files match any type
+                    self.entries.append(self._make_entry(
+                        topic, path, self._video_for(stem),
+                        artifacts_dir if os.path.isdir(artifacts_dir) else None,
+                        problem_type="ic" if stem.endswith("_ic") else None, source="code_dir"
+                    ))
+                    added += 1
+            for entry in self.entries:
+                if entry["video_path"] and not os.path.exists(entry["video_path"]):
+                    entry["video_path"] = None
+        return added
+
+    def find(self, topic, macro_topic=None, problem_type=None, threshold=None, requires=()):
+        """Return the closest indexed topic at or above the threshold.
+
+        Entries registered for another macro topic or problem type are skipped;
+        entries found in code_dir carry neither (except "ic" for main_test_ic
+        files) and match any request.
+
+        Args:
+            topic: Requested topic
+            macro_topic: Only match entries of this macro topic (optional)
+            problem_type: Only match entries of this problem type (optional)
+            threshold: Minimum similarity (default: the index threshold)
+            requires: Artifact file names the caller reuses; entries missing
+                any of them are skipped
+
+        Returns:
+            Tuple (entry, score), or (None, best score) when nothing is close enough
+        """
+        threshold = self.threshold if threshold is None else threshold
+        tokens = normalize_topic(topic)
+        symbols = topic_symbols(topic)
+        best, best_score = None, 0.0
+        for entry in self.entries:
+            if macro_topic and entry.get("macro_topic") not in (None, macro_topic):
+                continue
+            if problem_type and entry.get("problem_type") not in (None, problem_type):
+                continue
+            if any(not self.read_artifact(entry, name) for name in requires):
+                continue
+            score = similarity(tokens, symbols, entry)
+            if score > best_score:
+                best, best_score = entry, score
+        if best is None or best_score < threshold:
+            return None, best_score
+        return best, best_score
+
+    @staticmethod
+    def read_artifact(entry, name):
+        """Return the text of an artifact saved next to an entry's video, or ''."""
+        if not entry.get("artifacts_dir"):
+            return ""
+        try:
+            with open(os.path.join(entry["artifacts_dir"], name), 'r') as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def lookup(self, topic, macro_topic=None, problem_type=None, requires=()):
+        """Refresh the index and print the outcome of ``find`` for a request."""
+        self.refresh()
+        entry, score = self.find(topic, macro_topic, problem_type, requires=requires)
+        if entry:
+            print(f"✓ Topic '{topic}' matches indexed topic '{entry['topic']}' "
+                  f"(similarity {score:.2f} >= {self.threshold:.2f})")
+        else:
+            print(f"No indexed topic close to '{topic}' (best similarity {score:.2f}, "
+                  f"threshold {self.threshold:.2f})")
+        return entry
@@ -0,0 +1,411 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from dotenv import load_dotenv
+
+# Importing the pipeline loads the prompt templates and manim once for the
+# lifetime of the service instead of once per request
+from generate_video_exercise import VideoGenerator
+from main_exercise import build_parser, apply_resume, run_job
+from job_checkpoint import JobCheckpoint
+from job_queue import JobQueue
+from job_lock import coalesce_key
+from event_stream import SKIPPED_EVENTS
+from job_deadline import JobDeadline
+
+DEFAULT_PORT = 4100
+
+# Seconds an idle worker waits before checking the queue again
+POLL_SECONDS = 1.0
+
+# Times a worker tries to store a finished job's result before giving up
+FINISH_ATTEMPTS = 5
+
+# Job fields and the main_exercise option each one maps to
+JOB_OPTIONS = {
+    "topic": "--topic",
+    "macro_topic": "--macro-topic",
+    "problem_type": "--problem-type",
+    "server_url": "--server-url",
+    "similarity_threshold": "--similarity-threshold",
+    "resume": "--resume",
+    "timeout": "--timeout",
+}
+JOB_FLAGS = {
+    "regenerate": "--regenerate",
+}
+
+
+def job_args(job):
+    """Turn a JSON job into main_exercise options, validated by the same parser.
+
+    Raises:
+        ValueError: The job has unknown fields or invalid values
+    """
+    unknown = set(job) - set(JOB_OPTIONS) - set(JOB_FLAGS)
+    if unknown:
+        raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+    argv = []
+    for field, option in JOB_OPTIONS.items():
+        if job.get(field) is not None:
+            argv.extend([option, str(job[field])])
+    argv.extend(option for field, option in JOB_FLAGS.items() if job.get(field))
+
+    parser = build_parser()
+    # argparse reports bad options by exiting; a service has to answer instead
+    parser.error = _raise_value_error
+    return parser.parse_args(argv)
+
+
+def _raise_value_error(message):
+    raise ValueError(message)
+
+
+class WorkerPool:
+    """Fixed pool of generation workers, each with its own resident VideoGenerator.
+
+    Every worker thread builds its generator (API client, response cache,
+    rate limiter) once at startup and reuses it for every job it runs, so a
+    job starts generating immediately. Jobs wait in the persistent JobQueue
+    until a worker claims them, oldest first, and every stage event of a
+    running job is appended to its event log.
+    """
+
+    def __init__(self, size, generator_options, job_queue):
+        self.size = size
+        self.generator_options = generator_options
+        self.queue = job_queue
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.ready = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._done = {}
+        self._deadlines = {}
+        self._threads = []
+
+    def start(self):
+        for number in range(self.size):
+            thread = threading.Thread(target=self._work, name=f"generation-worker-{number + 1}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        video_gen = VideoGenerator(**self.generator_options)
+        with self._lock:
+            self.ready += 1
+        while True:
+            try:
+                claimed = self.queue.claim()
+            except Exception as e:
+                # A busy or briefly unavailable database must not end the worker
+                print(f"⚠️ Could not claim a job: {e}")
+                claimed = None
+            if claimed is None:
+                # Jobs submitted by another process are picked up on the next poll
+                with self._wake:
+                    self._wake.wait(timeout=POLL_SECONDS)
+                continue
+            job_id, params = claimed
+            with self._lock:
+                self.busy += 1
+            started = time.time()
+            try:
+                result = self._run(video_gen, job_id, params)
+            except Exception as e:
+                traceback.print_exc()
+                result = {"success": False, "video_path": None, "error": str(e),
+                          "job_id": job_id, "reused": False}
+            result["duration"] = round(time.time() - started, 3)
+            self._finish(job_id, result)
+            with self._lock:
+                self.busy -= 1
+                self.completed += 1
+                if not result.get("success"):
+                    self.failed += 1
+            self.notify_finished(job_id)
+
+    def _finish(self, job_id, result):
+        """Store a job's result, retrying while the database is busy.
+
+        Returns:
+            True if the result was stored
+        """
+        for attempt in range(1, FINISH_ATTEMPTS + 1):
+            try:
+                self.queue.finish(job_id, result)
+                return True
+            except Exception as e:
+                print(f"⚠️ Could not store the result of job {job_id} "
+                      f"(attempt {attempt}/{FINISH_ATTEMPTS}): {e}")
+                time.sleep(POLL_SECONDS * attempt)
+        # Left running, so the next service start requeues it from its checkpoints
+        print(f"❌ Job {job_id} stays running until the service restarts")
+        return False
+
+    def _run(self, video_gen, job_id, params):
+        args = job_args(params)
+        checkpoint = apply_resume(args) or JobCheckpoint.open(job_id, {
+            "topic": args.topic,
+            "macro_topic": args.macro_topic,
+            "problem_type": args.problem_type,
+        })
+
+        def record(payload):
+            event = payload["event"]
+            if event not in SKIPPED_EVENTS:
+                self.queue.progress(job_id, event, {k: v for k, v in payload.items() if k != "event"})
+
+        deadline = JobDeadline.start(args.timeout)
+        with self._lock:
+            self._deadlines[job_id] = deadline
+        try:
+            # A cancel that arrived between claiming and starting the job
+            if self.queue.cancel_requested(job_id):
+                deadline.cancel()
+            return run_job(args, video_gen, checkpoint, progress=record, deadline=deadline)
+        finally:
+            with self._lock:
+                self._deadlines.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """Cancel a job; a running one stops its LLM calls and render at once.
+
+        Returns:
+            The job's status afterwards, or None for an unknown job
+        """
+        status = self.queue.cancel(job_id)
+        if status == "running":
+            with self._lock:
+                deadline = self._deadlines.get(job_id)
+            if deadline is not None:
+                deadline.cancel()
+        elif status == "cancelled":
+            self.notify_finished(job_id)
+        return status
+
+    def submit(self, params):
+        """Queue a validated job and wake an idle worker.
+
+        Returns:
+            Tuple (job_id, coalesced)
+        """
+        args = job_args(params)
+        apply_resume(args)
+        job_id, coalesced = self.queue.submit(
+            params, coalesce_key(args.topic, args.macro_topic, args.problem_type)
+        )
+        with self._wake:
+            self._wake.notify()
+        return job_id, coalesced
+
+    def notify_finished(self, job_id):
+        with self._lock:
+            done = self._done.pop(job_id, None)
+        if done is not None:
+            done.set()
+
+    def wait(self, job_id):
+        """Block until the job finished and return its status."""
+        with self._lock:
+            done = self._done.setdefault(job_id, threading.Event())
+        job = self.queue.status(job_id)
+        if not job["finished"]:
+            done.wait()
+            job = self.queue.status(job_id)
+        return job
+
+    def health(self):
+        """Liveness and load of the pool, served on GET /health."""
+        alive = sum(1 for thread in self._threads if thread.is_alive())
+        counts = self.queue.counts()
+        with self._lock:
+            return {
+                "status": "ok" if alive == self.size and self.ready == self.size else "degraded",
+                "pool_size": self.size,
+                "workers_alive": alive,
+                "workers_ready": self.ready,
+                "busy": self.busy,
+                "queued": counts.get("queued", 0),
+                "completed": self.completed,
+                "failed": self.failed,
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "manim_loaded": "manim" in sys.modules,
+            }
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    """JSON job protocol of the worker service.
+
+    GET  /health                  pool status
+    POST /jobs                    queue a job, e.g. {"topic": ..., "macro_topic": ..., "problem_type": ...},
+                                  and answer 202 with its job_id; with ?wait=1 answer with
+                                  the result once it finished
+    GET  /jobs/<id>               status, phase, stage and progress of a job
+    GET  /jobs/<id>/events?after=N  events of a job after sequence number N
+    GET  /jobs/<id>/result        result of a finished job (409 while it runs)
+    POST /jobs/<id>/cancel        cancel a queued or running job
+    """
+
+    pool = None
+
+    def log_message(self, format, *args):
+        print(f"[worker] {self.address_string()} {format % args}")
+
+    def _send_json(self, status, body):
+        encoded = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            self._send_json(400, {"success": False, "error": "Request body must be a JSON object"})
+            return None
+        return body
+
+    def _route(self):
+        url = urlparse(self.path)
+        return url.path.rstrip("/").split("/")[1:], parse_qs(url.query)
+
+    def _job(self, job_id):
+        job = self.pool.queue.status(job_id)
+        if job is None:
+            self._send_json(404, {"success": False, "error": f"Unknown job '{job_id}'"})
+        return job
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ["health"]:
+            health = self.pool.health()
+            self._send_json(200 if health["status"] == "ok" else 503, health)
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self._job(parts[1])
+            if job:
+                self._send_json(200, job)
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            job = self._job(parts[1])
+            if job:
+                try:
+                    after = int(query.get("after", ["0"])[0])
+                except ValueError:
+                    after = 0
+                self._send_json(200, {"job_id": job["id"], "status": job["status"],
+                                      "finished": job["finished"],
+                                      "events": self.pool.queue.events(job["id"], after)})
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+            job = self._job(parts[1])
+            if job and not job["finished"]:
+                self._send_json(409, {"success": False, "error": f"Job is {job['status']}",
+                                      "status": job["status"]})
+            elif job:
+                self._send_json(200, job["result"] or {"success": False, "error": f"Job {job['status']}"})
+        else:
+            self._send_json(404, {"success": False, "error": "Unknown path"})
+
+    def do_POST(self):
+        parts, query = self._route()
+        if parts == ["jobs"]:
+            body = self._read_json()
+            if body is None:
+                return
+            try:
+                job_id, coalesced = self.pool.submit(body)
+            except (ValueError, FileNotFoundError) as e:
+                self._send_json(400, {"success": False, "error": str(e)})
+                return
+            if query.get("wait", ["0"])[0] in ("1", "true"):
+                job = self.pool.wait(job_id)
+                self._send_json(200, job["result"] or {"success": False, "error": f"Job {job['status']}",
+                                                       "job_id": job_id})
+            else:
+                self._send_json(202, {"success": True, "job_id": job_id, "coalesced": coalesced})
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            status = self.pool.cancel(parts[1])
+            if status is None:
+                self._send_json(404, {"success": False, "error": f"Unknown job '{parts[1]}'"})
+                return
+            self._send_json(200, {"success": True, "job_id": parts[1], "status": status})
+        else:
+            self._send_json(404, {"success": False, "error": "Unknown path"})
+
+
+def serve(pool, host="127.0.0.1", port=DEFAULT_PORT):
+    """Run the worker service until interrupted."""
+    WorkerHandler.pool = pool
+    server = ThreadingHTTPServer((host, port), WorkerHandler)
+    server.daemon_threads = True
+    print(f"Generation worker service with {pool.size} workers on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve generation jobs from resident worker processes")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MANIM_WORKER_PORT", DEFAULT_PORT)),
+                        help=f"Port to listen on (default: MANIM_WORKER_PORT or {DEFAULT_PORT})")
+    parser.add_argument("--pool-size", type=int, default=int(os.getenv("MANIM_WORKER_POOL", "2")),
+                        help="Jobs that run at the same time (default: MANIM_WORKER_POOL or 2)")
+    parser.add_argument("--job-db", type=str, default=None,
+                        help="SQLite job queue (default: MANIM_JOB_DB or content/job_queue.sqlite3)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk LLM response cache")
+    parser.add_argument("--stream-code", action="store_true",
+                        help="Stream code generation responses and stop once the code block is closed")
+    parser.add_argument("--llm-backend", choices=["anthropic", "record", "replay"], default=None,
+                        help="LLM backend (default: MANIM_LLM_BACKEND or anthropic)")
+    parser.add_argument("--code-candidates", type=int, default=None,
+                        help="Code generation candidates raced per job (default: MANIM_CODE_CANDIDATES or 1)")
+    parser.add_argument("--render-repairs", type=int, default=None,
+                        help="Targeted code repairs per failed render (default: MANIM_RENDER_REPAIRS or 2)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv('ANTHROPIC_API_KEY')
+    if args.llm_backend:
+        os.environ["MANIM_LLM_BACKEND"] = args.llm_backend
+    if not api_key and os.getenv("MANIM_LLM_BACKEND") != "replay":
+        print("Error: ANTHROPIC_API_KEY not found in environment variables")
+        return 1
+
+    job_queue = JobQueue(args.job_db)
+    requeued = job_queue.requeue_interrupted()
+    if requeued:
+        print(f"✓ Requeued {requeued} job(s) interrupted by the last shutdown")
+
+    pool = WorkerPool(max(1, args.pool_size), {
+        "api_key": api_key,
+        "use_cache": False if args.no_cache else None,
+        "stream_code": True if args.stream_code else None,
+        "llm_backend": args.llm_backend,
+        "code_candidates": args.code_candidates,
+        "render_repairs": args.render_repairs,
+    }, job_queue)
+    pool.start()
+    serve(pool, args.host, args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
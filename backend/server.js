@@ -9,6 +9,7 @@ import inputRoutes from './routes/input.route.js'
 import feedbackRoutes from './routes/feedback.route.js'
 import fs from 'fs' // For file system operations
 import { spawn } from 'child_process'
+import http from 'http'
 
 // Set up __dirname equivalent for ES modules
 const __filename = fileURLToPath(import.meta.url)
@@ -147,24 +148,17 @@ app.post('/test-endpoint', (req, res) => {
   });
 });
 
-app.post('/generate-video', async (req, res) => {
-  res.setHeader('Content-Type', 'application/json');
-  
-  console.log('\n=== Processing Video Generation Request ===');
-  console.log('Request Body:', req.body);
-  
-  const { topic, macroTopic, problemType } = req.body;
+// Identical generation requests that arrive while a job is running attach to it
+// instead of spawning a second pipeline that would overwrite the same files
+const inFlightJobs = new Map();
 
-  // Validate input
-  if (!topic || !macroTopic || !problemType) {
-    console.log('Validation failed:', { topic, macroTopic, problemType });
-    return res.status(400).json({ 
-      success: false, 
-      error: 'Missing required fields',
-      received: { topic, macroTopic, problemType }
-    });
-  }
+const coalesceKey = (topic, macroTopic, problemType) =>
+  [topic, macroTopic, problemType]
+    .map((value) => String(value).toLowerCase().replace(/[^a-z0-9]+/g, ' ').trim())
+    .join('|');
 
+// Runs main_exercise.py once and resolves with the HTTP status and body to send
+const runVideoGeneration = (topic, macroTopic, problemType) => new Promise((resolve) => {
   try {
     // Log the current working directory
     console.log('Current working directory:', process.cwd());
@@ -176,22 +170,24 @@ app.post('/generate-video', async (req, res) => {
     // Check if script exists
     if (!fs.existsSync(scriptPath)) {
       console.error('Python script not found!');
-      return res.status(500).json({
+      return resolve({ status: 500, body: {
         success: false,
         error: 'Python script not found',
         path: scriptPath
-      });
+      }});
     }
     
     console.log('Python script found, preparing to execute');
 
-    // Prepare command arguments
+    // Prepare command arguments. With --json-events stdout carries one JSON event per
+    // line and the human-readable log goes to stderr.
     const commandArgs = [
       scriptPath,
       '--topic', topic,
       '--macro-topic', macroTopic,
       '--problem-type', problemType,
-      '--server-url', 'http://localhost:4000'
+      '--server-url', 'http://localhost:4000',
+      '--json-events'
     ];
 
     console.log('Executing command:', 'python', commandArgs.join(' '));
@@ -199,83 +195,321 @@ app.post('/generate-video', async (req, res) => {
     // Spawn Python process
     const pythonProcess = spawn('python', commandArgs);
 
-    let outputData = '';
-    let errorData = '';
+    let pendingLine = '';
+    let result = null;
+    // Only the end of the log is kept, for the error details of a failed run
+    let logTail = '';
+
+    const handleEvent = (line) => {
+      if (!line.trim()) return;
+      let event;
+      try {
+        event = JSON.parse(line);
+      } catch (error) {
+        console.warn('Ignoring malformed event line:', line.slice(0, 200));
+        return;
+      }
+      if (event.event === 'result') {
+        result = event;
+      } else if (event.event === 'stage_finished') {
+        console.log(`Stage ${event.stage} finished in ${event.seconds}s`);
+      } else if (event.event === 'stage_started' || event.event === 'stage_failed') {
+        console.log(`Stage ${event.stage} ${event.event === 'stage_failed' ? `failed: ${event.error}` : 'started'}`);
+      }
+    };
 
     pythonProcess.stdout.on('data', (data) => {
-      const output = data.toString();
-      outputData += output;
-      console.log('Python output:', output);
+      const lines = (pendingLine + data.toString()).split('\n');
+      pendingLine = lines.pop();
+      lines.forEach(handleEvent);
     });
 
     pythonProcess.stderr.on('data', (data) => {
-      const error = data.toString();
-      errorData += error;
-      console.error('Python error:', error);
+      const log = data.toString();
+      logTail = (logTail + log).slice(-4000);
+      console.log('Python log:', log);
+    });
+
+    pythonProcess.on('error', (error) => {
+      console.error('Failed to start Python process:', error);
+      resolve({ status: 500, body: {
+        success: false,
+        error: 'Failed to start Python process',
+        details: error.message
+      }});
     });
 
     pythonProcess.on('close', (code) => {
+      handleEvent(pendingLine);
       console.log(`\n=== Python Process Completed ===`);
       console.log('Exit code:', code);
-      console.log('Total output length:', outputData.length);
-      console.log('Total error length:', errorData.length);
-      
-      if (code !== 0) {
-        console.error('Process failed with code:', code);
-        console.error('Error output:', errorData);
-        return res.status(500).json({ 
-          success: false, 
+
+      if (!result) {
+        console.error('Process ended without a result event, code:', code);
+        return resolve({ status: 500, body: {
+          success: false,
           error: 'Python process failed',
-          details: errorData,
+          details: logTail,
           exitCode: code
-        });
+        }});
       }
 
-      try {
-        // Try to find the video path in the output
-        const videoPathMatch = outputData.match(/Video saved to: (.+)/);
-        
-        if (!videoPathMatch) {
-          console.error('No video path found in output');
-          return res.status(500).json({ 
-            success: false, 
-            error: 'Video path not found in output',
-            output: outputData
-          });
-        }
-
-        const videoPath = videoPathMatch[1];
-        console.log('Found video path:', videoPath);
-
-        const videoFileName = path.basename(videoPath);
-        const videoUrl = `/videos-content/${videoFileName}`;
-        
-        console.log('Generated video URL:', videoUrl);
-        console.log('Sending success response');
-
-        return res.json({ 
-          success: true, 
-          videoUrl,
-          message: 'Video generated successfully'
-        });
-      } catch (error) {
-        console.error('Error processing Python output:', error);
-        return res.status(500).json({
+      if (!result.success) {
+        return resolve({ status: 500, body: {
           success: false,
-          error: 'Error processing Python output',
-          details: error.message
-        });
+          error: result.error || 'Video generation failed',
+          jobId: result.job_id,
+          details: logTail
+        }});
       }
+
+      const videoUrl = `/videos-content/${path.basename(result.video_path)}`;
+      console.log('Generated video URL:', videoUrl);
+      return resolve({ status: 200, body: {
+        success: true,
+        videoUrl,
+        message: 'Video generated successfully',
+        reused: result.reused,
+        jobId: result.job_id
+      }});
     });
 
   } catch (error) {
     console.error('Server error:', error);
-    return res.status(500).json({ 
+    resolve({ status: 500, body: { 
       success: false, 
       error: 'Internal server error',
       details: error.message
+    }});
+  }
+});
+
+// Resident Python generation worker (backend/manim/worker_service.py). It keeps the
+// API client and prompt templates loaded, so a job does not pay interpreter start-up.
+// Requests fall back to spawning main_exercise.py while the worker is not reachable.
+const workerUrl = new URL(process.env.MANIM_WORKER_URL || 'http://127.0.0.1:4100');
+
+const startWorkerService = () => {
+  const scriptPath = path.join(process.cwd(), 'backend', 'manim', 'worker_service.py');
+  const worker = spawn('python', [scriptPath, '--port', workerUrl.port || '4100']);
+  worker.stdout.on('data', (data) => console.log('Worker output:', data.toString()));
+  worker.stderr.on('data', (data) => console.error('Worker error:', data.toString()));
+  worker.on('error', (error) => console.error('Failed to start worker service:', error));
+  worker.on('close', (code) => {
+    console.error(`Worker service exited with code ${code}, restarting in 5s`);
+    setTimeout(startWorkerService, 5000);
+  });
+};
+
+const workerRequest = (method, requestPath, body) => new Promise((resolve, reject) => {
+  const payload = body ? JSON.stringify(body) : null;
+  const request = http.request({
+    hostname: workerUrl.hostname,
+    port: workerUrl.port,
+    path: requestPath,
+    method,
+    headers: payload
+      ? { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(payload) }
+      : {}
+  }, (response) => {
+    let data = '';
+    response.on('data', (chunk) => { data += chunk; });
+    response.on('end', () => {
+      try {
+        resolve({ status: response.statusCode, body: JSON.parse(data) });
+      } catch (error) {
+        reject(error);
+      }
+    });
+  });
+  request.on('error', reject);
+  if (payload) request.write(payload);
+  request.end();
+});
+
+const workerJob = (topic, macroTopic, problemType) => ({
+  topic,
+  macro_topic: macroTopic,
+  problem_type: problemType,
+  server_url: 'http://localhost:4000'
+});
+
+// Maps a worker job result to the response shape clients know from /generate-video
+const toClientResult = (result) => (result && result.success
+  ? {
+    success: true,
+    videoUrl: `/videos-content/${path.basename(result.video_path)}`,
+    message: 'Video generated successfully',
+    reused: result.reused,
+    jobId: result.job_id
+  }
+  : {
+    success: false,
+    error: (result && result.error) || 'Worker job failed',
+    jobId: result && result.job_id
+  });
+
+const runInWorker = async (topic, macroTopic, problemType) => {
+  const { status, body } = await workerRequest('POST', '/jobs?wait=1', workerJob(topic, macroTopic, problemType));
+  const failedStatus = status === 400 ? 400 : 500;
+  return { status: status === 200 && body.success ? 200 : failedStatus, body: toClientResult(body) };
+};
+
+const generateVideo = async (topic, macroTopic, problemType) => {
+  try {
+    return await runInWorker(topic, macroTopic, problemType);
+  } catch (error) {
+    // Only fall back when the worker never got the job, or it would run twice
+    if (error.code !== 'ECONNREFUSED') {
+      console.error('Worker request failed:', error);
+      return { status: 500, body: { success: false, error: 'Worker request failed', details: error.message } };
+    }
+    console.warn('Worker service not reachable, spawning main_exercise.py');
+    return runVideoGeneration(topic, macroTopic, problemType);
+  }
+};
+
+app.get('/worker-health', async (req, res) => {
+  try {
+    const { status, body } = await workerRequest('GET', '/health');
+    res.status(status).json(body);
+  } catch (error) {
+    res.status(503).json({ status: 'unreachable', error: error.message });
+  }
+});
+
+app.post('/generate-video', async (req, res) => {
+  res.setHeader('Content-Type', 'application/json');
+  
+  console.log('\n=== Processing Video Generation Request ===');
+  console.log('Request Body:', req.body);
+  
+  const { topic, macroTopic, problemType } = req.body;
+
+  // Validate input
+  if (!topic || !macroTopic || !problemType) {
+    console.log('Validation failed:', { topic, macroTopic, problemType });
+    return res.status(400).json({ 
+      success: false, 
+      error: 'Missing required fields',
+      received: { topic, macroTopic, problemType }
     });
   }
+
+  // By default answer once the video is ready, as before. With ?async=1 answer
+  // with a job id at once; progress then streams from GET /jobs/:id/events.
+  if (req.query.async === '1') {
+    try {
+      const { status, body } = await workerRequest('POST', '/jobs', workerJob(topic, macroTopic, problemType));
+      if (status !== 202) {
+        return res.status(status === 400 ? 400 : 500).json({
+          success: false,
+          error: body.error || 'Worker rejected the job'
+        });
+      }
+      return res.status(202).json({
+        success: true,
+        jobId: body.job_id,
+        coalesced: body.coalesced,
+        statusUrl: `/jobs/${body.job_id}`,
+        eventsUrl: `/jobs/${body.job_id}/events`,
+        resultUrl: `/jobs/${body.job_id}/result`
+      });
+    } catch (error) {
+      if (error.code !== 'ECONNREFUSED') {
+        console.error('Worker request failed:', error);
+        return res.status(500).json({ success: false, error: 'Worker request failed', details: error.message });
+      }
+      console.warn('Worker service not reachable, generating before answering');
+    }
+  }
+
+  const key = coalesceKey(topic, macroTopic, problemType);
+  let job = inFlightJobs.get(key);
+  const coalesced = Boolean(job);
+  if (job) {
+    job.followers += 1;
+    console.log(`Attaching to in-flight job for "${topic}" (${job.followers} waiting)`);
+  } else {
+    job = {
+      followers: 0,
+      promise: generateVideo(topic, macroTopic, problemType)
+        .finally(() => inFlightJobs.delete(key))
+    };
+    inFlightJobs.set(key, job);
+  }
+
+  const { status, body } = await job.promise;
+  return res.status(status).json({ ...body, coalesced });
+});
+
+const proxyWorker = async (res, method, requestPath, transform = (body) => body) => {
+  try {
+    const { status, body } = await workerRequest(method, requestPath);
+    res.status(status).json(status === 200 ? transform(body) : body);
+  } catch (error) {
+    res.status(503).json({ success: false, error: 'Worker service not reachable', details: error.message });
+  }
+};
+
+app.get('/jobs/:id', (req, res) =>
+  proxyWorker(res, 'GET', `/jobs/${encodeURIComponent(req.params.id)}`));
+
+app.get('/jobs/:id/result', (req, res) =>
+  proxyWorker(res, 'GET', `/jobs/${encodeURIComponent(req.params.id)}/result`, toClientResult));
+
+app.post('/jobs/:id/cancel', (req, res) =>
+  proxyWorker(res, 'POST', `/jobs/${encodeURIComponent(req.params.id)}/cancel`));
+
+// Server-sent events with every stage, render percentage and the final result of a job.
+// Event ids are the worker's sequence numbers, so a reconnecting EventSource resumes
+// after the last event it received.
+app.get('/jobs/:id/events', (req, res) => {
+  const jobPath = `/jobs/${encodeURIComponent(req.params.id)}/events`;
+  let after = Number(req.get('Last-Event-ID') || req.query.after || 0) || 0;
+  let closed = false;
+  let timer = null;
+
+  res.writeHead(200, {
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    Connection: 'keep-alive'
+  });
+
+  const send = (type, data, id) => {
+    if (id !== undefined) res.write(`id: ${id}\n`);
+    res.write(`event: ${type}\ndata: ${JSON.stringify(data)}\n\n`);
+  };
+
+  const poll = async () => {
+    try {
+      const { status, body } = await workerRequest('GET', `${jobPath}?after=${after}`);
+      if (closed) return;
+      if (status !== 200) {
+        send('error', body);
+        return res.end();
+      }
+      for (const event of body.events) {
+        after = event.seq;
+        const data = event.type === 'finished' && event.data.result
+          ? { ...event.data, result: toClientResult(event.data.result) }
+          : event.data;
+        send(event.type, { ...data, at: event.created_at }, event.seq);
+        if (event.type === 'finished') return res.end();
+      }
+      timer = setTimeout(poll, 1000);
+    } catch (error) {
+      if (closed) return;
+      send('error', { success: false, error: 'Worker service not reachable', details: error.message });
+      res.end();
+    }
+  };
+
+  req.on('close', () => {
+    closed = true;
+    clearTimeout(timer);
+  });
+  poll();
 });
 
 // 6. Other API routes
@@ -328,6 +562,9 @@ try {
 const PORT = process.env.PORT || 4000
 app.listen(PORT, () => {
     connectDB()
+    if (!process.env.MANIM_WORKER_URL && process.env.MANIM_WORKER_AUTOSTART !== '0') {
+      startWorkerService()
+    }
     console.log(`Server is ready at http://localhost:${PORT}`)
     console.log(`Video files will be served from both directories:`)
     console.log(`- ${videoDir}`)